@@ -8,12 +8,16 @@
 # This cron file deletes old builds and cache entries. It deletes on time and
 # space criterias.
 
-import os, shutil, sqlite3, time
+import os, re, shutil, sqlite3, time
 
 # Local imports
 from config_default import *
 from config import *
 
+# Packages made less than this number of seconds ago are kept even if nothing
+# refers to them yet, as the compilation making them may not be finished
+PACKAGES_MIN_AGE = 3600
+
 def getFolderSize(path):
     """Get the size of a folder recursively."""
     itemList = os.listdir(path)
@@ -31,17 +35,87 @@ def getBuildTime(path):
     """Get the modification time for a build folder."""
     return os.path.getmtime(path)
 
-def getCacheTime(path):
-    """Get the last access time (if available) for a cache folder."""
+def getCacheTimes(database):
+    """Get the last access time of all cache entries from the cache database,
+    indexed by the name of their folder."""
+    cacheTimes = {}
+    for row in database.execute("SELECT id, atime FROM cache WHERE atime IS NOT NULL"):
+        cacheTimes[str(row['id'])] = row['atime']
+    return cacheTimes
+
+def getCacheTime(path, cacheTimes):
+    """Get the last access time (if available) for a cache folder, from the
+    cacheTimes given by getCacheTimes; entries made by older versions have it
+    in their cache.ok file. Folders being made or replaced by another entry
+    have no access time, their modification time is used instead."""
+    folder = os.path.basename(os.path.normpath(path))
+    if cacheTimes.has_key(folder):
+        return cacheTimes[folder]
     try:
         atimeFile = open(os.path.join(path, 'cache.ok'), 'r')
         return float(atimeFile.read())
+    except:
+        pass
+    try:
+        return os.path.getmtime(path)
     except:
         return 0
 
-def pruneDir(path, olderThan, maxSize, timeFunction):
+def removeCacheEntries(database, folders):
+    """Remove from the cache database the entries of the cache folders which
+    are going to be deleted, so that they aren't used anymore."""
+    ids = ','.join(filter(lambda folder: folder.isdigit(), folders))
+    if not ids:
+        return
+    # The entry with the highest id is only marked as incomplete, as SQLite
+    # would give its id, and thus its folder, to the next entry
+    database.execute("UPDATE cache SET files=NULL, report=NULL WHERE id IN (%s)" % ids)
+    database.execute("DELETE FROM cache WHERE id IN (%s) AND id < (SELECT MAX(id) FROM cache)" % ids)
+    database.commit()
+
+def getPackagesUsed(folders):
+    """Get the names of the packages of CFG_PACKAGESDIR referenced by the
+    executables (scripts named *.exe) in folders."""
+    packageRe = re.compile(re.escape(os.path.join(CFG_PACKAGESDIR, '')) + '([0-9a-f]{32})')
+    packagesUsed = set()
+    for folder in folders:
+        for (dirpath, dirnames, filenames) in os.walk(folder):
+            for f in filenames:
+                if f[-4:] != '.exe':
+                    continue
+                try:
+                    exeFile = open(os.path.join(dirpath, f), 'r')
+                    if exeFile.read(2) != '#!':
+                        continue
+                    packagesUsed.update(packageRe.findall(exeFile.read()))
+                except:
+                    pass
+    return packagesUsed
+
+def prunePackages(packagesUsed):
+    """Delete the packages not in packagesUsed."""
+    try:
+        packages = os.listdir(CFG_PACKAGESDIR)
+    except:
+        return
+    for package in packages:
+        packagePath = os.path.join(CFG_PACKAGESDIR, package)
+        if (package not in packagesUsed
+                and os.path.getmtime(packagePath) < time.time() - PACKAGES_MIN_AGE):
+            shutil.rmtree(packagePath, ignore_errors=True)
+
+def prunePrecompiledHeaders():
+    """Delete the precompiled headers of CFG_PCHDIR unused for
+    CFG_PCH_MAXTIME, then the oldest ones until they take less than
+    CFG_PCH_MAXSIZE."""
+    if os.path.isdir(CFG_PCHDIR):
+        pruneDir(CFG_PCHDIR, time.time()-CFG_PCH_MAXTIME, CFG_PCH_MAXSIZE, os.path.getmtime)
+
+def pruneDir(path, olderThan, maxSize, timeFunction, beforeDelete=None):
     """Prune a folder, deleting all folders older than a specific time, and
-    then deleting oldest folders until the size criteria is satisfied."""
+    then deleting oldest folders until the size criteria is satisfied.
+    beforeDelete, if given, is called with the list of folders to delete
+    before deleting them."""
     delList = []
     infoList = []
     totalSize = 0
@@ -66,25 +140,44 @@ def pruneDir(path, olderThan, maxSize, timeFunction):
         totalSize -= folderSize
 
     # Delete the folders
+    if beforeDelete:
+        beforeDelete(delList)
     for folder in delList:
-        shutil.rmtree(os.path.join(path, folder))
+        shutil.rmtree(os.path.join(path, folder), ignore_errors=True)
 
     # Return the remaining folders
     return infoList
 
+def pruneCache(database):
+    """Prune the cache folders, removing their entries from the cache
+    database before deleting them."""
+    cacheTimes = getCacheTimes(database)
+    # Entries added after this point may not have their folder yet
+    maxId = database.execute("SELECT MAX(id) FROM cache").fetchone()[0] or 0
+    infoCache = pruneDir(CFG_CACHEDIR, time.time()-CFG_CACHE_MAXTIME, CFG_CACHE_MAXSIZE,
+        lambda path: getCacheTime(path, cacheTimes),
+        beforeDelete=lambda folders: removeCacheEntries(database, folders))
+
+    # Clean the entries without a folder from the cache database
+    foldersCache = filter(lambda folder: folder.isdigit(), map(lambda t: t[0], infoCache))
+    database.execute("DELETE FROM cache WHERE id < ? AND id NOT IN (%s)" % ','.join(foldersCache), [maxId])
+    database.commit()
+    return infoCache
+
 
 if __name__ == '__main__':
     # Delete builds
     infoBuilds = pruneDir(CFG_BUILDSDIR, time.time()-CFG_BUILDS_MAXTIME, CFG_BUILDS_MAXSIZE, getBuildTime)
 
     # Delete cache entries
-    infoCache = pruneDir(CFG_CACHEDIR, time.time()-CFG_CACHE_MAXTIME, CFG_CACHE_MAXSIZE, getCacheTime)
-
-    # Clean cache database
     database = sqlite3.connect(CFG_CACHEDBPATH)
     database.row_factory = sqlite3.Row
-    foldersCache = map(lambda t: t[0], infoCache)
-    dbCur = database.cursor()
-    dbCur.execute("DELETE FROM cache WHERE id NOT IN (%s)" % ','.join(foldersCache))
-    dbCur.execute("VACUUM")
-    database.commit()
+    pruneCache(database)
+    database.execute("VACUUM")
+
+    # Delete the packages which aren't used by the cache, the builds or the
+    # task bundles anymore
+    prunePackages(getPackagesUsed([CFG_CACHEDIR, CFG_BUILDSDIR, CFG_BUNDLESDIR]))
+
+    # Delete the precompiled headers which weren't used recently
+    prunePrecompiledHeaders()
@@ -29,6 +29,12 @@ CFG_BUILDSDIR = os.path.join(CFG_BASEDIR, 'builds/')
 CFG_CACHEDIR = os.path.join(CFG_BASEDIR, 'cache/')
 CFG_CACHEDBPATH = os.path.join(CFG_CACHEDIR, 'taskgrader-cache.sqlite')
 CFG_RESET_SCRIPT = os.path.join(CFG_BINDIR, 'cache_reset.py')
+# Task bundles prepared with `taskgrader.py --prepare-task`
+CFG_BUNDLESDIR = os.path.join(CFG_BASEDIR, 'bundles/')
+# Precompiled headers for C++ compilations
+CFG_PCHDIR = os.path.join(CFG_BASEDIR, 'pch/')
+# Packaged files of multi-file scripts, available read-only inside isolate
+CFG_PACKAGESDIR = os.path.join(CFG_BASEDIR, 'packages/')
 
 # Paths to binaries
 CFG_ISOLATEBIN = os.path.join(CFG_BINDIR, 'isolate-bin')
@@ -50,6 +56,13 @@ CFG_LOGFILE = None
 # Log level, must be 'CRITICAL', 'ERROR', 'WARNING', 'INFO' or 'DEBUG'
 CFG_LOGLEVEL = "WARNING"
 
+# File where metrics about the taskgrader activity (evaluations, executions,
+# cache hits, ...) are written in the Prometheus text exposition format, for
+# instance for the textfile collector of the Prometheus node exporter; the
+# metrics of all taskgrader processes are accumulated in it.
+# None to disable metrics.
+CFG_METRICS_FILE = None
+
 
 ### Execution ###
 
@@ -60,6 +73,41 @@ CFG_CONTROLGROUPS = False
 # Possible values: 'auto', True, False
 # 'auto' will be False on Mac OS X, True on other systems
 CFG_STATIC = 'auto'
+# Folder containing the runtime libraries for dynamically linked executables
+# (when not compiled as static); executables will search for their libraries
+# in this folder first, and it will be available read-only inside isolate.
+# Set to None to use only the system libraries.
+CFG_RUNTIME_DIR = None
+# Report the link time of C, C++ and OCaml compilations (needs the GNU ld
+# linker, other linkers print statistics into the compilation output)
+# Possible values: 'auto', True, False
+# 'auto' will be False on Mac OS X, True on other systems
+CFG_LINK_STATS = False
+
+# Options given to the JVM for java8 executions; for tasks with many small
+# tests, '-XX:TieredStopAtLevel=1' can also reduce the startup time
+CFG_JAVA_FLAGS = '-XX:+UseSerialGC'
+# Make a class data sharing archive (AppCDS) of the compiled classes of java8
+# programs, to reduce the JVM startup time (needs JDK 10 or later, the archive
+# is not used otherwise)
+CFG_JAVA_APPCDS = True
+
+# Compile Python scripts and their dependencies to bytecode, so that each
+# execution doesn't need to compile them again; programs are then executed
+# from the bytecode of their main script (__file__ and sys.argv[0] end with
+# .pyc)
+# Can be changed for each compilation with the key 'forcePrecompile' of the
+# compilation parameters.
+CFG_PYTHON_PRECOMPILE = False
+# Options given to the Python interpreter, as a single argument; for instance
+# '-E' ignores the PYTHON* environment variables, and '-ES' also skips the
+# import of the site module if programs only use the standard library
+CFG_PYTHON_FLAGS = ''
+
+# Headers precompiled for C++ compilations, once for each compiler version and
+# set of compilation options; a solution including them first will be
+# compiled faster. Set to [] to disable precompiled headers.
+CFG_CPP_PCH_HEADERS = ['bits/stdc++.h']
 
 # Use only one isolated execution for all checker tests
 # (improves performance as each isolate invocation is slow)
@@ -73,6 +121,32 @@ CFG_MULTICHECK = True
 # 'auto' will be True on Mac OS X, False on other systems
 CFG_MULTICHECK_LIGHT = 'auto'
 
+# Compare the solution output with the expected output before calling the
+# checker, giving the full grade without calling the checker if they are the
+# same; tasks whose checker doesn't expect the output in the .out file must
+# not enable it.
+# Possible values: False, 'exact' (byte-exact comparison), 'spaces' (only
+# compare the sequences of whitespace-separated tokens)
+# Can be changed for each evaluation with the option 'outputPreCheck'.
+CFG_OUTPUT_PRECHECK = False
+
+# Use cached executions with other time and memory limits when their result
+# is implied: a successful execution which used its resources well within both
+# limits gives the same result with other limits also well above its usage,
+# and an execution killed at some limits is also killed with lower limits.
+# Memory limits can only change if the memory is measured by control groups.
+CFG_CACHE_LIMITS_REUSE = True
+# An execution is considered to be well within a limit if its usage
+# multiplied by this margin is still under the limit
+CFG_CACHE_LIMITS_MARGIN = 1.5
+
+# Cache the report of whole evaluations, to answer identical evaluations
+# (same input JSON, options and referenced files, same taskgrader version and
+# configuration) without evaluating them again; the build folder is then not
+# made.
+# Can be changed for each evaluation with the option 'evaluationCache'.
+CFG_EVALUATION_CACHE = False
+
 # Folders available inside of the isolate box
 # Isolated executions will have access to these folders, use with care.
 CFG_ISOLATE_AVAILABLE = ['/etc/alternatives']
@@ -85,6 +159,17 @@ CFG_NOISOLATE = []
 
 # Timeout for accessing the cache
 CFG_CACHE_TIMEOUT = 60
+# Minimum time between two updates of the last access time of a cache entry,
+# in seconds; access times are written into the cache database at the end of
+# each evaluation
+CFG_CACHE_ATIME_DELAY = 60
+
+# Maximum number of generations (or test cases of a generation) executed at
+# the same time; set to 1 to execute them one after the other
+CFG_GENERATION_JOBS = 4
+# Maximum number of compilations (of generators, sanitizer, checker and
+# solutions) executed at the same time
+CFG_COMPILATION_JOBS = 4
 
 
 ### Time and memory limits ###
@@ -98,6 +183,12 @@ CFG_MAX_GETFILE = 1024*1024     # in bytes
 # Wall time factor: if the cpu time limit is x, the wall time limit will be
 # CFG_WALLTIME_FACTOR * x
 CFG_WALLTIME_FACTOR = 3
+# Wall time factors for some languages, replacing CFG_WALLTIME_FACTOR
+# Example: CFG_WALLTIME_FACTOR_LANG={'java8': 2}
+CFG_WALLTIME_FACTOR_LANG = {}
+# Additional wall time in seconds given to Java executions for the JVM to
+# initialize
+CFG_WALLTIME_JAVA_STARTUP = 1
 
 # Time and memory parameter transformations for some languages
 # For memory, we only transform the limit
@@ -130,5 +221,9 @@ CFG_BUILDS_MAXSIZE = 50*1024*1024 # Keep less than 50 MB of builds
 CFG_CACHE_MAXTIME = 14*24*60*60   # Keep old cache for two weeks
 CFG_CACHE_MAXSIZE = 250*1024*1024 # Keep less than 250 MB of cache
 
+# Max age (since last use) in seconds and total size for precompiled headers
+CFG_PCH_MAXTIME = 7*24*60*60      # Keep unused headers for a week
+CFG_PCH_MAXSIZE = 1024*1024*1024  # Keep less than 1 GB of headers
+
 
 ##### END OF CONFIGURATION #####
@@ -0,0 +1,257 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 France-IOI, MIT license
+#
+# http://opensource.org/licenses/MIT
+
+# output_diff.py: comparison of a solution output with the expected output
+# This module is used by the built-in checkers of the taskgrader, and by the
+# defaultChecker.py of genJson, which gets it as a dependency.
+
+from collections import deque, OrderedDict
+from os.path import getsize
+from re import compile as reCompile
+from string import whitespace
+
+DEFAULT_OPTIONS = {
+    'ignoreSpaceChange': True,
+    'ignoreBlankLines': True,
+    'maxChars': 500,
+    'diffContext': 3
+    }
+
+SPACES_RE = reCompile('[%s]+' % whitespace)
+# Size of the chunks compared before comparing line by line
+CHUNK_SIZE = 1024*1024
+
+
+def utf8safe(s):
+    """Remove characters invalid in UTF-8."""
+    return s.decode('utf-8', errors='replace').encode('utf-8')
+
+
+def isBlankLine(line, options):
+    """Check whether a line is blank; with ignoreSpaceChange, lines with only
+    whitespaces are blank too."""
+    if options['ignoreSpaceChange']:
+        return line.strip() == ''
+    else:
+        return line.rstrip('\n') == ''
+
+
+def skipIdenticalStart(solHandle, expHandle):
+    """Skip the start of both files while they are identical, by chunks.
+    Returns None if the files are identical, else the number of lines
+    skipped; both handles are then at the start of a line, at least a chunk
+    before the first difference, to keep lines to display before it."""
+    lineNb, prevLineNb = 0, 0
+    offset, prevOffset = 0, 0
+    while True:
+        solChunk = solHandle.read(CHUNK_SIZE)
+        expChunk = expHandle.read(CHUNK_SIZE)
+        if solChunk != expChunk:
+            break
+        elif len(solChunk) < CHUNK_SIZE:
+            return None
+
+        # Resume from the last line start of the chunk before
+        lineStart = solChunk.rfind('\n') + 1
+        if lineStart > 0:
+            prevLineNb = lineNb
+            prevOffset = offset
+            lineNb += solChunk.count('\n', 0, lineStart)
+            offset = solHandle.tell() - CHUNK_SIZE + lineStart
+
+    solHandle.seek(prevOffset)
+    expHandle.seek(prevOffset)
+    return prevLineNb
+
+
+def readLines(handle, options, startLineNb=0):
+    """Iterate over the lines of handle, with their line number, skipping
+    blank lines if ignoreBlankLines is set."""
+    for (lineNb, line) in enumerate(handle, startLineNb + 1):
+        if options['ignoreBlankLines'] and isBlankLine(line, options):
+            continue
+        if line[-1:] != '\n':
+            # The last line doesn't need to end with a newline
+            line += '\n'
+        yield (lineNb, line)
+
+
+def normalizeLine(line, options):
+    """Normalize a line for comparison; with ignoreSpaceChange, consecutive
+    whitespaces are equivalent, and whitespaces at the end of the line are
+    ignored."""
+    if options['ignoreSpaceChange']:
+        return SPACES_RE.sub(' ', line.rstrip())
+    else:
+        return line
+
+
+def diff(solPath, outPath, options=None):
+    """Generate a diff report of two files.
+    The arguments are:
+    -solPath: path to the solution output
+    -outPath: path to the expected output
+    -options: dict with the following options:
+     ignoreSpaceChange (bool): ignore consecutive whitespaces
+     ignoreBlankLines (bool): ignore blank lines
+     maxChar (int): maximum chars in the displayed output
+    Returns a tuple (grade, result), where grade is the grade from 0 to 100,
+    and result is a dict containing the diff information."""
+
+    # Read options
+    if options:
+        opt = {}
+        opt.update(DEFAULT_OPTIONS)
+        opt.update(options)
+    else:
+        opt = DEFAULT_OPTIONS
+
+    solHandle = open(solPath, 'r')
+    expHandle = open(outPath, 'r')
+    lastLineNb = skipIdenticalStart(solHandle, expHandle)
+    if lastLineNb is None:
+        # The files are identical
+        return (100, {})
+
+    # Compare both files line by line, until the first difference, keeping
+    # the last lines for the context
+    solRead = readLines(solHandle, opt, lastLineNb)
+    expRead = readLines(expHandle, opt, lastLineNb)
+    beforeLines = deque(maxlen=opt['diffContext'])
+    while True:
+        sol = next(solRead, None)
+        exp = next(expRead, None)
+        if sol is None and exp is None:
+            # The files are identical
+            return (100, {})
+        if sol is None or exp is None or (sol[1] != exp[1] and
+                normalizeLine(sol[1], opt) != normalizeLine(exp[1], opt)):
+            break
+        beforeLines.append(sol)
+        lastLineNb = sol[0]
+
+    # The files aren't identical, read a few lines after the difference
+    solLines = [l for (n, l) in beforeLines]
+    expLines = solLines[:]
+    solLines.append(sol[1] if sol else "\n")
+    expLines.append(exp[1] if exp else "\n")
+    truncatedAfter = False
+    for (read, lines, cur) in [(solRead, solLines, sol), (expRead, expLines, exp)]:
+        if cur is None:
+            continue
+        for i in range(opt['diffContext']):
+            nextLine = next(read, None)
+            if nextLine is None:
+                break
+            lines.append(nextLine[1])
+        else:
+            truncatedAfter = truncatedAfter or (next(read, None) is not None)
+
+    # Line of the difference in the solution output
+    diffLine = sol[0] if sol else lastLineNb + 1
+
+    # Find difference in the diff line
+    relLine = len(beforeLines)
+    solDLine = solLines[relLine]
+    expDLine = expLines[relLine]
+    solCur = 0
+    expCur = 0
+    while True:
+        if solCur >= len(solDLine) or expCur >= len(expDLine):
+            break
+
+        if opt['ignoreSpaceChange']:
+            # We ignore consecutive whitespaces
+            # It's a line so the character before the first one is a newline
+            if solDLine[solCur] in whitespace:
+                if solCur == len(solDLine)-1:
+                    break
+                elif solCur == 0 or solDLine[solCur+1] in whitespace:
+                    solCur += 1
+                    continue
+            if expDLine[expCur] in whitespace:
+                if expCur == len(expDLine)-1:
+                    break
+                elif expCur == 0 or expDLine[expCur+1] in whitespace:
+                    expCur += 1
+                    continue
+
+        if solDLine[solCur] != expDLine[expCur]:
+            break
+        else:
+            solCur += 1
+            expCur += 1
+
+    result = OrderedDict()
+
+    # Start building report
+    result['msg'] = "Answer mismatch at line %d, character %d" % (diffLine, solCur+1)
+    result['solutionOutputLength'] = getsize(solPath)
+    result['diffRow'] = diffLine
+    result['diffCol'] = solCur+1
+
+    # Select lines to display
+    maxChars = opt['maxChars']
+    if len(solDLine) > maxChars or len(expDLine) > maxChars:
+        # We only display the differing line because it's already too long
+        if solCur < maxChars/2:
+            colStart = 0
+            colEnd = maxChars
+        elif len(solDLine) - solCur < maxChars/2:
+            colStart = len(solDLine)-maxChars
+            colEnd = max(len(solDLine), len(expDLine))
+        else:
+            colStart = solCur - maxChars/2
+            colEnd = solCur + maxChars/2
+        result['displayedSolutionOutput'] = utf8safe(solDLine[colStart:colEnd])
+        result['displayedExpectedOutput'] = utf8safe(expDLine[colStart:colEnd])
+        result['truncatedBefore'] = (diffLine > 1)
+        result['truncatedAfter'] = True
+        result['excerptRow'] = diffLine
+        result['excerptCol'] = colStart+1
+
+    else:
+        # We add lines before and/or after as long as we stay within maxChars
+        remChars = maxChars - max(len(solDLine), len(expDLine))
+        dispStartLine = relLine
+        dispSolEndLine = relLine
+        dispExpEndLine = relLine
+
+        # Add lines before from both solution and expected output
+        while dispStartLine > 0:
+            if len(solLines[dispStartLine-1]) > remChars:
+                break
+            else:
+                remChars -= len(solLines[dispStartLine-1])
+                dispStartLine -= 1
+
+        # Separately add lines from solution and expected output, as it's
+        # possible they don't have the same lines/number of lines
+        while dispSolEndLine < len(solLines)-1:
+            if len(solLines[dispSolEndLine+1]) > remChars:
+                break
+            else:
+                remChars -= len(solLines[dispSolEndLine+1])
+                dispSolEndLine += 1
+
+        while dispExpEndLine < len(expLines)-1:
+            if len(expLines[dispExpEndLine+1]) > remChars:
+                break
+            else:
+                remChars -= len(expLines[dispExpEndLine+1])
+                dispExpEndLine += 1
+
+        result['displayedSolutionOutput'] = utf8safe(''.join(solLines[dispStartLine:dispSolEndLine+1]))
+        result['displayedExpectedOutput'] = utf8safe(''.join(expLines[dispStartLine:dispExpEndLine+1]))
+        excerptRow = beforeLines[dispStartLine][0] if dispStartLine < relLine else diffLine
+        result['truncatedBefore'] = (excerptRow > 1)
+        result['truncatedAfter'] = truncatedAfter
+        result['excerptRow'] = excerptRow
+        result['excerptCol'] = 1
+
+    # Return a grade of 0 (answer mismatch) and the results info
+    return (0, result)
@@ -16,12 +16,37 @@ try:
 except:
     pass
 
+def upgradeDb(db):
+    """Add the columns and indexes missing from a database made by an older
+    version of the taskgrader."""
+    columns = [row[1] for row in db.execute("PRAGMA table_info(cache)")]
+    # baseid: filesid without the execution limits, see
+    # CacheHandle.getLimitsVariants
+    if 'baseid' not in columns:
+        db.execute("ALTER TABLE cache ADD COLUMN baseid TEXT")
+    # files, report, atime: metadata of the cache entries, see CacheFolder;
+    # files is NULL until the entry is complete
+    if 'files' not in columns:
+        db.execute("ALTER TABLE cache ADD COLUMN files TEXT")
+    if 'report' not in columns:
+        db.execute("ALTER TABLE cache ADD COLUMN report TEXT")
+    if 'atime' not in columns:
+        db.execute("ALTER TABLE cache ADD COLUMN atime REAL")
+    db.execute("CREATE INDEX IF NOT EXISTS cache_filesid ON cache (filesid)")
+    db.execute("CREATE INDEX IF NOT EXISTS cache_baseid ON cache (baseid)")
+    db.commit()
+
 def schemaDb():
     db = sqlite3.connect(CFG_CACHEDBPATH)
     db.execute("""CREATE TABLE IF NOT EXISTS cache
     (id INTEGER PRIMARY KEY,
      filesid TEXT,
-     hashlist TEXT)""")
+     hashlist TEXT,
+     baseid TEXT,
+     files TEXT,
+     report TEXT,
+     atime REAL)""")
+    upgradeDb(db)
 
 if __name__ == '__main__':
     schemaDb()
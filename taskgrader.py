@@ -10,15 +10,28 @@
 # See README.md for more information.
 
 
-import argparse, cPickle, fcntl, glob, hashlib, json, logging, os, platform
-import random, shlex, shutil, sqlite3, stat, sys, subprocess, tempfile
-import threading, time, traceback
+import argparse, contextlib, copy, cPickle, fcntl, functools, glob, hashlib, json
+import logging, mmap, os, platform, Queue, random, re, shlex, shutil, sqlite3, stat, sys
+import subprocess, tempfile, threading, time, traceback
 
 
 # Load configuration; default values will be overwritten by user-defined ones
 from config_default import *
 from config import *
 
+import output_diff, schema_db
+
+# Limit transformations calibrated with `tools/autoLimit/autoLimit.py config`,
+# for the languages which don't have a transformation in config.py
+try:
+    import config_transforms
+    for (lang, transform) in config_transforms.CFG_TRANSFORM_TIME.items():
+        CFG_TRANSFORM_TIME.setdefault(lang, transform)
+    for (lang, transform) in config_transforms.CFG_TRANSFORM_MEM.items():
+        CFG_TRANSFORM_MEM.setdefault(lang, transform)
+except ImportError:
+    pass
+
 # Handle configuration variables
 for var in ['CFG_BASEDIR', 'CFG_BINDIR']:
     if eval(var) == 'CHANGE_ME':
@@ -31,6 +44,18 @@ if CFG_STATIC == 'auto':
     else:
         CFG_STATIC = True
 
+# Linker statistics are only available with GNU ld
+if CFG_LINK_STATS == 'auto':
+    CFG_LINK_STATS = (platform.system() != 'Darwin')
+
+# Dynamically linked executables need their runtime inside isolate
+if CFG_RUNTIME_DIR and CFG_RUNTIME_DIR not in CFG_ISOLATE_AVAILABLE:
+    CFG_ISOLATE_AVAILABLE = CFG_ISOLATE_AVAILABLE + [CFG_RUNTIME_DIR]
+
+# Multi-file scripts need their packaged files inside isolate
+if CFG_PACKAGESDIR not in CFG_ISOLATE_AVAILABLE:
+    CFG_ISOLATE_AVAILABLE = CFG_ISOLATE_AVAILABLE + [CFG_PACKAGESDIR]
+
 # Mac OS X doesn't have an appropriate 'time' binary
 if CFG_MULTICHECK and CFG_MULTICHECK_LIGHT == 'auto':
     if platform.system() == 'Darwin':
@@ -45,6 +70,42 @@ os.environ["TASKGRADERDIR"] = SELFDIR
 
 RESTRICT_PATHS = []
 
+# Version of the task bundles format, see prepareTask
+TASKBUNDLE_VERSION = 1
+
+# Locks for concurrent accesses from multiple threads: the cache database,
+# each cache folder (fcntl locks are only effective between processes), and
+# the isolate box slots in use by this process
+CACHEDB_LOCK = threading.Lock()
+CACHEFOLDER_LOCKS = {}
+CACHEFOLDER_LOCKS_LOCK = threading.Lock()
+# Last access times of the cache entries used, written all at once into the
+# cache database by saveCacheAccessTimes
+CACHE_ACCESS_TIMES = {}
+BOXSLOTS_USED = set()
+BOXSLOTS_LOCK = threading.Lock()
+
+# Folders of precompiled headers already looked for by this process, see
+# getPrecompiledHeaders
+PCH_DIRS = {}
+PCH_LOCK = threading.Lock()
+
+# Other lines of the statistics printed by GNU ld with --stats
+LINKSTATS_RE = re.compile(r'^\S*ld\S*: data size [0-9]+$')
+
+# Size of the chunks compared by sameOutputs
+PRECHECK_CHUNK = 1024 * 1024
+SPACE_RE = re.compile(r'\s')
+
+# Path variables replaced in strings by preprocessJson
+PATHVAR_RE = re.compile(r'\$(BUILD_PATH|ROOT_PATH|TASK_PATH)')
+
+# Profile of the current evaluation, see Profile
+PROFILE = None
+
+# Hash of the code and configuration, see getTaskgraderFingerprint
+TASKGRADER_FINGERPRINT = None
+
 sys.path.append(CFG_JSONSCHEMA)
 try:
     from jsonschema import validate
@@ -52,6 +113,196 @@ except:
     validate = None
 
 
+class Profile(object):
+    """Accumulates the wall-clock time spent by the taskgrader itself in each
+    phase of an evaluation, such as cache lookups or isolate initialization."""
+
+    def __init__(self, startTime=None):
+        """startTime is the start of the evaluation, by default now."""
+        self.startTime = startTime or time.time()
+        self.phases = {} # phase -> [count, timeMs]
+        self.lock = threading.Lock()
+
+    def add(self, phase, timeMs):
+        with self.lock:
+            phaseData = self.phases.setdefault(phase, [0, 0.0])
+            phaseData[0] += 1
+            phaseData[1] += timeMs
+
+    def snapshot(self):
+        """Returns the current state of the profile, to be given to
+        makeReport later."""
+        with self.lock:
+            return (time.time(), dict([(k, list(v)) for (k, v) in self.phases.items()]))
+
+    def makeReport(self, since=None):
+        """Make the profile report of the phases since the snapshot since, or
+        since the start of the evaluation."""
+        (sinceTime, sincePhases) = since if since else (self.startTime, {})
+        phasesReport = {}
+        with self.lock:
+            for (phase, (count, timeMs)) in self.phases.items():
+                (prevCount, prevTimeMs) = sincePhases.get(phase, [0, 0.0])
+                if count > prevCount:
+                    phasesReport[phase] = {'count': count - prevCount,
+                        'timeMs': round(timeMs - prevTimeMs, 3)}
+        return {'totalMs': round((time.time() - sinceTime) * 1000, 3),
+            'phases': phasesReport}
+
+
+@contextlib.contextmanager
+def profilePhase(phase):
+    """Accumulate the time taken by the block into phase of the current
+    profile."""
+    if PROFILE is None:
+        yield
+        return
+    startTime = time.time()
+    try:
+        yield
+    finally:
+        PROFILE.add(phase, (time.time() - startTime) * 1000)
+
+
+def profiled(phase):
+    """Decorator accumulating the time taken by each call of the function
+    into phase of the current profile."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profilePhase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Metrics exported in the Prometheus text exposition format, see Metrics
+METRICS_TYPES = {
+    'taskgrader_evaluations_total': ('counter', "Evaluations done, by result."),
+    'taskgrader_evaluation_duration_seconds': ('histogram', "Wall-clock duration of evaluations."),
+    'taskgrader_executions_total': ('counter', "Program executions, cached ones excluded, by isolation."),
+    'taskgrader_execution_duration_seconds': ('histogram', "Wall-clock duration of program executions, cached ones excluded, by language."),
+    'taskgrader_compilation_duration_seconds': ('histogram', "Wall-clock duration of compilations, cached ones excluded, by language."),
+    'taskgrader_cache_hits_total': ('counter', "Cache lookups finding a cached version, by cache type."),
+    'taskgrader_cache_misses_total': ('counter', "Cache lookups not finding a cached version, by cache type."),
+    'taskgrader_isolate_errors_total': ('counter', "Internal errors of isolate."),
+    'taskgrader_temporary_exceptions_total': ('counter', "Temporary errors, for which the evaluation can be tried again later."),
+    'taskgrader_lock_wait_seconds': ('histogram', "Time waited to acquire locks, by lock.")}
+METRICS_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class Metrics(object):
+    """Counters and histograms about the activity of the taskgrader. They are
+    accumulated across processes into CFG_METRICS_FILE, in the Prometheus text
+    exposition format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> [cumulative bucket counts..., sum, count]
+
+    def inc(self, name, labels={}, value=1):
+        """Increment the counter name with labels by value."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels={}):
+        """Add the observation value to the histogram name with labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.setdefault(key, [0] * len(METRICS_BUCKETS) + [0.0, 0])
+            for (i, bound) in enumerate(METRICS_BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def save(self, path):
+        """Add the metrics to the ones accumulated in path, and reset them.
+        The accumulated values are kept in JSON in path + '.state'."""
+        with self.lock:
+            (counters, histograms) = (self.counters, self.histograms)
+            (self.counters, self.histograms) = ({}, {})
+        if not counters and not histograms:
+            return
+
+        lockFile = open(path + '.lock', 'a')
+        fcntl.lockf(lockFile, fcntl.LOCK_EX)
+        try:
+            try:
+                state = json.load(open(path + '.state', 'r'))
+            except:
+                state = {'counters': [], 'histograms': []}
+
+            for (name, labels, value) in state['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for (name, labels, value) in state['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                if len(value) != len(METRICS_BUCKETS) + 2:
+                    # Buckets changed, drop the old values
+                    continue
+                if histograms.has_key(key):
+                    histograms[key] = [a + b for (a, b) in zip(histograms[key], value)]
+                else:
+                    histograms[key] = value
+
+            state = {
+                'counters': [[name, labels, value] for ((name, labels), value) in counters.items()],
+                'histograms': [[name, labels, value] for ((name, labels), value) in histograms.items()]}
+            json.dump(state, open(path + '.state.tmp', 'w'))
+            os.rename(path + '.state.tmp', path + '.state')
+            open(path + '.tmp', 'w').write(self.render(counters, histograms))
+            os.rename(path + '.tmp', path)
+        finally:
+            fcntl.lockf(lockFile, fcntl.LOCK_UN)
+            lockFile.close()
+
+    @staticmethod
+    def render(counters, histograms):
+        """Render metrics in the Prometheus text exposition format."""
+        def labelsText(labels, extra=[]):
+            labels = list(labels) + extra
+            if not labels:
+                return ''
+            return '{%s}' % ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for (k, v) in labels])
+
+        lines = []
+        for name in sorted(METRICS_TYPES.keys()):
+            (metricType, helpText) = METRICS_TYPES[name]
+            lines.append('# HELP %s %s' % (name, helpText))
+            lines.append('# TYPE %s %s' % (name, metricType))
+            if metricType == 'counter':
+                for ((cName, labels), value) in sorted(counters.items()):
+                    if cName == name:
+                        lines.append('%s%s %s' % (name, labelsText(labels), value))
+            else:
+                for ((hName, labels), value) in sorted(histograms.items()):
+                    if hName != name:
+                        continue
+                    for (bound, count) in zip(METRICS_BUCKETS, value):
+                        lines.append('%s_bucket%s %d' % (name, labelsText(labels, [('le', bound)]), count))
+                    lines.append('%s_bucket%s %d' % (name, labelsText(labels, [('le', '+Inf')]), value[-1]))
+                    lines.append('%s_sum%s %s' % (name, labelsText(labels), repr(value[-2])))
+                    lines.append('%s_count%s %d' % (name, labelsText(labels), value[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+def saveMetrics():
+    """Save the metrics into CFG_METRICS_FILE, if configured."""
+    if not CFG_METRICS_FILE:
+        return
+    try:
+        METRICS.save(CFG_METRICS_FILE)
+    except:
+        logging.warning("Unable to save metrics into `%s`:\n%s" % (CFG_METRICS_FILE, traceback.format_exc()))
+
+
+METRICS = Metrics()
+
+
 class TemporaryException(Exception):
     """TemporaryException is a special exception representing a temporary
     error, for which reexecuting the exact same evaluation can succeed at a
@@ -76,56 +327,136 @@ class UnsupportedLanguage(Exception):
         return repr(self.msg)
 
 
+def touchCacheEntry(cacheId):
+    """Record an access to the cache entry cacheId."""
+    with CACHEDB_LOCK:
+        CACHE_ACCESS_TIMES[cacheId] = time.time()
+
+
+def saveCacheAccessTimes():
+    """Write the recorded access times of the cache entries into the cache
+    database, in a single transaction."""
+    with CACHEDB_LOCK:
+        accessTimes = [(atime, cacheId) for (cacheId, atime) in CACHE_ACCESS_TIMES.iteritems()]
+        CACHE_ACCESS_TIMES.clear()
+    if not accessTimes:
+        return
+    try:
+        database = sqlite3.connect(CFG_CACHEDBPATH)
+        database.executemany("UPDATE cache SET atime=? WHERE id=?", accessTimes)
+        database.commit()
+        database.close()
+    except:
+        logging.warning("Unable to save the cache access times:\n%s" % traceback.format_exc())
+
+
 class CacheFolder(object):
     """CacheFolder represents a folder of the cache, caching a specific
     execution. The class gives functions for reading from and writing to this
-    folder."""
+    folder; the list of files and the report are stored in the cache
+    database."""
 
-    def __init__(self, cacheId):
-        """cacheId is the ID number of the cache folder."""
-        logging.debug("Opening CacheFolder #%d." % cacheId)
+    def __init__(self, database, dbRow):
+        """database is the cache database, and dbRow the row of the cache
+        entry in it. A complete entry is read from dbRow without locking the
+        folder, as it won't be modified anymore; an incomplete one is locked
+        until it is saved."""
+        self.cacheId = dbRow['id']
+        logging.debug("Opening CacheFolder #%d." % self.cacheId)
 
-        self.cacheId = cacheId
-        self.cacheFolder = os.path.join(CFG_CACHEDIR, "%s/" % cacheId)
+        self.database = database
+        self.cacheFolder = os.path.join(CFG_CACHEDIR, "%s/" % self.cacheId)
+        self.hashList = dbRow['hashlist']
+        self.baseId = None
+        self.locked = False
+        self._loadRow(dbRow)
+
+        # The folder of a complete entry may have been removed by clean_cache
+        if self.isCached and os.path.isdir(self.cacheFolder):
+            if (dbRow['atime'] or 0) < time.time() - CFG_CACHE_ATIME_DELAY:
+                touchCacheEntry(self.cacheId)
+            logging.debug("CacheFolder #%d is cached, files: %s." % (self.cacheId, ', '.join(self.files)))
+            return
 
         try:
             os.mkdir(self._makePath())
         except:
             pass
 
-        # Lock the cache folder
+        # Lock the cache folder, against other threads and other processes
+        with CACHEFOLDER_LOCKS_LOCK:
+            self.threadLock = CACHEFOLDER_LOCKS.setdefault(self.cacheId, threading.RLock())
         locking_start = time.time()
         self.cacheLock = open(self._makePath('cache.lock'), 'w+')
         while time.time() - locking_start < CFG_CACHE_TIMEOUT:
             # There's no internal timeout function, we have to do it manually
+            if not self.threadLock.acquire(False):
+                time.sleep(0.01)
+                continue
             try:
                 fcntl.lockf(self.cacheLock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.locked = True
                 break
             except IOError:
+                self.threadLock.release()
                 continue
-        if time.time() - locking_start > CFG_CACHE_TIMEOUT:
+        METRICS.observe('taskgrader_lock_wait_seconds', time.time() - locking_start, {'lock': 'cacheFolder'})
+        if not self.locked:
+            self.cacheLock.close()
             raise TemporaryException("Failed to acquire lock on cache folder #%d after %d seconds." % (self.cacheId, CFG_CACHE_TIMEOUT))
 
-        self.isCached = os.path.isfile(self._makePath('cache.ok'))
-        self.files = []
+        # The entry may have been completed while we were waiting for the lock
+        with CACHEDB_LOCK:
+            self._loadRow(self.database.execute("SELECT * FROM cache WHERE id=?", [self.cacheId]).fetchone())
+        if self.isCached and not all([os.path.lexists(self._makePath(f)) for f in self.files]):
+            self.invalidate()
+        if not self.isCached and os.path.isfile(self._makePath('cache.ok')):
+            self._importOldEntry()
+
         if self.isCached:
-            try:
-                self.files = cPickle.load(open(self._makePath('cache.files'), 'r'))
-            except:
-                pass
-            # Write in cache.ok the last access timestamp
-            try:
-                open(self._makePath('cache.ok'), 'w').write(str(time.time()))
-            except:
-                pass
-            logging.debug("CacheFolder #%d is cached, files: %s." % (cacheId, ', '.join(self.files)))
+            self._unlock()
+            logging.debug("CacheFolder #%d is cached, files: %s." % (self.cacheId, ', '.join(self.files)))
         else:
-            logging.debug("CacheFolder #%d is not cached." % cacheId)
+            logging.debug("CacheFolder #%d is not cached." % self.cacheId)
 
 
     def __del__(self):
-        # Unlock the cache folder
-        fcntl.lockf(self.cacheLock, fcntl.LOCK_UN)
+        self._unlock()
+
+    def _loadRow(self, dbRow):
+        """Load the state of the cache entry from its database row."""
+        self.isCached = dbRow is not None and dbRow['files'] is not None
+        if self.isCached:
+            self.files = json.loads(dbRow['files'])
+            self.reportData = dbRow['report']
+        else:
+            self.files = []
+            self.reportData = None
+
+    def _importOldEntry(self):
+        """Import into the database an entry made by an older version of the
+        taskgrader, which stored its files list and report in the folder."""
+        try:
+            files = cPickle.load(open(self._makePath('cache.files'), 'r'))
+            reportData = open(self._makePath('report.json'), 'r').read()
+        except:
+            return
+        self.files = files
+        self.reportData = reportData
+        self.save()
+        for f in ['cache.ok', 'cache.files', 'report.json']:
+            try:
+                os.remove(self._makePath(f))
+            except:
+                pass
+
+    def _unlock(self):
+        """Unlock the cache folder, if it is locked."""
+        if getattr(self, 'locked', False):
+            fcntl.lockf(self.cacheLock, fcntl.LOCK_UN)
+            self.cacheLock.close()
+            self.threadLock.release()
+            self.locked = False
 
     def _makePath(self, f=None):
         """Makes the path to the file f in the cache folder."""
@@ -135,16 +466,18 @@ class CacheFolder(object):
             return os.path.join(CFG_CACHEDIR, "%s/" % self.cacheId)
 
     def invalidate(self):
-        """Invalidates the cache folder, removing all files."""
+        """Invalidates the cache folder, marking it as incomplete. The files
+        are not removed, as they may still be in use; they will be replaced
+        when the entry is made again."""
         logging.info("Invalidating CacheFolder #%d" % self.cacheId)
-        try:
-            shutil.rmtree(self._makePath())
-        except:
-            pass
-        os.mkdir(self._makePath())
+        with CACHEDB_LOCK:
+            self.database.execute("UPDATE cache SET files=NULL, report=NULL WHERE id=?", [self.cacheId])
+            self.database.commit()
         self.isCached = False
         self.files = []
+        self.reportData = None
 
+    @profiled('cacheStore')
     def addFile(self, path, isExecutable=False):
         """Add a file to the cache. save() must be called in order for the
         cache to be considered as complete."""
@@ -159,6 +492,7 @@ class CacheFolder(object):
             os.chmod(self._makePath(filename), 493)
         self.files.append(filename)
 
+    @profiled('cacheStore')
     def addReport(self, data):
         """Add the execution report to the cache. save() must be called in
         order for the cache to be considered as complete."""
@@ -167,41 +501,57 @@ class CacheFolder(object):
             raise Exception("Tried to modify an already cached version (ID %d)." % self.cacheId)
 
         logging.debug("Adding report to CacheFolder #%d" % self.cacheId)
-        json.dump(data, open(self._makePath('report.json'), 'w'))
+        self.reportData = json.dumps(data)
 
+    @profiled('cacheStore')
     def save(self):
-        """Save the cache, marking it as complete and usable."""
+        """Save the cache, marking it as complete and usable. Returns False if
+        the entry was removed or made for other files meanwhile, in which case
+        it is not saved."""
         logging.debug("Saving CacheFolder #%d, files: %s" % (self.cacheId, ', '.join(self.files)))
-        cPickle.dump(self.files, open(self._makePath('cache.files'), 'w'))
-        open(self._makePath('cache.ok'), 'w').write(' ')
+        with CACHEDB_LOCK:
+            dbCur = self.database.cursor()
+            dbCur.execute("UPDATE cache SET files=?, report=?, atime=? WHERE id=? AND hashlist=?",
+                [json.dumps(self.files), self.reportData, time.time(), self.cacheId, self.hashList])
+            self.database.commit()
+        # The entry won't be modified anymore by this CacheFolder
+        self._unlock()
+        if dbCur.rowcount != 1:
+            logging.info("CacheFolder #%d was changed meanwhile, not saved." % self.cacheId)
+            return False
         self.isCached = True
+        return True
 
+    @profiled('cacheLoad')
     def loadFiles(self, path):
         """Load files from the cache into the folder path. Will behave as if
         the execution took place in that folder."""
         if not self.isCached:
-            raise Execption("Tried to load non-cached files from cache (ID %d)." % self.cacheId)
+            raise Exception("Tried to load non-cached files from cache (ID %d)." % self.cacheId)
 
         logging.debug("Loading CacheFolder #%d into folder `%s`" % (self.cacheId, path))
         for f in self.files:
             symlink(self._makePath(f), os.path.join(path, f))
 
+    @profiled('cacheLoad')
     def loadReport(self):
         """Load the execution report from the cache."""
         if not self.isCached:
-            raise Execption("Tried to load non-cached files from cache (ID %d)." % self.cacheId)
+            raise Exception("Tried to load non-cached files from cache (ID %d)." % self.cacheId)
 
-        return json.load(open(self._makePath('report.json'), 'r'))
+        return json.loads(self.reportData)
 
 
 class CacheHandle():
     """CacheHandle represents a program in the cache. It allows to get
     CacheFolder instances related to that program."""
 
-    def __init__(self, database, programFiles):
+    @profiled('hashing')
+    def __init__(self, database, programFiles, options=[]):
         """database is the cache database.
         programFiles is the list of fileDescr elements representing the
-        program."""
+        program, and options the list of strings representing the options it
+        was made with."""
         self.database = database
 
         fileIdList = []
@@ -221,6 +571,8 @@ class CacheHandle():
             else:
                 # It's a local dependency
                 fileIdList.append("local:%s" % fileDescr['name'])
+        for option in options:
+            fileIdList.append("option:%s" % option)
 
         fileIdList.sort()
         fileHashList.sort() # Both lists won't be sorted the same but it's not an issue
@@ -247,40 +599,79 @@ class CacheHandle():
 
         inputIdList = []
         # We add identifiers for input files (local name and md5sum)
-        for f in inputFiles:
-            md5sum = hashlib.md5(open(f, 'rb').read()).hexdigest()
-            inputIdList.append("input:%s:%s" % (os.path.basename(f), md5sum))
+        with profilePhase('hashing'):
+            for f in inputFiles:
+                md5sum = hashlib.md5(open(f, 'rb').read()).hexdigest()
+                inputIdList.append("input:%s:%s" % (os.path.basename(f), md5sum))
 
         # This will be the ID string in the database, containing the cache type and the input files list
         filesId = "%s;cache:%s;args:%s;%s;%s" % (self.programId, cacheType, args, params, ";".join(inputIdList))
+        # The same ID without the execution limits, to find the executions
+        # with other limits
+        if execParams:
+            baseId = "%s;cache:%s;args:%s;%s" % (self.programId, cacheType, args, ";".join(inputIdList))
+        else:
+            baseId = None
 
         logging.debug("Getting CacheFolder for filesId `%s`" % filesId)
 
-        # Read cache information from database
-        dbCur = self.database.cursor()
-        dbCur.execute("SELECT * FROM cache WHERE filesId=?", [filesId])
-        dbRow = dbCur.fetchone()
-        if dbRow:
-            # This list of files already exists in the database
-            dbId = dbRow['id']
-            dbHashes = dbRow['hashlist']
-            if dbHashes == self.programHashes:
-                # MD5 hashes are good
-                return CacheFolder(dbId)
-            else:
-                # MD5 hashes changed, update database, invalidate cache
-                dbCur.execute("UPDATE cache SET hashlist=? WHERE filesid=?", [self.programHashes, filesId])
-                self.database.commit()
-                cf = CacheFolder(dbId)
-                cf.invalidate()
-                return cf
+        # Read cache information from database, and lock the cache folder if
+        # the entry is not complete
+        with profilePhase('cacheLookup'):
+            waitStart = time.time()
+            with CACHEDB_LOCK:
+                METRICS.observe('taskgrader_lock_wait_seconds', time.time() - waitStart, {'lock': 'cacheDatabase'})
+                dbCur = self.database.cursor()
+                dbCur.execute("SELECT * FROM cache WHERE filesId=?", [filesId])
+                dbRow = dbCur.fetchone()
+                if dbRow and dbRow['hashlist'] == self.programHashes:
+                    # This list of files already exists in the database
+                    if dbRow['baseid'] != baseId:
+                        # The entry was made by an older version; update
+                        # database
+                        dbCur.execute("UPDATE cache SET baseid=? WHERE id=?", [baseId, dbRow['id']])
+                        self.database.commit()
+                else:
+                    # New entry in database
+                    dbCur.execute("INSERT INTO cache(filesid, hashlist, baseid) VALUES(?, ?, ?)", [filesId, self.programHashes, baseId])
+                    logging.debug("Added new entry into cache database")
+                    newId = dbCur.lastrowid
+                    if dbRow:
+                        # MD5 hashes changed, the old entry isn't valid
+                        # anymore; it is replaced by the new one, in a new
+                        # folder, as its files may still be in use (its folder
+                        # is then removed by clean_cache). It is deleted after
+                        # the insertion so that its id isn't reused.
+                        logging.debug("Replacing outdated cache entry #%d" % dbRow['id'])
+                        dbCur.execute("DELETE FROM cache WHERE id=?", [dbRow['id']])
+                    self.database.commit()
+                    dbRow = {'id': newId, 'hashlist': self.programHashes, 'files': None, 'report': None, 'atime': None}
+
+            cf = CacheFolder(self.database, dbRow)
+            cf.baseId = baseId
+
+        cacheLabels = {'cache_type': cacheType.split('-')[0]}
+        if cf.isCached:
+            METRICS.inc('taskgrader_cache_hits_total', cacheLabels)
         else:
-            # New entry in database
-            dbCur.execute("INSERT INTO cache(filesid, hashlist) VALUES(?, ?)", [filesId, self.programHashes])
-            logging.debug("Added new entry into cache database")
-            self.database.commit()
-            newId = dbCur.lastrowid
-            return CacheFolder(newId)
+            METRICS.inc('taskgrader_cache_misses_total', cacheLabels)
+        return cf
+
+    def getLimitsVariants(self, cacheFolder):
+        """Returns the cached CacheFolders of the same execution as
+        cacheFolder, but with other execution limits."""
+        if not cacheFolder.baseId:
+            return []
+
+        with profilePhase('cacheLookup'):
+            with CACHEDB_LOCK:
+                dbCur = self.database.cursor()
+                dbCur.execute("SELECT * FROM cache WHERE baseid=? AND hashlist=? AND id!=? AND files IS NOT NULL",
+                    [cacheFolder.baseId, self.programHashes, cacheFolder.cacheId])
+                dbRows = dbCur.fetchall()
+
+            variants = [CacheFolder(self.database, dbRow) for dbRow in dbRows]
+        return variants
 
 
 class CacheDatabase():
@@ -288,7 +679,9 @@ class CacheDatabase():
 
     def _loadDatabase(self):
         """Load the database."""
-        self.database = sqlite3.connect(CFG_CACHEDBPATH)
+        # The connection is shared between threads, accesses are serialized
+        # with CACHEDB_LOCK
+        self.database = sqlite3.connect(CFG_CACHEDBPATH, check_same_thread=False)
         self.database.row_factory = sqlite3.Row
 
     def __init__(self):
@@ -304,8 +697,13 @@ class CacheDatabase():
             resetProc.wait()
             self._loadDatabase()
 
-    def getHandle(self, files):
-        return CacheHandle(self.database, files)
+        try:
+            schema_db.upgradeDb(self.database)
+        except:
+            logging.warning("Unable to upgrade the cache database:\n%s" % traceback.format_exc())
+
+    def getHandle(self, files, options=[]):
+        return CacheHandle(self.database, files, options)
 
 
 def getFile(fileDescr, destDir, errorFatal=True, language=None, baseDir=None):
@@ -442,10 +840,11 @@ class Execution():
         # Open stdin file
         stdinHandle = (open(self.stdinFile, 'rb') if self.stdinFile else None)
 
-        proc = subprocess.Popen(shlex.split(cmdLine), stdin=stdinHandle, stdout=open(self.stdoutFile, 'w'),
-                stderr=open(self.stderrFile, 'w'), cwd=workingDir, env=self.env)
-        # We allow a wall time of 3 times the timeLimit
-        waitWithTimeout(proc, (1+int(self.executionParams['timeLimitMs']/1000))*CFG_WALLTIME_FACTOR)
+        with profilePhase('execution'):
+            proc = subprocess.Popen(shlex.split(cmdLine), stdin=stdinHandle, stdout=open(self.stdoutFile, 'w'),
+                    stderr=open(self.stderrFile, 'w'), cwd=workingDir, env=self.env)
+            # We allow a wall time of 3 times the timeLimit
+            waitWithTimeout(proc, (1+int(self.executionParams['timeLimitMs']/1000))*CFG_WALLTIME_FACTOR_LANG.get(self.language, CFG_WALLTIME_FACTOR))
 
         # Make execution report
         report = {}
@@ -477,9 +876,13 @@ class Execution():
         and standard input and output redirected from stdinFile and to
         stdoutFile."""
         logging.info("Executing executable `%s`, cmd `%s`, args `%s` in dir `%s`" % (self.executablePath, self.cmd, args, workingDir))
-        self.workingDir = workingDir
-        self._prepareExecute(workingDir, stdinFile, stdoutFile, stderrFile)
-        return self._doExecute(workingDir, args)
+        # The state of this execution is kept in a copy, so that the same
+        # Execution can be used by multiple threads at once
+        execution = copy.copy(self)
+        execution.workingDir = workingDir
+        execution._prepareExecute(workingDir, stdinFile, stdoutFile, stderrFile)
+        METRICS.inc('taskgrader_executions_total', {'isolated': str(isinstance(self, IsolatedExecution)).lower()})
+        return execution._doExecute(workingDir, args)
 
 
 class IsolatedExecution(Execution):
@@ -494,22 +897,38 @@ class IsolatedExecution(Execution):
             logging.warning("Box-rights for isolate is not properly configured, falling back to normal execution. Check documentation for more information.")
             return Execution._doExecute(self, workingDir, args=args)
 
+        # Box ID is required if multiple isolate instances are running
+        # concurrently; it depends on the PID and on a slot unique among the
+        # threads of this process
+        with BOXSLOTS_LOCK:
+            boxSlot = 0
+            while boxSlot in BOXSLOTS_USED:
+                boxSlot += 1
+            BOXSLOTS_USED.add(boxSlot)
+        try:
+            return self._isolatedExecute(workingDir, args, (os.getpid() % 100) + 100 * boxSlot)
+        finally:
+            with BOXSLOTS_LOCK:
+                BOXSLOTS_USED.remove(boxSlot)
+
+    def _isolatedExecute(self, workingDir, args, boxId):
+        """Executes the command in workingDir with args, in the isolate box
+        boxId."""
         cmdLine = self.cmd + ((' ' + args) if args else '')
         report = {}
         report.update(self.baseReport)
 
-        # Box ID is required if multiple isolate instances are running concurrently
-        boxId = (os.getpid() % 100)
-
         isolateCommonOpts = ['--box-id=%d' % boxId]
         if CFG_CONTROLGROUPS:
             isolateCommonOpts.append('--cg')
 
         # Initialize isolate box
-        initProc = subprocess.Popen([CFG_ISOLATEBIN, '--init'] + isolateCommonOpts, stdout=subprocess.PIPE, cwd=workingDir)
-        (isolateDir, isolateErr) = communicateWithTimeout(initProc, 10)
+        with profilePhase('isolateInit'):
+            initProc = subprocess.Popen([CFG_ISOLATEBIN, '--init'] + isolateCommonOpts, stdout=subprocess.PIPE, cwd=workingDir)
+            (isolateDir, isolateErr) = communicateWithTimeout(initProc, 10)
 
         if initProc.returncode != 0:
+            METRICS.inc('taskgrader_isolate_errors_total')
             raise Exception("Error while initializing isolate box (#%d)." % initProc.returncode)
 
         # isolatePath will be the path of the sandbox, as given by isolate
@@ -527,10 +946,10 @@ class IsolatedExecution(Execution):
         isolatedCmdLine += ' --box-id=%d' % boxId
         if self.executionParams['timeLimitMs'] > 0:
             isolatedCmdLine += ' --time=' + str(self.realTimeLimit / 1000.)
-            wallTime = CFG_WALLTIME_FACTOR * self.realTimeLimit / 1000.
+            wallTime = CFG_WALLTIME_FACTOR_LANG.get(self.language, CFG_WALLTIME_FACTOR) * self.realTimeLimit / 1000.
             if self.language[:4] == 'java':
-                # Add one second for Java to initialize
-                wallTime += 1
+                # Add some time for Java to initialize
+                wallTime += CFG_WALLTIME_JAVA_STARTUP
             isolatedCmdLine += ' --wall-time=' + str(wallTime)
         if self.executionParams['memoryLimitKb'] > 0:
             if CFG_CONTROLGROUPS:
@@ -553,7 +972,8 @@ class IsolatedExecution(Execution):
                 pass
 
         # Copy files from working directory to sandbox
-        dircopy(workingDir, isolateDir)
+        with profilePhase('dircopyIn'):
+            dircopy(workingDir, isolateDir)
 
         # Create meta file with right owner/permissions
         open(os.path.join(workingDir, 'isolate.meta'), 'w')
@@ -561,8 +981,9 @@ class IsolatedExecution(Execution):
         logging.debug("Executing isolate: `%s`" % isolatedCmdLine)
 
         # Execute the isolated program
-        proc = subprocess.Popen(shlex.split(isolatedCmdLine), cwd=workingDir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
-        (procOut, procErr) = communicateWithTimeout(proc, int(10 + 3 * self.realTimeLimit / 1000.))
+        with profilePhase('execution'):
+            proc = subprocess.Popen(shlex.split(isolatedCmdLine), cwd=workingDir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
+            (procOut, procErr) = communicateWithTimeout(proc, int(10 + 3 * self.realTimeLimit / 1000.))
 
         # Get metadata from isolate execution
         isolateMeta = {}
@@ -578,6 +999,7 @@ class IsolatedExecution(Execution):
             # Try to cleanup sandbox
             cleanProc = subprocess.Popen([CFG_ISOLATEBIN, '--cleanup', '--box-id=%d' % boxId], cwd=workingDir)
             waitWithTimeout(cleanProc, 10)
+            METRICS.inc('taskgrader_isolate_errors_total')
             raise Exception("""Internal isolate error, please check installation: #%d %s
                     while trying to execute `%s` in folder `%s`.
                     stdout: %s
@@ -586,13 +1008,15 @@ class IsolatedExecution(Execution):
                                     procOut, procErr))
 
         # Set file rights so that we can access the files
-        rightsProc = subprocess.Popen([CFG_RIGHTSBIN])
-        waitWithTimeout(rightsProc, 30)
+        with profilePhase('boxRights'):
+            rightsProc = subprocess.Popen([CFG_RIGHTSBIN])
+            waitWithTimeout(rightsProc, 30)
 
         # Copy back the files from sandbox
-        dircopy(isolateDir, workingDir, overwrite=False)
-        filecopy(os.path.join(isolateDir, 'isolated.stdout'), self.stdoutFile)
-        filecopy(os.path.join(isolateDir, 'isolated.stderr'), self.stderrFile)
+        with profilePhase('dircopyOut'):
+            dircopy(isolateDir, workingDir, overwrite=False)
+            filecopy(os.path.join(isolateDir, 'isolated.stdout'), self.stdoutFile)
+            filecopy(os.path.join(isolateDir, 'isolated.stderr'), self.stderrFile)
 
         # Generate execution report
         if isolateMeta.has_key('time'):
@@ -626,8 +1050,9 @@ class IsolatedExecution(Execution):
                 truncateSize=self.executionParams.get('stderrTruncateKb', -1) * 1024)
 
         # Cleanup sandbox
-        cleanProc = subprocess.Popen([CFG_ISOLATEBIN, '--cleanup'] + isolateCommonOpts, cwd=workingDir)
-        waitWithTimeout(cleanProc, 10)
+        with profilePhase('isolateCleanup'):
+            cleanProc = subprocess.Popen([CFG_ISOLATEBIN, '--cleanup'] + isolateCommonOpts, cwd=workingDir)
+            waitWithTimeout(cleanProc, 10)
 
         return report
 
@@ -649,6 +1074,143 @@ def which(name):
     return False
 
 
+def getPrecompiledHeaders(compilerPath, options):
+    """Returns the path to a folder containing the CFG_CPP_PCH_HEADERS
+    precompiled by compilerPath with options, building them if needed; returns
+    None if no headers could be precompiled.
+    The folder depends on a fingerprint of the compiler and options, and is to
+    be added to the include path; the compiler will then use the precompiled
+    headers when they match the compilation options, and fall back to the
+    original headers otherwise."""
+
+    if not CFG_CPP_PCH_HEADERS:
+        return None
+
+    with PCH_LOCK:
+        # The headers may have been deleted by clean_cache.py meanwhile
+        pchDir = PCH_DIRS.get((compilerPath, options), False)
+        if pchDir is None or (pchDir and os.path.isdir(pchDir)):
+            return pchDir
+
+        try:
+            compilerVersion = subprocess.Popen([compilerPath, '--version'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+        except:
+            compilerVersion = ''
+        fingerprint = hashlib.md5(json.dumps([compilerPath, compilerVersion,
+            options, CFG_CPP_PCH_HEADERS])).hexdigest()
+        pchDir = os.path.join(CFG_PCHDIR, '%s/' % fingerprint)
+
+        if os.path.isdir(pchDir):
+            # Mark the headers as used, for clean_cache.py
+            try:
+                os.utime(pchDir, None)
+            except:
+                pass
+        else:
+            logging.info("Building precompiled headers in `%s`" % pchDir)
+            if not os.path.isdir(CFG_PCHDIR):
+                try:
+                    os.makedirs(CFG_PCHDIR)
+                except:
+                    pass
+            tmpDir = tempfile.mkdtemp(dir=CFG_PCHDIR)
+            gchBuilt = False
+            for header in CFG_CPP_PCH_HEADERS:
+                # The precompiled header is made from a stub including the
+                # actual header
+                stubPath = os.path.join(tmpDir, 'stub.h')
+                open(stubPath, 'w').write('#include <%s>\n' % header)
+                gchPath = os.path.join(tmpDir, header + '.gch')
+                if not os.path.isdir(os.path.dirname(gchPath)):
+                    os.makedirs(os.path.dirname(gchPath))
+                proc = subprocess.Popen([compilerPath] + shlex.split(options) +
+                    ['-x', 'c++-header', '-o', gchPath, stubPath],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                (procOut, procErr) = proc.communicate()
+                if proc.returncode != 0:
+                    logging.warning("Unable to precompile header `%s`:\n%s" % (header, procErr))
+                else:
+                    gchBuilt = True
+                os.unlink(stubPath)
+            if gchBuilt:
+                os.chmod(tmpDir, 0755)
+                try:
+                    os.rename(tmpDir, pchDir)
+                except OSError:
+                    # Another process built them at the same time
+                    shutil.rmtree(tmpDir, ignore_errors=True)
+            else:
+                # Nothing to keep; we don't leave an empty folder behind
+                shutil.rmtree(tmpDir, ignore_errors=True)
+
+        if not glob.glob(os.path.join(pchDir, '*')):
+            pchDir = None
+        PCH_DIRS[(compilerPath, options)] = pchDir
+        return pchDir
+
+
+def getLinkArgs(compStatic):
+    """Returns the list of arguments for gcc to link an executable, statically
+    if compStatic, else dynamically with the runtime from CFG_RUNTIME_DIR."""
+    if compStatic:
+        linkArgs = ['-static']
+    elif CFG_RUNTIME_DIR:
+        linkArgs = ['-Wl,-rpath,%s' % CFG_RUNTIME_DIR]
+    else:
+        linkArgs = []
+    if CFG_LINK_STATS:
+        linkArgs.append('-Wl,--stats')
+    return linkArgs
+
+
+def extractLinkStats(report):
+    """Removes the linker statistics from the stderr of a compilation report,
+    and adds the link time to the report."""
+    stderrLines = []
+    for l in report['stderr']['data'].splitlines(True):
+        linkTime = re.search('total time in link: ([0-9.]+)', l)
+        if linkTime:
+            report['linkTimeMs'] = int(float(linkTime.group(1)) * 1000)
+        elif not LINKSTATS_RE.search(l):
+            stderrLines.append(l)
+    report['stderr']['data'] = ''.join(stderrLines)
+    return report
+
+
+def makePackage(ownDir, files):
+    """Copies files from ownDir into a package folder, shared by all programs
+    made of the same files, and returns the path to that folder."""
+    filesHash = hashlib.md5()
+    for f in files:
+        filesHash.update(f + '\0')
+        filesHash.update(hashlib.md5(open(os.path.join(ownDir, f), 'rb').read()).hexdigest())
+    packageDir = os.path.join(CFG_PACKAGESDIR, filesHash.hexdigest())
+
+    if not os.path.isdir(packageDir):
+        if not os.path.isdir(CFG_PACKAGESDIR):
+            try:
+                os.makedirs(CFG_PACKAGESDIR)
+            except:
+                pass
+            # Packages can be accessed but not listed, so that a program
+            # cannot read the other programs
+            os.chmod(CFG_PACKAGESDIR, 0711)
+        tmpDir = tempfile.mkdtemp(dir=CFG_PACKAGESDIR)
+        for f in files:
+            filecopy(os.path.join(ownDir, f), os.path.join(tmpDir, f), makedirs=True)
+            os.chmod(os.path.join(tmpDir, f), 0644)
+        for (dirpath, dirnames, filenames) in os.walk(tmpDir):
+            os.chmod(dirpath, 0755)
+        try:
+            os.rename(tmpDir, packageDir)
+        except OSError:
+            # Another process made the same package at the same time
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    return packageDir
+
+
 class Language(object):
     """Represents a language, gives functions for aspects specific to each
     language."""
@@ -732,15 +1294,13 @@ class LanguageC(Language):
         else:
             compStatic = CFG_STATIC
 
-        if compStatic:
-            cmdLine = "%s -static -std=gnu99 -O2 -Wall -Werror=uninitialized %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
-        else:
-            cmdLine = "%s -std=gnu99 -O2 -Wall -Werror=uninitialized %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
+        linkArgs = ' '.join(getLinkArgs(compStatic))
+        cmdLine = "%s %s -std=gnu99 -O2 -Wall -Werror=uninitialized %s -o %s.exe %s -lm" % (self.deppaths[0], linkArgs, execArgs, name, ' '.join(compFiles))
 
         if 'commandLine' in compilationParams:
             cmdLine = compilationParams['commandLine'] % (self.deppaths[0], name, ' '.join(compFiles))
 
-        return Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        return extractLinkStats(Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir))
 
 class LanguageCpp(Language):
     lang = 'cpp'
@@ -755,27 +1315,42 @@ class LanguageCpp(Language):
             # We search for [name] in the libs directory
             os.path.join(baseDir, 'libs', filename)]
 
+    def _getPchArgs(self, options):
+        """Returns the compiler arguments to use the precompiled headers for
+        compilations with options; options must be all the compilation
+        options, as the compiler ignores headers precompiled with other
+        options."""
+        pchDir = getPrecompiledHeaders(self.deppaths[0], options)
+        return ('-I%s ' % pchDir) if pchDir else ''
+
+    def _compileWithPch(self, compilationParams, ownDir, cmdLine, pchArgs, evaluationContext):
+        """Executes the compilation cmdLine, reporting whether precompiled
+        headers were available."""
+        report = extractLinkStats(Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir))
+        report['precompiledHeaders'] = (pchArgs != '')
+        return report
+
     def compile(self, compilationParams, ownDir, sourceFiles, depFiles, evaluationContext, name='executable'):
         # Add non-header dependencies to compilation
         compFiles = sourceFiles[:]
         compFiles.extend(filter(lambda d: d[-2:] not in ['.h', '.hpp'], depFiles))
 
         execArgs = compilationParams.get('executionArgs', '')
+        pchArgs = self._getPchArgs('-O2 -Wall %s' % execArgs)
 
         if 'forceStatic' in compilationParams:
             compStatic = compilationParams['forceStatic']
         else:
             compStatic = CFG_STATIC
 
-        if compStatic:
-            cmdLine = "%s -static -O2 -Wall %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
-        else:
-            cmdLine = "%s -O2 -Wall %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
+        linkArgs = ' '.join(getLinkArgs(compStatic))
+        cmdLine = "%s %s -O2 -Wall %s%s -o %s.exe %s -lm" % (self.deppaths[0], linkArgs, pchArgs, execArgs, name, ' '.join(compFiles))
 
         if 'commandLine' in compilationParams:
             cmdLine = compilationParams['commandLine'] % (self.deppaths[0], name, ' '.join(compFiles))
+            pchArgs = ''
 
-        return Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        return self._compileWithPch(compilationParams, ownDir, cmdLine, pchArgs, evaluationContext)
 
 class LanguageCpp11(LanguageCpp):
     lang = 'cpp11'
@@ -787,32 +1362,35 @@ class LanguageCpp11(LanguageCpp):
         compFiles.extend(filter(lambda d: d[-2:] not in ['.h', '.hpp'], depFiles))
 
         execArgs = compilationParams.get('executionArgs', '')
+        pchArgs = self._getPchArgs('-std=gnu++11 -O2 -Wall %s' % execArgs)
 
         if 'forceStatic' in compilationParams:
             compStatic = compilationParams['forceStatic']
         else:
             compStatic = CFG_STATIC
 
-        if compStatic:
-            cmdLine = "%s -std=gnu++11 -static -O2 -Wall %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
-        else:
-            cmdLine = "%s -std=gnu++11 -O2 -Wall %s -o %s.exe %s -lm" % (self.deppaths[0], execArgs, name, ' '.join(compFiles))
+        linkArgs = ' '.join(getLinkArgs(compStatic))
+        cmdLine = "%s -std=gnu++11 %s -O2 -Wall %s%s -o %s.exe %s -lm" % (self.deppaths[0], linkArgs, pchArgs, execArgs, name, ' '.join(compFiles))
 
         if 'commandLine' in compilationParams:
             cmdLine = compilationParams['commandLine'] % (self.deppaths[0], name, ' '.join(compFiles))
+            pchArgs = ''
 
-        return Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        return self._compileWithPch(compilationParams, ownDir, cmdLine, pchArgs, evaluationContext)
 
 class LanguageOcaml(Language):
     lang = 'ocaml'
     dependencies = ["ocamlopt"]
 
     def compile(self, compilationParams, ownDir, sourceFiles, depFiles, evaluationContext, name='executable'):
-        if CFG_STATIC:
-            cmdLine = "%s -ccopt -static -o %s.exe %s" % (self.deppaths[0], name, ' '.join(sourceFiles))
+        if 'forceStatic' in compilationParams:
+            compStatic = compilationParams['forceStatic']
         else:
-            cmdLine = "%s -o %s.exe %s" % (self.deppaths[0], name, ' '.join(sourceFiles))
-        return Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+            compStatic = CFG_STATIC
+
+        linkArgs = ''.join(map(lambda a: '-ccopt %s ' % a, getLinkArgs(compStatic)))
+        cmdLine = "%s %s-o %s.exe %s" % (self.deppaths[0], linkArgs, name, ' '.join(sourceFiles))
+        return extractLinkStats(Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir))
 
 class LanguagePascal(Language):
     lang = 'pascal'
@@ -843,13 +1421,13 @@ class LanguageJavascool(LanguageJavaGcj):
 
 class LanguageScript(Language):
     lang = 'default-script'
-    dependencies = ["openssl"]
+    dependencies = []
     singleShebang = True # Should we execute directly the file if unique?
 
     def _scriptLines(self, sourceFiles, depFiles):
         """Returns the commands to execute the program when there are multiple
-        sourceFiles and depFiles. Added at the end of the self-extracting
-        archive (for language classes derived from LanguageScript)."""
+        sourceFiles and depFiles. Added at the end of the script linking the
+        packaged files (for language classes derived from LanguageScript)."""
         return map(lambda x: "/bin/sh %s $@\n" % x, sourceFiles)
 
     def _singleScriptShebang(self):
@@ -879,28 +1457,23 @@ class LanguageScript(Language):
             # We set the executable bits
             os.chmod(execPath, 493) # chmod 755
         else:
-            # Multiple files, we write a shell archive which extracts all
-            # source files and dependencies, then executes the scripts
-            sharPath = os.path.join(ownDir, name + '.exe')
-            sharFile = open(sharPath, 'w')
-            sharFile.write("#!/bin/sh\n")
+            # Multiple files, we package all source files and dependencies in
+            # a folder, and write a script which links them into the working
+            # folder, then executes the scripts
+            packageDir = makePackage(ownDir, sourceFiles + depFiles)
+            execPath = os.path.join(ownDir, name + '.exe')
+            execFile = open(execPath, 'w')
+            execFile.write("#!/bin/sh\n")
             for f in (sourceFiles + depFiles):
                 # Make dirs for the file
-                fileDirs = f.split('/')
-                depth = 1
-                while depth < len(fileDirs):
-                    sharFile.write("/bin/mkdir %s 2> /dev/null\n" % '/'.join(fileDirs[0:depth]))
-                    depth += 1
-
-                # Encode each file in base64, use openssl to extract them
-                sharFile.write("%s base64 -d -out \"%s\" 2> /dev/null <<EOF\n" % (self.deppaths[0], f))
-                sharFile.write(open(os.path.join(ownDir, f), 'r').read().encode("base64"))
-                sharFile.write("EOF\n")
-            # Execute the script(s) after self-extracting
-            sharFile.writelines(self._scriptLines(sourceFiles, depFiles))
-            sharFile.close()
-            # We set the archive executable bits
-            os.chmod(sharPath, 493) # chmod 755
+                if os.path.dirname(f):
+                    execFile.write("/bin/mkdir -p \"%s\" 2> /dev/null\n" % os.path.dirname(f))
+                execFile.write("/bin/ln -sf \"%s\" \"%s\"\n" % (os.path.join(packageDir, f), f))
+            # Execute the script(s)
+            execFile.writelines(self._scriptLines(sourceFiles, depFiles))
+            execFile.close()
+            # We set the executable bits
+            os.chmod(execPath, 493) # chmod 755
 
         # We build a dummy report for this "compilation"
         report = {'timeLimitMs': compilationParams['timeLimitMs'],
@@ -916,45 +1489,89 @@ class LanguageScript(Language):
 
 class LanguageJavaJdkOld(LanguageScript):
     lang = 'java8'
-    dependencies = ["openssl", "javac", "java"]
+    dependencies = ["javac", "java"]
     singleShebang = False
 
     def _scriptLines(self, sourceFiles, depFiles):
         if not len(sourceFiles): return []
         return [
             "mv %s Main.java\n" % sourceFiles[0],
-            "%s Main.java %s\n" % (self.deppaths[1], ' '.join(depFiles)),
-            "%s Main\n" % self.deppaths[2]
+            "%s Main.java %s\n" % (self.deppaths[0], ' '.join(depFiles)),
+            "%s Main\n" % self.deppaths[1]
             ]
 
 class LanguageJavaJdk(LanguageScript):
     lang = 'java8'
-    dependencies = ["openssl", "javac", "java"]
+    dependencies = ["javac", "java"]
     singleShebang = False
 
+    def _makeClassDataArchive(self, compilationParams, ownDir, evaluationContext):
+        """Packs the compiled classes into a jar and dumps a class data sharing
+        archive of them; returns whether the archive could be made."""
+        jarPath = which('jar')
+        classFiles = []
+        for root, dirs, files in os.walk(ownDir):
+            for f in files:
+                if f[-6:] == '.class':
+                    classFiles.append(os.path.relpath(os.path.join(root, f), ownDir))
+        if not (jarPath and 'Main.class' in classFiles):
+            return False
+
+        # Classes can only be archived from a jar
+        cmdLine = "%s cf app.jar %s" % (jarPath, ' '.join(classFiles))
+        report = Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        if isExecError(report):
+            return False
+
+        open(os.path.join(ownDir, 'app.classlist'), 'w').write(
+            ''.join(map(lambda f: f[:-6] + '\n', classFiles)))
+        cmdLine = "%s -Xshare:dump -XX:SharedClassListFile=app.classlist -XX:SharedArchiveFile=app.jsa -cp app.jar" % self.deppaths[1]
+        report = Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        for f in ['app.classlist', 'stdout', 'stderr']:
+            try:
+                os.unlink(os.path.join(ownDir, f))
+            except:
+                pass
+        if isExecError(report) or not os.path.isfile(os.path.join(ownDir, 'app.jsa')):
+            logging.info("Unable to make a class data sharing archive.")
+            try:
+                os.unlink(os.path.join(ownDir, 'app.jar'))
+            except:
+                pass
+            return False
+        return True
+
     def compile(self, compilationParams, ownDir, sourceFiles, depFiles, evaluationContext, name='executable'):
         # compile with javac then create a script out of all the files in the compilation folder
         cmdLine = "mv %s Main.java" % sourceFiles[0]
         Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
         # needs -d . or it compiles into the symlinked folder
-        cmdLine = "%s -d . Main.java %s" % (self.deppaths[1], ' '.join(depFiles))
+        cmdLine = "%s -d . Main.java %s" % (self.deppaths[0], ' '.join(depFiles))
         Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
 
+        self.classDataSharing = CFG_JAVA_APPCDS and self._makeClassDataArchive(compilationParams, ownDir, evaluationContext)
+
         sourceFiles = []
         for root, dirs, files in os.walk(ownDir):
             for f in files:
                 sourceFiles.append(os.path.relpath(os.path.join(root, f), ownDir))
-        return super(LanguageJavaJdk, self).compile(compilationParams, ownDir, sourceFiles, [], evaluationContext, name)
+        report = super(LanguageJavaJdk, self).compile(compilationParams, ownDir, sourceFiles, [], evaluationContext, name)
+        report['classDataSharing'] = self.classDataSharing
+        return report
 
     def _scriptLines(self, sourceFiles, depFiles):
         if not len(sourceFiles): return []
+        if self.classDataSharing:
+            return [
+                "%s %s -Xshare:auto -XX:SharedArchiveFile=app.jsa -cp app.jar Main\n" % (self.deppaths[1], CFG_JAVA_FLAGS)
+                ]
         return [
-            "%s Main\n" % self.deppaths[2]
+            "%s %s Main\n" % (self.deppaths[1], CFG_JAVA_FLAGS)
             ]
 
 class LanguageCplex(LanguageScript):
     lang = 'cplex'
-    dependencies = ["openssl"]
+    dependencies = []
     isolationPossible = False # Can't be isolated
     singleShebang = False # Don't generate a script if unique
 
@@ -970,17 +1587,17 @@ class LanguageCplex(LanguageScript):
 
 class LanguageOutput(LanguageScript):
     lang = 'output'
-    dependencies = ["openssl", "gzip"]
+    dependencies = ["base64", "gzip"]
     singleShebang = False
 
     def _scriptLines(self, sourceFiles, depFiles):
         if len(sourceFiles) == 0:
             return []
-        return ["( cat %s ; echo ) | openssl base64 -d 2> /dev/null | gunzip" % sourceFiles[0]]
+        return ["%s -d -i %s 2> /dev/null | gunzip" % (self.deppaths[0], sourceFiles[0])]
 
 class LanguageShell(LanguageScript):
     lang = 'sh'
-    dependencies = ["openssl"]
+    dependencies = []
 
     def _scriptLines(self, sourceFiles, depFiles):
         lines = [
@@ -995,28 +1612,50 @@ class LanguageShell(LanguageScript):
 
 class LanguageNodejs(LanguageScript):
     lang = 'js'
-    dependencies = ["openssl", "nodejs"]
+    dependencies = ["nodejs"]
 
     def _scriptLines(self, sourceFiles, depFiles):
         # TODO :: try to configure nodejs to use less memory
-        return map(lambda x: "%s %s $@\n" % (self.deppaths[1], x), sourceFiles)
+        return map(lambda x: "%s %s $@\n" % (self.deppaths[0], x), sourceFiles)
 
     def _singleScriptShebang(self):
-        return "#!%s" % self.deppaths[1]
+        return "#!%s" % self.deppaths[0]
 
 class LanguagePhp(LanguageScript):
     lang = 'php'
-    dependencies = ["openssl", "php5"]
+    dependencies = ["php5"]
 
     def _scriptLines(self, sourceFiles, depFiles):
-        return map(lambda x: "%s --file %s $@\n" % (self.deppaths[1], x), sourceFiles)
+        return map(lambda x: "%s --file %s $@\n" % (self.deppaths[0], x), sourceFiles)
 
     def _singleScriptShebang(self):
-        return "#!%s" % self.deppaths[1]
+        return "#!%s" % self.deppaths[0]
 
 class LanguagePython2(LanguageScript):
     lang = 'py2'
-    dependencies = ["openssl", "python2.7"]
+    dependencies = ["python2.7"]
+
+    # Script compiling the files given as arguments to bytecode, and printing
+    # the path to the bytecode of each file; the first file is the main
+    # script, and its bytecode is written next to it so that it can be
+    # executed directly
+    precompileScript = """import json, py_compile, sys
+bytecodes = {}
+for f in sys.argv[1:]:
+    cfile = f + 'c'
+    if f != sys.argv[1]:
+        try:
+            import importlib.util
+            cfile = importlib.util.cache_from_source(f)
+        except ImportError:
+            pass
+    try:
+        py_compile.compile(f, cfile=cfile, dfile=f, doraise=True)
+        bytecodes[f] = cfile
+    except Exception:
+        pass
+print(json.dumps(bytecodes))
+"""
 
     def _getPossiblePaths(self, baseDir, filename):
         return [
@@ -1027,30 +1666,65 @@ class LanguagePython2(LanguageScript):
             # We search for [name] in the libs directory
             os.path.join(baseDir, 'libs', filename)]
 
-    def _scriptLines(self, sourceFiles, depFiles):
-        return ["%s %s $@\n" % (self.deppaths[1], ' '.join(sourceFiles))]
+    def _precompile(self, compilationParams, ownDir, pyFiles, evaluationContext):
+        """Compiles pyFiles to bytecode, returns a dict associating each file
+        compiled to the path of its bytecode."""
+        open(os.path.join(ownDir, 'precompile.py'), 'w').write(self.precompileScript)
+        cmdLine = "%s precompile.py %s" % (self.deppaths[0], ' '.join(pyFiles))
+        report = Execution(None, compilationParams, cmdLine, evaluationContext).execute(ownDir)
+        for f in ['precompile.py', 'stdout', 'stderr']:
+            try:
+                os.unlink(os.path.join(ownDir, f))
+            except:
+                pass
+        try:
+            return json.loads(report['stdout']['data'])
+        except:
+            logging.info("Unable to precompile Python files.")
+            return {}
 
-    def _singleScriptShebang(self):
-        return "#!%s" % self.deppaths[1]
+    def compile(self, compilationParams, ownDir, sourceFiles, depFiles, evaluationContext, name='executable'):
+        self.mainBytecode = None
+        precompile = compilationParams.get('forcePrecompile', CFG_PYTHON_PRECOMPILE)
+        if not precompile or len(sourceFiles) == 0:
+            return super(LanguagePython2, self).compile(compilationParams, ownDir, sourceFiles, depFiles, evaluationContext, name)
+
+        if len(sourceFiles) == 1 and len(depFiles) == 0:
+            # Rewrite the script as it would be in the single file
+            # executable, so that line numbers stay the same
+            sourcePath = os.path.join(ownDir, sourceFiles[0])
+            source = open(sourcePath, 'r')
+            sourceFirstLine = source.readline()
+            sourceData = self._singleScriptShebang() + "\n"
+            if sourceFirstLine[:2] != '#!':
+                sourceData += sourceFirstLine
+            sourceData += source.read()
+            source.close()
+            os.unlink(sourcePath)
+            open(sourcePath, 'w').write(sourceData)
 
-class LanguagePython3(LanguageScript):
-    lang = 'py3'
-    dependencies = ["openssl", "python3"]
+        pyFiles = [sourceFiles[0]] + filter(lambda f: f[-3:] == '.py', depFiles)
+        bytecodes = self._precompile(compilationParams, ownDir, pyFiles, evaluationContext)
+        self.mainBytecode = bytecodes.get(sourceFiles[0])
+        bytecodeFiles = sorted(set(bytecodes.values()))
 
-    def _getPossiblePaths(self, baseDir, filename):
-        return [
-            # We search for [language]-[name] in the libs directory
-            os.path.join(baseDir, 'libs', '%s-%s' % (self.lang, filename)),
-            # For Python langs, we search for run-[name] in the libs directory
-            os.path.join(baseDir, 'libs', 'run-%s' % filename),
-            # We search for [name] in the libs directory
-            os.path.join(baseDir, 'libs', filename)]
+        # The executable is always made from multiple files
+        return super(LanguagePython2, self).compile(compilationParams, ownDir, sourceFiles, depFiles + bytecodeFiles, evaluationContext, name)
 
     def _scriptLines(self, sourceFiles, depFiles):
-        return ["%s %s $@\n" % (self.deppaths[1], ' '.join(sourceFiles))]
+        if self.mainBytecode:
+            # Execute directly the bytecode of the main script
+            return ["exec %s %s %s %s $@\n" % (self.deppaths[0], CFG_PYTHON_FLAGS, self.mainBytecode, ' '.join(sourceFiles[1:]))]
+        return ["%s %s %s $@\n" % (self.deppaths[0], CFG_PYTHON_FLAGS, ' '.join(sourceFiles))]
 
     def _singleScriptShebang(self):
-        return "#!%s" % self.deppaths[1]
+        if CFG_PYTHON_FLAGS:
+            return "#!%s %s" % (self.deppaths[0], CFG_PYTHON_FLAGS)
+        return "#!%s" % self.deppaths[0]
+
+class LanguagePython3(LanguagePython2):
+    lang = 'py3'
+    dependencies = ["python3"]
 
 
 class Program():
@@ -1069,7 +1743,12 @@ class Program():
         self.name = name
         self.executablePath = os.path.join(self.ownDir, self.name + '.exe')
 
-        self.cacheHandle = evaluationContext['cache'].getHandle(compilationDescr['files'] + compilationDescr.get('dependencies', []))
+        # Compilation options changing the executable also identify the
+        # program in the cache
+        compOptions = ['%s:%s' % (k, json.dumps(compilationParams[k]))
+            for k in ['commandLine', 'executionArgs', 'forcePrecompile', 'forceStatic']
+            if k in compilationParams]
+        self.cacheHandle = evaluationContext['cache'].getHandle(compilationDescr['files'] + compilationDescr.get('dependencies', []), compOptions)
 
         self.compiled = False
         self.triedCompile = False
@@ -1150,7 +1829,13 @@ class Program():
         self.populateSources()
 
         # We call the language-specific compilation process
+        startTime = time.time()
         report = self.language.compile(self.compilationParams, self.ownDir, self.sourceFiles, self.depFiles, self.evaluationContext, self.name)
+        report['compilationTimeMs'] = int((time.time() - startTime) * 1000)
+        METRICS.observe('taskgrader_compilation_duration_seconds', time.time() - startTime,
+            {'language': self.compilationDescr['language']})
+        if os.path.isfile(self.executablePath):
+            report['executableSizeKb'] = os.path.getsize(self.executablePath) / 1024
 
         if isExecError(report, checkContinue=False) and self.compilationParams.get('continueOnError', False):
             # Compilation didn't succeed but the continueOnError flag is set
@@ -1221,6 +1906,59 @@ class Program():
                 self.evaluationContext, language=self.compilationDescr['language'])
         self.executionParams = executionParams
 
+    def _isImpliedReport(self, report):
+        """Check whether the result of an execution with other limits,
+        described by report, is also the result with the current limits."""
+        execution = self.execution
+        # The memory used is only measured accurately by control groups;
+        # otherwise memory limits can't be compared
+        if (report['realMemoryLimitKb'] != execution.realMemoryLimitKb
+                and not (CFG_CONTROLGROUPS and isinstance(execution, IsolatedExecution))):
+            return False
+
+        limits = [(report['realTimeLimitMs'], report.get('realTimeTakenMs', -1), execution.realTimeLimit),
+            (report['realMemoryLimitKb'], report.get('memoryUsedKb', -1), execution.realMemoryLimitKb)]
+        # A limit of 0 means no limit
+        limits = [(oldLimit if oldLimit > 0 else float('inf'), used, newLimit if newLimit > 0 else float('inf'))
+            for (oldLimit, used, newLimit) in limits]
+
+        if report['wasKilled']:
+            # Killed at some limits, it would also be killed with lower ones
+            return all([newLimit <= oldLimit for (oldLimit, used, newLimit) in limits])
+        elif report.get('exitCode', -1) == 0 and report.get('exitSig', -1) <= 0:
+            # If it ended successfully using its resources well within both
+            # limits, they didn't have any effect
+            return all([newLimit == oldLimit
+                    or (used >= 0 and used * CFG_CACHE_LIMITS_MARGIN <= min(oldLimit, newLimit))
+                for (oldLimit, used, newLimit) in limits])
+        else:
+            # A failed execution may have failed because of the limits
+            return all([newLimit == oldLimit for (oldLimit, used, newLimit) in limits])
+
+    def _loadLimitsVariant(self, cachef, workingDir):
+        """Look for a cached execution with other limits implying the result
+        with the current limits. If one is found, its files are loaded into
+        workingDir, the report and files are saved into cachef, and the report
+        is returned; else returns None."""
+        for variant in self.cacheHandle.getLimitsVariants(cachef):
+            try:
+                report = variant.loadReport()
+                if not self._isImpliedReport(report):
+                    continue
+            except:
+                continue
+
+            logging.debug("Result implied by the version in cache #%d with other limits" % variant.cacheId)
+            report.pop('continueOnError', None)
+            report.update(self.execution.baseReport)
+            variant.loadFiles(workingDir)
+            cachef.addReport(report)
+            for f in variant.files:
+                cachef.addFile(os.path.join(workingDir, f))
+            cachef.save()
+            return report
+        return None
+
     def execute(self, workingDir, args=None, stdinFile=None, stdoutFile=None, stderrFile=None, otherInputs=[], outputFiles=[]):
         """Execute the Program in workingDir, with command-line arguments args.
         otherInputs represent the files the Program execution will depend on,
@@ -1248,7 +1986,15 @@ class Program():
             if stdinFile: inputFiles.append(stdinFile)
             cachef = self.cacheHandle.getCacheFolder('execution-%s-%s' % (self.compilationDescr['language'], self.name), args=args, execParams=self.executionParams, inputFiles=inputFiles)
 
-            if cachef.isCached:
+            limitsReport = None
+            if not cachef.isCached and CFG_CACHE_LIMITS_REUSE:
+                # The result may be implied by an execution with other limits
+                limitsReport = self._loadLimitsVariant(cachef, workingDir)
+
+            if limitsReport:
+                report = limitsReport
+                report['wasCached'] = True
+            elif cachef.isCached:
                 # It is cached, we load the report and output files
                 logging.debug("Version in cache")
                 report = cachef.loadReport()
@@ -1257,7 +2003,10 @@ class Program():
             else:
                 logging.debug("No version in cache")
                 # It is not cached, we execute the program
+                startTime = time.time()
                 report = self.execution.execute(workingDir, args, stdinFile, stdoutFile, stderrFile)
+                METRICS.observe('taskgrader_execution_duration_seconds', time.time() - startTime,
+                    {'language': self.compilationDescr['language']})
                 # Save the report and output files
                 cachef.addReport(report)
                 if stdoutFile:
@@ -1270,7 +2019,10 @@ class Program():
         else:
             # We don't use cache at all
             logging.debug("Not using cache")
+            startTime = time.time()
             report = self.execution.execute(workingDir, args, stdinFile, stdoutFile, stderrFile)
+            METRICS.observe('taskgrader_execution_duration_seconds', time.time() - startTime,
+                {'language': self.compilationDescr['language']})
 
         if isExecError(report):
             logging.info("Execution failed.")
@@ -1280,6 +2032,181 @@ class Program():
         return report
 
 
+class BundledProgram(Program):
+    """Represents a program precompiled in a task bundle. The compilation only
+    imports the executable from the bundle."""
+
+    def __init__(self, bundleDescr, ownDir, baseDir, evaluationContext, name='executable'):
+        """bundleDescr is the description of the program in the bundle
+        manifest, as written by prepareTask."""
+        Program.__init__(self, bundleDescr['compilationDescr'], bundleDescr['compilationExecution'], ownDir, baseDir, evaluationContext, name)
+        self.bundleDescr = bundleDescr
+        # CFG_NOISOLATE was checked against the original source files
+        self.isolate = self.isolate and bundleDescr['isolate']
+
+    def compile(self):
+        """Import the precompiled executable from the bundle."""
+        logging.info("Importing Program `%s` from task bundle" % self.name)
+
+        symlink(self.compilationDescr['files'][0]['path'], self.executablePath)
+
+        report = {}
+        report.update(self.bundleDescr['compilationReport'])
+        report['wasCached'] = True
+
+        self.compiled = True
+        self.triedCompile = True
+
+        return report
+
+
+class BuiltinChecker(object):
+    """Represents a checker built into the taskgrader. It grades the solution
+    output in-process, without any compilation nor isolated execution, and
+    makes reports in the same format as the ones of a checker program."""
+
+    def __init__(self, checkerDescr, ownDir, evaluationContext, name='checker'):
+        """checkerDescr is the checker description from the input JSON,
+        with the kind of built-in checker under the key 'builtin'."""
+        if not BUILTIN_CHECKERS.has_key(checkerDescr['builtin']):
+            raise Exception("Unknown built-in checker '%s'." % checkerDescr['builtin'])
+        logging.info("Creating new BuiltinChecker `%s` of kind `%s`" % (name, checkerDescr['builtin']))
+        self.kind = checkerDescr['builtin']
+        self.options = checkerDescr.get('options', {})
+        self.ownDir = ownDir
+        self.evaluationContext = evaluationContext
+        self.name = name
+        self.executionParams = {}
+
+        self.compiled = False
+        self.triedCompile = False
+        # Nothing is executed in the isolate
+        self.isolate = False
+
+    def _makeReport(self, commandLine, timeTakenMs, exitCode):
+        """Make a report in the format of an execution report."""
+        return {
+            'timeLimitMs': self.executionParams.get('timeLimitMs', -1),
+            'memoryLimitKb': self.executionParams.get('memoryLimitKb', -1),
+            'realMemoryLimitKb': -1,
+            'realTimeLimitMs': -1,
+            'commandLine': commandLine,
+            'timeTakenMs': timeTakenMs,
+            'realTimeTakenMs': timeTakenMs,
+            'memoryUsedKb': -1,
+            'wasCached': False,
+            'wasKilled': False,
+            'exitCode': exitCode,
+            'exitSig': -1}
+
+    def compile(self):
+        """Built-in checkers don't need any compilation; returns a report of
+        a successful compilation."""
+        self.compiled = True
+        self.triedCompile = True
+
+        report = self._makeReport('builtin:%s' % self.kind, 0, 0)
+        report['stdout'] = {'name': 'stdout', 'sizeKb': 0, 'data': '', 'wasTruncated': False}
+        report['stderr'] = {'name': 'stderr', 'sizeKb': 0, 'data': '', 'wasTruncated': False}
+        return report
+
+    def prepareExecution(self, executionParams):
+        """Set the executionParams for the checker; only the limits and the
+        truncation of outputs are used."""
+        self.executionParams = executionParams or {}
+
+    def execute(self, workingDir, args=None, stdinFile=None, stdoutFile=None, otherInputs=None):
+        """Grade a solution output, args being the command-line which would
+        have been given to a checker program, "test.solout test.in test.out".
+        The grading is written to stdoutFile."""
+        (solPath, inPath, outPath) = [os.path.join(workingDir, f) for f in args.split()]
+        if stdoutFile is None:
+            stdoutFile = os.path.join(workingDir, 'checker.stdout')
+        stderrFile = os.path.join(workingDir, 'checker.stderr')
+
+        startTime = time.time()
+        try:
+            with profilePhase('builtinChecker'):
+                (grade, message) = BUILTIN_CHECKERS[self.kind](solPath, inPath, outPath, self.options)
+            stdout = "%d\n%s" % (grade, message)
+            stderr = ''
+            exitCode = 0
+        except:
+            # Same output as a checker program failing to check
+            stdout = "0\nError during solution check, please contact an administrator.\n"
+            stderr = traceback.format_exc()
+            exitCode = 1
+        timeTakenMs = (time.time() - startTime) * 1000
+
+        open(stdoutFile, 'w').write(stdout)
+        open(stderrFile, 'w').write(stderr)
+
+        report = self._makeReport('builtin:%s %s' % (self.kind, args), timeTakenMs, exitCode)
+        report['files'] = []
+        report['stdout'] = capture(stdoutFile, name='stdout',
+            truncateSize=self.executionParams.get('stdoutTruncateKb', -1) * 1024)
+        report['stderr'] = capture(stderrFile, name='stderr',
+            truncateSize=self.executionParams.get('stderrTruncateKb', -1) * 1024)
+        return report
+
+
+def builtinCheckDiff(solPath, inPath, outPath, options):
+    """Built-in checker comparing the outputs line by line, ignoring
+    whitespace changes and blank lines unless the options say otherwise."""
+    (grade, result) = output_diff.diff(solPath, outPath, options)
+    if grade == 100:
+        return (100, '')
+    return (grade, json.dumps(result) + '\n')
+
+
+def builtinCheckExact(solPath, inPath, outPath, options):
+    """Built-in checker comparing the outputs line by line, exactly."""
+    exactOptions = {'ignoreSpaceChange': False, 'ignoreBlankLines': False}
+    exactOptions.update(options)
+    return builtinCheckDiff(solPath, inPath, outPath, exactOptions)
+
+
+def readTokens(path):
+    """Read the whitespace-separated tokens of a file, with their line
+    numbers."""
+    for (lineNb, line) in enumerate(open(path, 'r')):
+        for token in line.split():
+            yield (lineNb + 1, token)
+
+
+def builtinCheckFloat(solPath, inPath, outPath, options):
+    """Built-in checker comparing the outputs token by token; tokens which
+    are numbers are compared with an absolute or relative tolerance."""
+    tolerance = options.get('tolerance', 1e-6)
+    solTokens = readTokens(solPath)
+    for (expLineNb, expToken) in readTokens(outPath):
+        try:
+            (solLineNb, solToken) = solTokens.next()
+        except StopIteration:
+            return (0, "Output is too short: expected `%s` on line %d.\n" % (expToken, expLineNb))
+
+        if solToken == expToken:
+            continue
+        try:
+            (solValue, expValue) = (float(solToken), float(expToken))
+            if abs(solValue - expValue) <= tolerance * max(1.0, abs(expValue)):
+                continue
+        except ValueError:
+            pass
+        return (0, "Line %d: expected `%s`, got `%s`.\n" % (solLineNb, expToken[:100], solToken[:100]))
+
+    for (solLineNb, solToken) in solTokens:
+        return (0, "Output is too long: unexpected `%s` on line %d.\n" % (solToken[:100], solLineNb))
+    return (100, '')
+
+
+# Built-in checkers, selected with the key 'builtin' of the checker description
+BUILTIN_CHECKERS = {
+    'diff': builtinCheckDiff,
+    'exact': builtinCheckExact,
+    'float': builtinCheckFloat}
+
+
 def multiChecker(workingDir, checkList, checker, executionParams, evaluationContext):
     """Do multiple checks in the same isolated execution."""
     if len(checkList) == 0:
@@ -1393,47 +2320,164 @@ def multiChecker(workingDir, checkList, checker, executionParams, evaluationCont
     return allReports
 
 
-def preprocessJson(json, varData):
+def preprocessJson(json, varData, dictHook=None):
     """Preprocess some JSON data, replacing variables with their values.
     There's no checking of the type of values in the variables; the resulting
     JSON is supposed to be checked against a JSON schema.
     varData represents the variable data; all values written as '@varname' in
-    the JSON will be replaced by varData['varname']."""
-    if (type(json) is str or type(json) is unicode) and len(json) > 0:
-        if json[0] == '@':
+    the JSON will be replaced by varData['varname'], and $BUILD_PATH,
+    $ROOT_PATH and $TASK_PATH in strings by their value in varData.
+    Each variable is only expanded once, the resulting data being shared by
+    all its occurrences. dictHook, if given, is called on each dict once its
+    values are expanded, and returns the dict to use instead."""
+    resolved = {} # Expanded value of each variable already met
+    resolving = set() # Variables being expanded
+    pathValues = {} # Expanded value of each path variable
+
+    def pathValue(match):
+        name = match.group(1)
+        if not pathValues.has_key(name):
+            if not varData.has_key(name):
+                return match.group(0)
+            if name in resolving:
+                raise Exception("Variable `%s` references itself." % name)
+            resolving.add(name)
+            pathValues[name] = PATHVAR_RE.sub(pathValue, varData[name])
+            resolving.discard(name)
+        return pathValues[name]
+
+    # Stack of the dicts and lists being expanded
+    stack = []
+
+    def enter(value, key):
+        """Expand value if possible, returning (True, newValue); else start
+        expanding the dict or list value, and return (False, None)."""
+        varNames = []
+        while isinstance(value, basestring) and value[:1] == '@':
             # It's a variable, we replace it with the JSON data
             # It will return an error if the variable doesn't exist, it's intended
-            varName = json[1:]
-            if varData.has_key(varName):
-                return preprocessJson(varData[varName], varData)
-            else:
+            varName = value[1:]
+            if resolved.has_key(varName):
+                value = resolved[varName]
+                for name in varNames:
+                    resolved[name] = value
+                return (True, value)
+            if varName in resolving or varName in varNames:
+                raise Exception("Variable `%s` references itself." % varName)
+            if not varData.has_key(varName):
                 raise Exception("varData doesn't have key `%s`, keys of varData:\n%s" % (varName, str(varData.keys())))
-        elif '$' in json:
-            if '$BUILD_PATH' in json:
-                return preprocessJson(json.replace('$BUILD_PATH', varData['BUILD_PATH']), varData)
-            elif '$ROOT_PATH' in json:
-                return preprocessJson(json.replace('$ROOT_PATH', varData['ROOT_PATH']), varData)
-            elif '$TASK_PATH' in json:
-                return preprocessJson(json.replace('$TASK_PATH', varData['TASK_PATH']), varData)
-            else:
-                return json
+            varNames.append(varName)
+            value = varData[varName]
+
+        if type(value) is dict:
+            items = value.iteritems()
+            newValue = {}
+        elif type(value) is list:
+            items = enumerate(value)
+            newValue = []
         else:
-            return json
-    elif type(json) is dict:
-        # It's a dict, we process the values in it
-        newjson = {}
-        for k in json.keys():
-            newjson[k] = preprocessJson(json[k], varData)
-        return newjson
-    elif type(json) is list:
-        # It's a list, we filter the values in it
-        newjson = map(lambda x: preprocessJson(x, varData), json)
-        # We remove None values, which are probably undefined variables
-        while None in newjson:
-            newjson.remove(None)
-        return newjson
-    else:
-        return json
+            if isinstance(value, basestring) and '$' in value:
+                value = PATHVAR_RE.sub(pathValue, value)
+            for name in varNames:
+                resolved[name] = value
+            return (True, value)
+
+        resolving.update(varNames)
+        stack.append((items, newValue, key, varNames))
+        return (False, None)
+
+    def store(container, key, value):
+        if type(container) is dict:
+            container[key] = value
+        elif value is not None:
+            # We remove None values, which are probably undefined variables
+            container.append(value)
+
+    (done, newJson) = enter(json, None)
+    while not done:
+        (items, newValue, key, varNames) = stack[-1]
+        for (itemKey, item) in items:
+            (itemDone, newItem) = enter(item, itemKey)
+            if not itemDone:
+                break
+            store(newValue, itemKey, newItem)
+        else:
+            # All values of this dict or list are expanded
+            stack.pop()
+            if dictHook and type(newValue) is dict:
+                newValue = dictHook(newValue)
+            for name in varNames:
+                resolved[name] = newValue
+                resolving.discard(name)
+            if stack:
+                store(stack[-1][1], key, newValue)
+            else:
+                (done, newJson) = (True, newValue)
+
+    return newJson
+
+
+def runParallel(tasks, jobs):
+    """Call each function of the list tasks, running at most jobs of them at
+    the same time in separate threads. Returns the list of their results, in
+    the same order as tasks. If some functions raised an exception, the
+    exception of the first of them is raised again once all tasks are
+    finished."""
+    if jobs <= 1 or len(tasks) <= 1:
+        return map(lambda task: task(), tasks)
+
+    results = [None] * len(tasks)
+    errors = []
+    taskQueue = Queue.Queue()
+    for (i, task) in enumerate(tasks):
+        taskQueue.put((i, task))
+
+    def worker():
+        while True:
+            try:
+                (i, task) = taskQueue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = task()
+            except:
+                errors.append((i, sys.exc_info()))
+
+    threads = []
+    for i in range(min(jobs, len(tasks))):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        reraise(min(errors, key=lambda e: e[0])[1])
+
+    return results
+
+
+def callAndCatch(func):
+    """Call func, returns a tuple (result, None), or (None, exc_info) if func
+    raised an exception."""
+    try:
+        return (func(), None)
+    except:
+        return (None, sys.exc_info())
+
+
+def reraise(excInfo):
+    """Raise again an exception caught as excInfo (from sys.exc_info)."""
+    raise excInfo[0], excInfo[1], excInfo[2]
+
+
+def reraiseCaught(callResult):
+    """Returns the result of a call made through callAndCatch, raising again
+    the exception if there was one."""
+    (result, excInfo) = callResult
+    if excInfo:
+        reraise(excInfo)
+    return result
 
 
 def waitWithTimeout(subProc, timeout=0):
@@ -1541,6 +2585,7 @@ def isExecError(executionReport, checkContinue=True):
             not (checkContinue and executionReport.get('continueOnError', False)))
 
 
+@profiled('capture')
 def capture(path, name='', truncateSize=-1):
     """Capture a file contents for inclusion into the output JSON as a
     captureReport object."""
@@ -1559,6 +2604,103 @@ def capture(path, name='', truncateSize=-1):
     return report
 
 
+def normalizedChunks(data):
+    """Iterate over data by chunks of about PRECHECK_CHUNK bytes, cut on
+    whitespaces, each chunk being normalized as its tokens followed by a
+    space."""
+    pos = 0
+    while pos < len(data):
+        end = pos + PRECHECK_CHUNK
+        if end < len(data):
+            # Don't cut a token
+            match = SPACE_RE.search(data, end)
+            end = match.start() if match else len(data)
+        tokens = data[pos:end].split()
+        if tokens:
+            yield ' '.join(tokens) + ' '
+        pos = end + 1
+
+
+@profiled('preCheck')
+def sameOutputs(solPath, outPath, mode='exact'):
+    """Compare the solution output with the expected output, with mmap to
+    avoid reading them in memory. mode is 'exact' for a byte-exact
+    comparison, or 'spaces' to compare the sequences of whitespace-separated
+    tokens."""
+    solSize = os.path.getsize(solPath)
+    outSize = os.path.getsize(outPath)
+    if mode == 'exact' and solSize != outSize:
+        return False
+    if solSize == 0 or outSize == 0:
+        # Empty files can't be mapped
+        if mode == 'exact':
+            return True
+        return open(solPath, 'r').read().split() == open(outPath, 'r').read().split()
+
+    solFile = open(solPath, 'r')
+    outFile = open(outPath, 'r')
+    solMap = mmap.mmap(solFile.fileno(), 0, access=mmap.ACCESS_READ)
+    outMap = mmap.mmap(outFile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        # Compare by chunks, identical outputs being the most common case
+        same = (solSize == outSize)
+        pos = 0
+        while same and pos < solSize:
+            same = (solMap[pos:pos+PRECHECK_CHUNK] == outMap[pos:pos+PRECHECK_CHUNK])
+            pos += PRECHECK_CHUNK
+        if same or mode == 'exact':
+            return same
+
+        # Compare the outputs normalized by chunks
+        solChunks = normalizedChunks(solMap)
+        outChunks = normalizedChunks(outMap)
+        (solBuf, outBuf) = ('', '')
+        while True:
+            if not solBuf:
+                solBuf = next(solChunks, None)
+            if not outBuf:
+                outBuf = next(outChunks, None)
+            if solBuf is None or outBuf is None:
+                return solBuf is None and outBuf is None
+            n = min(len(solBuf), len(outBuf))
+            if solBuf[:n] != outBuf[:n]:
+                return False
+            (solBuf, outBuf) = (solBuf[n:], outBuf[n:])
+    finally:
+        solMap.close()
+        outMap.close()
+        solFile.close()
+        outFile.close()
+
+
+def makeCheckerReport(stdoutData, commandLine=''):
+    """Make a report in the format of a checker report, for checks done
+    without the checker."""
+    return {
+        'commandLine': commandLine,
+        'timeLimitMs': 0,
+        'memoryLimitKb': 0,
+        'realMemoryLimitKb': 0,
+        'realTimeLimitMs': 0,
+        'memoryUsedKb': 0,
+        'timeTakenMs': 0,
+        'realTimeTakenMs': 0,
+        'wasCached': False,
+        'wasKilled': False,
+        'exitCode': 0,
+        'stdout': {
+            'name': 'stdout',
+            'sizeKb': (len(stdoutData) + 1023) / 1024,
+            'data': stdoutData,
+            'wasTruncated': False},
+        'stderr': {
+            'name': 'stderr',
+            'sizeKb': 0,
+            'data': '',
+            'wasTruncated': False}
+        }
+
+
 def removeFeedbackReport(report, noFeedback=False, isChecker=False, keepStderr=False):
     """Remove the feedback from an execution report, if the test has hidden
     results."""
@@ -1660,12 +2802,359 @@ def transformReport(report, transformations, programType='', execType=''):
     return report
 
 
+def generateTestCase(gen, tc, generator, outputGenerator, caseDir):
+    """Generate the test case tc of the generation gen in caseDir, with
+    generator and, if not None, outputGenerator. Returns the generation
+    report, the list of generated test files as (path, name) pairs, and the
+    (empty) list of generated lib files."""
+    os.mkdir(caseDir)
+    genReport = {'id': "%s.%s" % (gen['id'], tc['name'])}
+    testFiles = []
+    if outputGenerator:
+        # We also have an output generator, we generate `name`.in and `name`.out
+        genReport['generatorExecution'] = generator.execute(caseDir, args=tc['params'], stdoutFile=caseDir + tc['name'] + '.in')
+        if not isExecError(genReport['generatorExecution']):
+            testFiles.append((caseDir + tc['name'] + '.in', tc['name'] + '.in'))
+
+        genReport['outputGeneratorExecution'] = outputGenerator.execute(caseDir, args=tc['params'], stdoutFile=caseDir + tc['name'] + '.out')
+        if not isExecError(genReport['outputGeneratorExecution']):
+            testFiles.append((caseDir + tc['name'] + '.out', tc['name'] + '.out'))
+    else:
+        # We only have one generator, we assume `name` is the name of the test file to generate
+        genReport['generatorExecution'] = generator.execute(caseDir, args=tc['params'], stdoutFile=caseDir + tc['name'])
+        if not isExecError(genReport['generatorExecution']):
+            testFiles.append((caseDir + tc['name'], tc['name']))
+
+    return (genReport, testFiles, [])
+
+
+def generateFiles(gen, generator, outputGenerator, genDir):
+    """Execute the generators of the generation gen (which doesn't list test
+    cases) in genDir. Returns the generation report, the list of generated
+    test files as (path, name) pairs, and the list of generated lib files."""
+    genReport = {'id': gen['id']}
+    genReport['generatorExecution'] = generator.execute(genDir,
+        outputFiles=['*.in', '*.out', '*.params', '*.h', '*.hpp', '*.o', '*.java', '*.ml', '*.mli', '*.pas', '*.py'])
+    if outputGenerator:
+        # We also have an output generator
+        genReport['outputGeneratorExecution'] = outputGenerator.execute(genDir, outputFiles=['*.out', '*.params'])
+
+    testFiles = map(lambda f: (f, os.path.basename(f)), globOfGlobs(genDir, ['*.in', '*.out', '*.params']))
+    libFiles = globOfGlobs(genDir, ['*.h', '*.hpp', '*.o', '*.java', '*.ml', '*.mli', '*.pas', '*.py'])
+    return (genReport, testFiles, libFiles)
+
+
+def replaceGeneratedFile(path):
+    """Remove the file or symlink at path, if any, so that a later generation
+    can replace it without modifying the file it was copied or linked from."""
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def isGenerationError(genReport):
+    """Returns whether one of the executions of a generation report returned
+    an error."""
+    return (isExecError(genReport['generatorExecution'])
+            or ('outputGeneratorExecution' in genReport
+                and isExecError(genReport['outputGeneratorExecution'])))
+
+
+def getTestCaseSetCache(gen, generator, outputGenerator, evaluationContext):
+    """Returns the CacheFolder for the whole set of test cases of the
+    generation gen, or None if the generation doesn't use the cache. On a
+    cache hit, all test files are loaded at once instead of looking up each
+    execution of the generators."""
+    if not gen['genExecution'].get('useCache', True):
+        return None
+    genPrograms = [generator]
+    if outputGenerator:
+        if not gen['outGenExecution'].get('useCache', True):
+            return None
+        genPrograms.append(outputGenerator)
+
+    # The cache entry depends on all the generators files, on the test cases
+    # and on the execution parameters
+    cacheHandle = evaluationContext['cache'].getHandle(
+        sum(map(lambda p: p.compilationDescr['files'] + p.compilationDescr.get('dependencies', []), genPrograms), []))
+    setDescr = json.dumps({
+        'testCases': gen['testCases'],
+        'genExecution': gen['genExecution'],
+        'outGenExecution': gen.get('outGenExecution', None)}, sort_keys=True)
+    return cacheHandle.getCacheFolder('generation-%s' % gen['id'],
+        args=hashlib.md5(setDescr).hexdigest(), execParams=gen['genExecution'])
+
+
+def taskRevision(taskPath, rootPath, defaultParams):
+    """Compute a revision identifier for the task in taskPath, from the names
+    and contents of all its files, and of the files outside of taskPath
+    referenced through a `path` in defaultParams."""
+    revHash = hashlib.md5()
+    for (dirpath, dirnames, filenames) in os.walk(taskPath):
+        # Walk in a predictable order, ignoring version control folders
+        dirnames[:] = sorted(filter(lambda d: d not in ['.git', '.svn'], dirnames))
+        for f in sorted(filenames):
+            filePath = os.path.join(dirpath, f)
+            revHash.update(os.path.relpath(filePath, taskPath) + '\0')
+            revHash.update(hashlib.md5(open(filePath, 'rb').read()).hexdigest())
+
+    # Files referenced by the task, such as a checker in $ROOT_PATH
+    pathValues = {'ROOT_PATH': rootPath, 'TASK_PATH': taskPath}
+    refPaths = set()
+    stack = [defaultParams]
+    while stack:
+        elem = stack.pop()
+        if type(elem) is dict:
+            if isinstance(elem.get('path'), basestring):
+                path = PATHVAR_RE.sub(lambda m: pathValues.get(m.group(1), m.group(0)), elem['path'])
+                path = os.path.abspath(path)
+                if os.path.isfile(path) and not path.startswith(taskPath + os.sep):
+                    refPaths.add(path)
+            stack.extend(elem.values())
+        elif type(elem) is list:
+            stack.extend(elem)
+    for path in sorted(refPaths):
+        revHash.update(path + '\0')
+        revHash.update(hashlib.md5(open(path, 'rb').read()).hexdigest())
+
+    return revHash.hexdigest()
+
+
+def prepareTask(taskPath):
+    """Prepare a task bundle for the task in taskPath. The generators, the
+    sanitizer and the checker are compiled, the generations are executed, and
+    the resulting executables and test files are stored in a bundle folder
+    along with a manifest. Returns the manifest."""
+    taskPath = os.path.abspath(taskPath)
+    defParamsPath = os.path.join(taskPath, 'defaultParams.json')
+    if not os.path.isfile(defParamsPath):
+        raise Exception("Task path `%s` invalid (no defaultParams.json)." % taskPath)
+    try:
+        defaultParams = json.load(open(defParamsPath, 'r'))
+    except:
+        raise Exception("defaultParams.json in `%s` is invalid." % taskPath)
+
+    rootPath = defaultParams.get('rootPath', '')
+    if not (isinstance(rootPath, basestring) and os.path.isdir(rootPath)):
+        rootPath = taskPath
+
+    revision = taskRevision(taskPath, rootPath, defaultParams)
+    bundleDir = os.path.join(CFG_BUNDLESDIR, '%s-%s/' % (os.path.basename(taskPath), revision))
+
+    # Check whether this revision of the task was already prepared
+    try:
+        manifest = json.load(open(os.path.join(bundleDir, 'manifest.json'), 'r'))
+        if manifest['bundleVersion'] == TASKBUNDLE_VERSION:
+            logging.info("Task bundle `%s` already prepared." % bundleDir)
+            return manifest
+    except:
+        pass
+
+    # Evaluate the task without any solution; the build folder is needed, so
+    # the evaluation can't come from the cache
+    evalReport = evaluation({'rootPath': rootPath, 'taskPath': taskPath,
+        'solutions': [], 'executions': [], 'options': {'evaluationCache': False}})
+    buildPath = evalReport['buildPath']
+
+    logging.info("Writing task bundle `%s`" % bundleDir)
+    try:
+        os.makedirs(CFG_BUNDLESDIR)
+    except:
+        pass
+    tmpDir = tempfile.mkdtemp(dir=CFG_BUNDLESDIR)
+    os.chmod(tmpDir, 493)
+
+    # Copy generated tests and libraries
+    shutil.copytree(os.path.join(buildPath, 'tests'), os.path.join(tmpDir, 'tests'))
+    shutil.copytree(os.path.join(buildPath, 'libs'), os.path.join(tmpDir, 'libs'))
+
+    manifest = {
+        'bundleVersion': TASKBUNDLE_VERSION,
+        'bundlePath': bundleDir,
+        'taskPath': taskPath,
+        'revision': revision,
+        'preparedAt': time.time(),
+        'report': {
+            'generators': evalReport['generators'],
+            'generations': evalReport['generations']}
+        }
+
+    # Copy sanitizer and checker executables
+    varData = {'ROOT_PATH': rootPath, 'TASK_PATH': taskPath, 'BUILD_PATH': buildPath}
+    varData.update(defaultParams)
+    for name in ['sanitizer', 'checker']:
+        progParams = preprocessJson('@defaultEvaluation%s%s' % (name[0].upper(), name[1:]), varData)
+        if progParams.has_key('builtin'):
+            # Built-in checkers have no executable
+            manifest[name] = {'compilationReport': evalReport[name]}
+            for k in ['builtin', 'options', 'runExecution']:
+                if progParams.has_key(k):
+                    manifest[name][k] = progParams[k]
+            continue
+
+        filecopy(os.path.join(buildPath, name, '%s.exe' % name), os.path.join(tmpDir, '%s.exe' % name))
+
+        isolate = True
+        for f in progParams['compilationDescr']['files'] + progParams['compilationDescr'].get('dependencies', []):
+            if 'path' in f and os.path.abspath(f['path']) in CFG_NOISOLATE:
+                isolate = False
+
+        manifest[name] = {
+            'compilationDescr': {
+                'language': progParams['compilationDescr']['language'],
+                'files': [{'name': '%s.exe' % name,
+                           'path': os.path.join(bundleDir, '%s.exe' % name)}]},
+            'compilationExecution': progParams['compilationExecution'],
+            'runExecution': progParams['runExecution'],
+            'compilationReport': evalReport[name],
+            'isolate': isolate}
+
+    json.dump(manifest, open(os.path.join(tmpDir, 'manifest.json'), 'w'))
+
+    # Replace any incomplete or outdated bundle
+    shutil.rmtree(bundleDir, ignore_errors=True)
+    os.rename(tmpDir, bundleDir)
+
+    return manifest
+
+
+def loadTaskBundle(bundlePath):
+    """Load the manifest of the task bundle in bundlePath; bundlePath can be
+    relative to CFG_BUNDLESDIR."""
+    bundlePath = os.path.join(CFG_BUNDLESDIR, bundlePath)
+    if not (isInRestrict(bundlePath) or os.path.abspath(bundlePath).startswith(os.path.abspath(CFG_BUNDLESDIR) + os.sep)):
+        raise Exception("Loading task bundle `%s` not allowed." % bundlePath)
+
+    try:
+        manifest = json.load(open(os.path.join(bundlePath, 'manifest.json'), 'r'))
+    except:
+        raise Exception("Task bundle `%s` invalid (no readable manifest)." % bundlePath)
+    if manifest.get('bundleVersion') != TASKBUNDLE_VERSION:
+        raise Exception("Task bundle `%s` was prepared with another version of the taskgrader, please prepare it again." % bundlePath)
+
+    return manifest
+
+
+def importTaskBundle(manifest, baseWorkingDir):
+    """Import the tests and libraries from a task bundle into the build
+    folder."""
+    for folder in ['tests', 'libs']:
+        bundleFolder = os.path.join(manifest['bundlePath'], folder)
+        for f in os.listdir(bundleFolder):
+            symlink(os.path.join(bundleFolder, f), os.path.join(baseWorkingDir, folder, f))
+
+
+def getTaskgraderFingerprint():
+    """Returns a hash of the code and the configuration of the taskgrader,
+    including the comparison used by the built-in checkers."""
+    global TASKGRADER_FINGERPRINT
+    if TASKGRADER_FINGERPRINT is None:
+        fingerprint = hashlib.sha1()
+        sources = [os.path.join(SELFDIR, f) for f in
+            ['taskgrader.py', 'output_diff.py', 'config_default.py', 'config.py', 'config_transforms.py']]
+        for path in sources:
+            try:
+                fingerprint.update(open(path, 'rb').read())
+            except IOError:
+                pass
+            fingerprint.update('\0')
+        # Configuration variables, as some are modified after being loaded;
+        # the code of functions is in the sources above
+        config = dict([(k, v) for (k, v) in globals().items() if k.startswith('CFG_')])
+        fingerprint.update(json.dumps(config, sort_keys=True,
+            default=lambda obj: getattr(obj, '__name__', type(obj).__name__)))
+        TASKGRADER_FINGERPRINT = fingerprint.hexdigest()
+    return TASKGRADER_FINGERPRINT
+
+
+def getEvaluationCache(evaluationParams, evaluationOptions, baseWorkingDir, cache):
+    """Returns a function opening the CacheFolder of the whole evaluation
+    described by the preprocessed evaluationParams, or None if the evaluation
+    can't be cached. The evaluation is identified by its JSON, where the build
+    path is normalized, its evaluationOptions, the files it references, and
+    the version of the taskgrader."""
+    buildPath = baseWorkingDir.rstrip('/')
+    files = []
+    if evaluationParams.has_key('taskBundle'):
+        files.append({'name': 'manifest.json',
+            'path': os.path.join(evaluationParams['taskBundle'], 'manifest.json')})
+
+    # Look for the referenced files and the executions not using the cache
+    stack = [evaluationParams]
+    while stack:
+        elem = stack.pop()
+        if type(elem) is dict:
+            if elem.get('useCache', True) is False:
+                return None
+            path = elem.get('path')
+            if isinstance(path, basestring) and elem.has_key('name') and path != '':
+                # Files in the build folder are made by the evaluation itself
+                if not os.path.abspath(path).startswith(buildPath + '/'):
+                    if not os.path.isfile(path) or not isInRestrict(path):
+                        return None
+                    files.append(elem)
+            stack.extend(elem.values())
+        elif type(elem) is list:
+            stack.extend(elem)
+
+    jsonData = json.dumps([evaluationParams, evaluationOptions], sort_keys=True).replace(buildPath, '$BUILD_PATH')
+    jsonHash = hashlib.sha1(jsonData).hexdigest()
+    return functools.partial(cache.getHandle(files, ['taskgrader:%s' % getTaskgraderFingerprint()]).getCacheFolder,
+        'evaluation', args='json:%s' % jsonHash)
+
+
+def changeBuildPath(report, oldPath, newPath):
+    """Returns report with the build path oldPath replaced by newPath."""
+    return json.loads(json.dumps(report).replace(oldPath.rstrip('/'), newPath.rstrip('/')))
+
+
+def markCached(report):
+    """Mark all execution reports in report as cached."""
+    stack = [report]
+    while stack:
+        elem = stack.pop()
+        if type(elem) is dict:
+            if elem.has_key('wasCached'):
+                elem['wasCached'] = True
+            stack.extend(elem.values())
+        elif type(elem) is list:
+            stack.extend(elem)
+
+
 def evaluation(evaluationParams):
+    """Full evaluation process, recording the metrics of the evaluation."""
+    startTime = time.time()
+    result = 'error'
+    try:
+        report = _evaluation(evaluationParams)
+        result = 'success'
+        return report
+    except TemporaryException:
+        result = 'temporary'
+        METRICS.inc('taskgrader_temporary_exceptions_total')
+        raise
+    except UnsupportedLanguage:
+        result = 'unsupported'
+        raise
+    finally:
+        METRICS.inc('taskgrader_evaluations_total', {'result': result})
+        METRICS.observe('taskgrader_evaluation_duration_seconds', time.time() - startTime)
+        saveMetrics()
+        saveCacheAccessTimes()
+
+
+def _evaluation(evaluationParams):
     """Full evaluation process."""
 
-    global RESTRICT_PATHS
+    global PROFILE, RESTRICT_PATHS
 
     logging.info("Initializing evaluation")
+    evaluationStart = time.time()
+    # The profile is only made when the option 'profile' is set; when it is
+    # given directly in the input JSON, the profile includes the
+    # preprocessing
+    PROFILE = None
+    if type(evaluationParams.get('options')) is dict and evaluationParams['options'].get('profile') is True:
+        PROFILE = Profile(evaluationStart)
 
     # Check root path and task path
     # We need to check the keys exist as the JSON schema check is done later
@@ -1707,6 +3196,22 @@ def evaluation(evaluationParams):
             varData.update(exp)
 
 
+    # Load the task bundle, which replaces the task components
+    taskBundle = None
+    if evaluationParams.has_key('taskBundle'):
+        taskBundle = loadTaskBundle(evaluationParams['taskBundle'])
+        logging.info("Using task bundle `%s`" % taskBundle['bundlePath'])
+        evaluationParams['generators'] = []
+        evaluationParams['generations'] = []
+        for elem in ['sanitizer', 'checker']:
+            evaluationParams[elem] = {}
+            for k in ['compilationDescr', 'compilationExecution', 'runExecution', 'builtin', 'options']:
+                if taskBundle[elem].has_key(k):
+                    evaluationParams[elem][k] = taskBundle[elem][k]
+        # Task extra tests are already in the bundle
+        if not evaluationParams.has_key('extraTests'):
+            evaluationParams['extraTests'] = []
+
     # Check for evaluation elements
     for elem in ['generators', 'generations', 'extraTests', 'sanitizer',
                  'checker', 'solutions', 'executions']:
@@ -1730,7 +3235,6 @@ def evaluation(evaluationParams):
         while os.path.isdir(baseWorkingDir):
             baseWorkingDir = os.path.join(CFG_BUILDSDIR, '_build%d/' % random.randint(10000*buildPoolTries, 10000*(buildPoolTries+1)))
             buildPoolTries += 1
-    os.mkdir(baseWorkingDir)
 
     report = {}
 
@@ -1739,14 +3243,55 @@ def evaluation(evaluationParams):
     if len(RESTRICT_PATHS) > 0:
         RESTRICT_PATHS.append(baseWorkingDir)
 
-    evaluationParams = preprocessJson(evaluationParams, varData)
+    with profilePhase('preprocess'):
+        evaluationParams = preprocessJson(evaluationParams, varData)
 
     cache = CacheDatabase()
 
+    # Handle options
+    evaluationOptions = {
+        'locale': 'en',
+        'pyFrenchErrors': True,
+        'onlyOneCheckerMessage': True,
+        'multiCheck': CFG_MULTICHECK,
+        'outputSizeLimit': True,
+        'outputPreCheck': CFG_OUTPUT_PRECHECK,
+        'profile': False,
+        'evaluationCache': CFG_EVALUATION_CACHE
+        }
+    if 'defaultEvaluationOptions' in varData:
+        evaluationOptions.update(varData['defaultEvaluationOptions'])
+    if 'options' in evaluationParams:
+        evaluationOptions.update(evaluationParams['options'])
+    if not evaluationOptions['profile']:
+        PROFILE = None
+    elif PROFILE is None:
+        PROFILE = Profile(evaluationStart)
+
+    # Look for the report of an identical evaluation; the evaluation is not
+    # cached when profiling or when the build folder is asked for
+    evaluationCache = None
+    if (evaluationOptions['evaluationCache'] and not evaluationOptions['profile']
+            and not evaluationParams.has_key('outputPath')):
+        evaluationCache = getEvaluationCache(evaluationParams, evaluationOptions, baseWorkingDir, cache)
+    if evaluationCache:
+        cachef = evaluationCache()
+        if cachef.isCached:
+            logging.info("Evaluation in cache")
+            # The report is stored with a placeholder build path
+            report = changeBuildPath(cachef.loadReport(), '$BUILD_PATH', baseWorkingDir)
+            markCached(report)
+            return report
+        # Release the lock during the evaluation
+        cachef = None
+
+    os.mkdir(baseWorkingDir)
+
     # We validate the input JSON format
     if validate is not None:
         try:
-            validate(evaluationParams, json.load(open(CFG_INPUTSCHEMA, 'r')))
+            with profilePhase('inputValidation'):
+                validate(evaluationParams, json.load(open(CFG_INPUTSCHEMA, 'r')))
         except Exception as err:
             raise Exception("Validation failed for input JSON, error message: %s" % str(err))
     else:
@@ -1760,19 +3305,6 @@ def evaluation(evaluationParams):
 
     logging.info("Evaluation taking place in dir `%s`" % baseWorkingDir)
 
-    # Handle options
-    evaluationOptions = {
-        'locale': 'en',
-        'pyFrenchErrors': True,
-        'onlyOneCheckerMessage': True,
-        'multiCheck': CFG_MULTICHECK,
-        'outputSizeLimit': True
-        }
-    if 'defaultEvaluationOptions' in varData:
-        evaluationOptions.update(varData['defaultEvaluationOptions'])
-    if 'options' in evaluationParams:
-        evaluationOptions.update(evaluationParams['options'])
-
     # Create evaluationContext object
     # allows to pass different evaluation objects around
     evaluationContext = {
@@ -1784,75 +3316,112 @@ def evaluation(evaluationParams):
     os.mkdir(baseWorkingDir + "generators/")
     report['generators'] = []
     generators = {}
+    genPrograms = []
     for gen in evaluationParams['generators']:
-        logging.info("Compiling generator ID `%s`" % gen['id'])
+        logging.info("Preparing generator ID `%s`" % gen['id'])
         genDir = "%sgenerators/%s/" % (baseWorkingDir, gen['id'])
         os.mkdir(genDir)
-        # We compile the generator
         generator = Program(gen['compilationDescr'], gen['compilationExecution'], genDir, baseWorkingDir, evaluationContext, 'generator')
-        genReport = generator.compile()
+        genPrograms.append(generator)
+        generators[gen['id']] = generator
+
+    # We compile the generators concurrently
+    genReports = runParallel(map(lambda p: p.compile, genPrograms), CFG_COMPILATION_JOBS)
+    for (gen, genReport) in zip(evaluationParams['generators'], genReports):
         errorSoFar = errorSoFar or isExecError(genReport)
         report['generators'].append({'id': gen['id'], 'compilationExecution': genReport})
-        generators[gen['id']] = generator
 
 
     # *** Generations
+    # Generations are executed concurrently, each test case of a generation
+    # being a separate task in its own folder; reports and files are then
+    # gathered in the original order, so that later generations overwrite
+    # the files of earlier ones
     os.mkdir(baseWorkingDir + "generations/")
     report['generations'] = []
+    genTasks = []
+    genSets = [] # (gen, cache folder, indexes of the tasks in genTasks)
     for gen in evaluationParams['generations']:
         logging.info("Generation ID `%s`" % gen['id'])
         genDir = "%sgenerations/%s/" % (baseWorkingDir, gen['id'])
         os.mkdir(genDir)
 
-        # Prepare generators
-        generator = generators[gen['idGenerator']]
+        # Prepare generators; they are copied as a generator can be used by
+        # multiple generations with different execution parameters
+        generator = copy.copy(generators[gen['idGenerator']])
         generator.prepareExecution(gen['genExecution'])
         if gen.has_key('idOutputGenerator'):
-            outputGenerator = generators[gen['idOutputGenerator']]
+            outputGenerator = copy.copy(generators[gen['idOutputGenerator']])
             outputGenerator.prepareExecution(gen['outGenExecution'])
+        else:
+            outputGenerator = None
 
         if gen.has_key('testCases'):
             # We have specific test cases to generate
-            for tc in gen['testCases']:
-                genReport = {'id': "%s.%s" % (gen['id'], tc['name'])}
-                if gen.has_key('idOutputGenerator'):
-                    # We also have an output generator, we generate `name`.in and `name`.out
-                    genReport['generatorExecution'] = generator.execute(genDir, args=tc['params'], stdoutFile=genDir + tc['name'] + '.in')
-                    if not isExecError(genReport['generatorExecution']):
-                        filecopy(genDir + tc['name'] + '.in', baseWorkingDir + 'tests/' + tc['name'] + '.in')
-
-                    genReport['outputGeneratorExecution'] = outputGenerator.execute(genDir, args=tc['params'], stdoutFile=genDir + tc['name'] + '.out')
-                    if not isExecError(genReport['outputGeneratorExecution']):
-                        filecopy(genDir + tc['name'] + '.out', baseWorkingDir + 'tests/' + tc['name'] + '.out')
-
-                    errorSoFar = errorSoFar or isExecError(genReport['generatorExecution']) or isExecError(genReport['outputGeneratorExecution'])
-                else:
-                    # We only have one generator, we assume `name` is the name of the test file to generate
-                    genReport['generatorExecution'] = generator.execute(genDir, args=tc['params'], stdoutFile=genDir + tc['name'])
-                    if isExecError(genReport['generatorExecution']):
-                        errorSoFar = True
-                    else:
-                        filecopy(genDir + tc['name'], baseWorkingDir + 'tests/' + tc['name'], fromlocal=True, tolocal=True)
-                report['generations'].append(genReport)
-
+            cachef = getTestCaseSetCache(gen, generator, outputGenerator, evaluationContext)
+            if cachef and cachef.isCached:
+                genSets.append((gen, cachef, None))
+                continue
+            firstTask = len(genTasks)
+            for (i, tc) in enumerate(gen['testCases']):
+                genTasks.append(functools.partial(generateTestCase, gen, tc,
+                    generator, outputGenerator, '%scase-%d/' % (genDir, i)))
+            genSets.append((gen, cachef, range(firstTask, len(genTasks))))
         else:
             # We generate the test cases just by executing the generators
-            genReport = {'id': gen['id']}
-            genReport['generatorExecution'] = generator.execute(genDir,
-                outputFiles=['*.in', '*.out', '*.params', '*.h', '*.hpp', '*.o', '*.java', '*.ml', '*.mli', '*.pas', '*.py'])
-            errorSoFar = errorSoFar or isExecError(genReport['generatorExecution'])
-            if gen.has_key('idOutputGenerator'):
-                # We also have an output generator
-                genReport['outputGeneratorExecution'] = outputGenerator.execute(genDir, outputFiles=['*.out', '*.params'])
-                errorSoFar = errorSoFar or isExecError(genReport['outputGeneratorExecution'])
-            report['generations'].append(genReport)
-
-            # We copy the generated test files
-            for f in globOfGlobs(genDir, ['*.in', '*.out', '*.params']):
-                filecopy(f, baseWorkingDir + 'tests/')
-            # We copy the generated lib files
-            for f in globOfGlobs(genDir, ['*.h', '*.hpp', '*.o', '*.java', '*.ml', '*.mli', '*.pas', '*.py']):
-                filecopy(f, baseWorkingDir + 'libs/')
+            genTasks.append(functools.partial(generateFiles, gen, generator,
+                outputGenerator, genDir))
+            genSets.append((gen, None, [len(genTasks) - 1]))
+
+    genResults = runParallel(genTasks, CFG_GENERATION_JOBS)
+
+    for (gen, cachef, taskIndexes) in genSets:
+        if taskIndexes is None:
+            # The whole set of test cases was cached
+            logging.debug("Generated test set `%s` was cached" % gen['id'])
+            genReports = cachef.loadReport()
+            for genReport in genReports:
+                for execType in ['generatorExecution', 'outputGeneratorExecution']:
+                    if execType in genReport:
+                        genReport[execType]['wasCached'] = True
+            for f in cachef.files:
+                replaceGeneratedFile(baseWorkingDir + 'tests/' + f)
+            cachef.loadFiles(baseWorkingDir + 'tests/')
+            report['generations'].extend(genReports)
+            continue
+
+        genReports = map(lambda i: genResults[i][0], taskIndexes)
+        report['generations'].extend(genReports)
+        # We copy the generated test and lib files
+        for i in taskIndexes:
+            for (path, name) in genResults[i][1]:
+                replaceGeneratedFile(baseWorkingDir + 'tests/' + name)
+                filecopy(path, baseWorkingDir + 'tests/' + name, fromlocal=True, tolocal=True)
+            for path in genResults[i][2]:
+                replaceGeneratedFile(baseWorkingDir + 'libs/' + os.path.basename(path))
+                filecopy(path, baseWorkingDir + 'libs/')
+        if len(filter(isGenerationError, genReports)) > 0:
+            errorSoFar = True
+        elif cachef:
+            # We only cache successful sets of test cases
+            cachef.addReport(genReports)
+            for i in taskIndexes:
+                for (path, name) in genResults[i][1]:
+                    cachef.addFile(path)
+            cachef.save()
+    # Release the locks on the cache folders
+    genSets = cachef = None
+
+    # We import the generated files from the task bundle
+    if taskBundle:
+        logging.info("Importing tests and libraries from task bundle")
+        importTaskBundle(taskBundle, baseWorkingDir)
+        for elem in ['generators', 'generations']:
+            report[elem] = taskBundle['report'][elem]
+            for genReport in report[elem]:
+                for execReport in genReport.values():
+                    if type(execReport) is dict:
+                        execReport['wasCached'] = True
 
     # We add extra tests
     if evaluationParams.has_key('extraTests'):
@@ -1867,25 +3436,61 @@ def evaluation(evaluationParams):
             elif et.has_key('content'): # Content given in descr
                 open(filepath, 'w').write(et['content'].encode('utf-8'))
 
-    logging.info("Preparing sanitizer and checker")
+    logging.info("Preparing sanitizer, checker and solutions")
 
-    # *** Sanitizer
+    # The sanitizer, the checker and the solutions are compiled concurrently;
+    # errors are then handled in the same order as if they were compiled one
+    # after the other
     os.mkdir(baseWorkingDir + "sanitizer/")
-    sanitizer = Program(evaluationParams['sanitizer']['compilationDescr'], evaluationParams['sanitizer']['compilationExecution'], baseWorkingDir + "sanitizer/", baseWorkingDir, evaluationContext, 'sanitizer')
-    report['sanitizer'] = sanitizer.compile()
+    os.mkdir(baseWorkingDir + "checker/")
+    if taskBundle:
+        sanitizer = BundledProgram(taskBundle['sanitizer'], baseWorkingDir + "sanitizer/", baseWorkingDir, evaluationContext, 'sanitizer')
+    else:
+        sanitizer = Program(evaluationParams['sanitizer']['compilationDescr'], evaluationParams['sanitizer']['compilationExecution'], baseWorkingDir + "sanitizer/", baseWorkingDir, evaluationContext, 'sanitizer')
+    if evaluationParams['checker'].has_key('builtin'):
+        checker = BuiltinChecker(evaluationParams['checker'], baseWorkingDir + "checker/", evaluationContext, 'checker')
+    elif taskBundle:
+        checker = BundledProgram(taskBundle['checker'], baseWorkingDir + "checker/", baseWorkingDir, evaluationContext, 'checker')
+    else:
+        checker = Program(evaluationParams['checker']['compilationDescr'], evaluationParams['checker']['compilationExecution'], baseWorkingDir + "checker/", baseWorkingDir, evaluationContext, 'checker')
+
+    os.mkdir(baseWorkingDir + "solutions/")
+    solutions = {} # Language and source files of solutions, need this for the evaluations
+    compTasks = [sanitizer.compile, checker.compile]
+    # The solutions aren't compiled if the evaluation is going to stop after
+    # the sanitizer and the checker anyway
+    if not errorSoFar:
+        for sol in evaluationParams['solutions']:
+            solDir = "%ssolutions/%s/" % (baseWorkingDir, sol['id'])
+            os.mkdir(solDir)
+            try:
+                solution = Program(sol['compilationDescr'], sol['compilationExecution'],
+                       solDir, baseWorkingDir, evaluationContext, 'solution')
+            except:
+                # Raised later, when the solution would have been compiled
+                compTasks.append(functools.partial(reraise, sys.exc_info()))
+                continue
+            solutions[sol['id']] = solution
+            compTasks.append(solution.compile)
+    compResults = runParallel(map(lambda task: functools.partial(callAndCatch, task), compTasks), CFG_COMPILATION_JOBS)
+    compTasks = None
+
+    # *** Sanitizer
+    report['sanitizer'] = reraiseCaught(compResults[0])
     if isExecError(report['sanitizer']):
         errorSoFar = True
     else:
         sanitizer.prepareExecution(evaluationParams['sanitizer']['runExecution'])
 
     # *** Checker
-    os.mkdir(baseWorkingDir + "checker/")
-    checker = Program(evaluationParams['checker']['compilationDescr'], evaluationParams['checker']['compilationExecution'], baseWorkingDir + "checker/", baseWorkingDir, evaluationContext, 'checker')
-    report['checker'] = checker.compile()
+    report['checker'] = reraiseCaught(compResults[1])
     if isExecError(report['checker']):
         errorSoFar = True
     else:
-        checker.prepareExecution(evaluationParams['checker']['runExecution'])
+        checker.prepareExecution(evaluationParams['checker'].get('runExecution', {}))
+
+    # Built-in checkers are fast enough to be called for each test
+    multiCheck = evaluationOptions['multiCheck'] and not isinstance(checker, BuiltinChecker)
 
     # Did we encounter an error so far?
     if errorSoFar:
@@ -1893,20 +3498,12 @@ def evaluation(evaluationParams):
 
 
     # *** Solutions
-    os.mkdir(baseWorkingDir + "solutions/")
     report['solutions'] = []
-    solutions = {} # Language and source files of solutions, need this for the evaluations
     solutionsWithErrors = []
-    for sol in evaluationParams['solutions']:
-        logging.info("Compiling solution ID `%s`" % sol['id'])
-        solDir = "%ssolutions/%s/" % (baseWorkingDir, sol['id'])
-        os.mkdir(solDir)
-        # We only compile the solution
-        solution = Program(sol['compilationDescr'], sol['compilationExecution'],
-               solDir, baseWorkingDir, evaluationContext, 'solution')
-        solReport = solution.compile()
+    for (sol, compResult) in zip(evaluationParams['solutions'], compResults[2:]):
+        logging.info("Compiled solution ID `%s`" % sol['id'])
+        solReport = reraiseCaught(compResult)
         report['solutions'].append({'id': sol['id'], 'compilationExecution': solReport})
-        solutions[sol['id']] = solution
         if isExecError(solReport):
             # We keep a list of solutions with errors
             solutionsWithErrors.append(sol['id'])
@@ -1933,7 +3530,7 @@ def evaluation(evaluationParams):
         solution.prepareExecution(test['runExecution'])
 
         # List of delayed checks
-        if evaluationOptions['multiCheck']:
+        if multiCheck:
             multiCheckList = []
 
         # Files to test as input
@@ -1951,10 +3548,14 @@ def evaluation(evaluationParams):
                 baseTfName = os.path.basename(tf)
 
             subTestReport = {'name': baseTfName}
+            if evaluationOptions['profile']:
+                testProfileStart = PROFILE.snapshot()
             # We execute the sanitizer
             subTestReport['sanitizer'] = transformReport(sanitizer.execute(testDir, stdinFile=tf), {'noFeedback': noFeedback}, 'sanitizer', 'execution')
             if isExecError(subTestReport['sanitizer']):
                 # Sanitizer found an error, we skip this file
+                if evaluationOptions['profile']:
+                    subTestReport['profile'] = PROFILE.makeReport(testProfileStart)
                 mainTestReport['testsReports'].append(subTestReport)
                 continue
 
@@ -2003,11 +3604,14 @@ def evaluation(evaluationParams):
 
             if isExecError(subTestReport['execution']):
                 # Solution returned an error, no need to check
+                if evaluationOptions['profile']:
+                    subTestReport['profile'] = PROFILE.makeReport(testProfileStart)
                 mainTestReport['testsReports'].append(subTestReport)
                 continue
 
             # Check answer
-            if os.path.isfile(tf[:-3] + '.out'):
+            hasExpectedOutput = os.path.isfile(tf[:-3] + '.out')
+            if hasExpectedOutput:
                 filecopy(tf[:-3] + '.out', testDir, fromlocal=True)
             else:
                 # We write a dummy .out file, the checker probably doesn't need it
@@ -2016,32 +3620,16 @@ def evaluation(evaluationParams):
             # Check output size
             if evaluationOptions['outputSizeLimit'] and os.stat(testDir + baseTfName + '.solout').st_size > 5 * (os.stat(testDir + baseTfName + '.out').st_size + 10) + 1024 * 1024:
                 # Output is way larger than expected, we don't check
-                subTestReport['checker'] = {
-                    'commandLine': '',
-                    'timeLimitMs': 0,
-                    'memoryLimitKb': 0,
-                    'realMemoryLimitKb': 0,
-                    'realTimeLimitMs': 0,
-                    'memoryUsedKb': 0,
-                    'timeTakenMs': 0,
-                    'realTimeTakenMs': 0,
-                    'wasCached': False,
-                    'wasKilled': False,
-                    'exitCode': 0,
-                    'stdout': {
-                        'name': 'stdout',
-                        'sizeKb': 1,
-                        'data': "0\nOutput is much larger than expected answer and wasn't checked.\nThis means your program prints too much data, and can happen for instance if you wrote a printing statement in an infinite loop.\n",
-                        'wasTruncated': False},
-                    'stderr': {
-                        'name': 'stderr',
-                        'sizeKb': 0,
-                        'data': '',
-                        'wasTruncated': False}
-                    }
+                subTestReport['checker'] = makeCheckerReport("0\nOutput is much larger than expected answer and wasn't checked.\nThis means your program prints too much data, and can happen for instance if you wrote a printing statement in an infinite loop.\n")
+            elif (evaluationOptions['outputPreCheck'] and hasExpectedOutput
+                    and sameOutputs(testDir + baseTfName + '.solout', testDir + baseTfName + '.out', evaluationOptions['outputPreCheck'])):
+                # Output is the expected one, no need for the checker
+                subTestReport['checker'] = transformReport(
+                    makeCheckerReport("100\n", 'precheck:%s' % evaluationOptions['outputPreCheck']),
+                    {'noFeedback': noFeedback}, 'checker', 'execution')
             else:
                 # We execute the checker
-                if evaluationOptions['multiCheck']:
+                if multiCheck:
                     # We delay the checking to later
                     multiCheckList.append((len(mainTestReport['testsReports']), baseTfName, noFeedback))
                 else:
@@ -2052,10 +3640,12 @@ def evaluation(evaluationParams):
                         otherInputs=[testDir + baseTfName + '.in', testDir + baseTfName + '.solout']),
                         {'noFeedback': noFeedback}, 'checker', 'execution')
 
+            if evaluationOptions['profile']:
+                subTestReport['profile'] = PROFILE.makeReport(testProfileStart)
             mainTestReport['testsReports'].append(subTestReport)
 
         # Execute delayed checks
-        if evaluationOptions['multiCheck']:
+        if multiCheck:
             multiCheckReports = multiChecker(testDir, multiCheckList, checker, evaluationParams['checker']['runExecution'], evaluationContext)
             for (i, checkReport) in multiCheckReports:
                 mainTestReport['testsReports'][i]['checker'] = checkReport
@@ -2080,12 +3670,22 @@ def evaluation(evaluationParams):
     # We validate the output JSON format
     if validate is not None:
         try:
-            validate(report, json.load(open(CFG_OUTPUTSCHEMA, 'r')))
+            with profilePhase('outputValidation'):
+                validate(report, json.load(open(CFG_OUTPUTSCHEMA, 'r')))
         except Exception as err:
             raise Exception("Validation failed for output JSON, error message: %s" % str(err))
     else:
         logging.info("Unable to import jsonschema library, output JSON was not validated.")
 
+    if evaluationCache:
+        cachef = evaluationCache()
+        if not cachef.isCached:
+            cachef.addReport(changeBuildPath(report, baseWorkingDir, '$BUILD_PATH'))
+            cachef.save()
+
+    if evaluationOptions['profile']:
+        report['profile'] = PROFILE.makeReport()
+
     return report
 
 
@@ -2097,6 +3697,8 @@ if __name__ == '__main__':
     argParser.add_argument('-L', '--logfile', help='Write logs into file LOGFILE', action='store', metavar='LOGFILE')
     argParser.add_argument('-v', '--verbose', help='Be more verbose', action='store_true')
 
+    argParser.add_argument('--prepare-task', help='Prepare a task bundle for the task in TASK_PATH, instead of reading an input JSON', action='store', metavar='TASK_PATH')
+
     args = argParser.parse_args()
 
     # Some options imply others
@@ -2123,14 +3725,18 @@ if __name__ == '__main__':
         logging.getLogger().addHandler(logStderr)
 
     # Read input JSON
-    try:
-        inJson = json.load(sys.stdin)
-    except Exception as err:
-        raise Exception("Input data is not valid JSON: %s" % err)
+    if not args.prepare_task:
+        try:
+            inJson = json.load(sys.stdin)
+        except Exception as err:
+            raise Exception("Input data is not valid JSON: %s" % err)
 
     # Evaluation
     try:
-        json.dump(evaluation(inJson), sys.stdout)
+        if args.prepare_task:
+            json.dump(prepareTask(args.prepare_task), sys.stdout)
+        else:
+            json.dump(evaluation(inJson), sys.stdout)
     except TemporaryException as err:
         # We use a different exit codes depending on the exception
         logging.critical("TemporaryException raised")
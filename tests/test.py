@@ -9,14 +9,20 @@
 # is as expected and the local configuration is good.
 
 
-import argparse, json, os, subprocess, sys, threading, tempfile, traceback
-import unittest
+import argparse, cPickle, json, os, shutil, sqlite3, subprocess, sys, threading
+import tempfile, time, traceback, types, unittest
 
 # Paths to executables
 SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
 CFG_GENJSON = os.path.normpath(os.path.join(SELFDIR, '../tools/genJson/genJson.py'))
 CFG_TASKGRADER = os.path.normpath(os.path.join(SELFDIR, '../taskgrader.py'))
 
+# The taskgrader is also imported to test its internal functions
+sys.path.insert(0, os.path.join(SELFDIR, '../'))
+import taskgrader, clean_cache, output_diff
+sys.path.pop(0)
+CFG_DEFAULTCHECKER = os.path.normpath(os.path.join(SELFDIR, '../tools/genJson/scripts/defaultChecker.py'))
+
 # Configuration for examples
 CFG_EXAMPLES_IGNORE = ['taskTurtle']
 # gcc and python2.7 are set as default dependencies for all examples
@@ -281,6 +287,134 @@ class GenerationCasesTest(FullTestBase):
             self.assertVariableEqual("outputJson['generations'][0]['outputGeneratorExecution']['stdout']['data']", "40"),
             ]
 
+@register_test
+class GenerationOrderTest(FullTestBase):
+    """This test generates test cases concurrently in two generations, the
+    second one generating a test file already generated by the first one, and
+    checks the reports and the test files follow the order of the
+    generations."""
+
+    description = "concurrent generations order test"
+
+    def makeInputJson(self):
+        genExecution = {
+            'memoryLimitKb': 131072,
+            'timeLimitMs': 60000,
+            'stdoutTruncateKb': -1,
+            'stderrTruncateKb': -1,
+            'getFiles': [],
+            'useCache': False
+            }
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': ['@testGenerator2'],
+            'generations': [{
+                    'id': 'tGenerationOrder1',
+                    'idGenerator': 'tGenerator2',
+                    'genExecution': genExecution,
+                    'testCases': [{'name': 'order%d.in' % i, 'params': str(i)} for i in range(1, 5)]
+                }, {
+                    'id': 'tGenerationOrder2',
+                    'idGenerator': 'tGenerator2',
+                    'genExecution': '@testExecParams',
+                    'testCases': [{'name': 'order2.in', 'params': '22'}]
+                }],
+            'extraTests': [],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': [],
+            'executions': []
+            }
+
+    def makeChecks(self):
+        buildPath = getattr(self, 'outputJson', {}).get('buildPath', '')
+        self.generationJobs = taskgrader.CFG_GENERATION_JOBS
+        self.reportIds = map(lambda r: r['id'], getattr(self, 'outputJson', {}).get('generations', []))
+        self.testFiles = {}
+        for i in range(1, 5):
+            try:
+                self.testFiles['order%d.in' % i] = open(os.path.join(buildPath, 'tests', 'order%d.in' % i), 'r').read().strip()
+            except:
+                pass
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("generationJobs > 1", True),
+            self.assertVariableEqual("reportIds", ['tGenerationOrder1.order1.in',
+                'tGenerationOrder1.order2.in', 'tGenerationOrder1.order3.in',
+                'tGenerationOrder1.order4.in', 'tGenerationOrder2.order2.in']),
+            self.assertVariableEqual("testFiles", {'order1.in': '1',
+                'order2.in': '22', 'order3.in': '3', 'order4.in': '4'})
+            ]
+
+@register_test
+class GenerationCacheTest(FullTestBase):
+    """This test generates a set of test cases twice, and checks the second
+    time the whole set is loaded from the cache; it then changes the params
+    of a test case and checks the set is generated again."""
+
+    description = "generated test set cache test"
+
+    def setUp(self):
+        """Generate the test cases a first time, with params which were
+        never used before."""
+        self.params = str(int(time.time() * 1000))
+        self.runEvaluation(self.makeInputJson())
+
+    def runEvaluation(self, inputJson):
+        """Send inputJson to the taskgrader, returning the output JSON."""
+        proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (procOut, procErr) = communicateWithTimeout(proc, 15, input=json.dumps(inputJson))
+        self.assertEqual(proc.returncode, 0, msg="Evaluation failed: %s" % procErr)
+        return json.loads(procOut)
+
+    def makeInputJson(self, params=None):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': ['@testGenerator2'],
+            'generations': [{
+                'id': 'tGenerationCache',
+                'idGenerator': 'tGenerator2',
+                'genExecution': '@testExecParams',
+                'testCases': [
+                    {'name': 'cache1.in', 'params': '1'},
+                    {'name': 'cache2.in', 'params': params or self.params}]
+                }],
+            'extraTests': [],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': [],
+            'executions': []
+            }
+
+    def readTestFiles(self, outputJson):
+        """Read the test files generated in the evaluation of outputJson."""
+        testFiles = {}
+        for name in ['cache1.in', 'cache2.in']:
+            try:
+                testFiles[name] = open(os.path.join(outputJson['buildPath'], 'tests', name), 'r').read().strip()
+            except:
+                pass
+        return testFiles
+
+    def makeChecks(self):
+        self.testFiles = self.readTestFiles(getattr(self, 'outputJson', {'buildPath': ''}))
+
+        # Changing the params of a test case must not use the cached set
+        self.changedParams = self.params + '0'
+        self.changedJson = self.runEvaluation(self.makeInputJson(params=self.changedParams))
+        self.changedTestFiles = self.readTestFiles(self.changedJson)
+
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['generations'][0]['generatorExecution']['wasCached']", True),
+            self.assertVariableEqual("outputJson['generations'][1]['generatorExecution']['wasCached']", True),
+            self.assertVariableEqual("testFiles", {'cache1.in': '1', 'cache2.in': self.params}),
+            self.assertVariableEqual("changedJson['generations'][1]['generatorExecution']['wasCached']", False),
+            self.assertVariableEqual("changedTestFiles", {'cache1.in': '1', 'cache2.in': self.changedParams})
+            ]
+
 
 class SolutionSimpleBase(FullTestBase):
     """This test tries a simple solution execution, with one test file, and
@@ -392,6 +526,63 @@ class SolutionSimpleShell(SolutionSimpleBase):
     _solution = '@testSolutionShell'
     _execution = '@testExecutionShell'
 
+@register_test
+class PythonPrecompileTest(FullTestBase):
+    """This test compiles the same Python solution, made of a script and a
+    module, with and without precompilation to bytecode, and checks both give
+    the same output."""
+
+    description = "Python precompilation test"
+
+    def makeSolution(self, solId, precompile):
+        return {
+            'id': solId,
+            'compilationDescr': {
+                'language': 'python2',
+                'files': [{'name': 'sol-precompile.py',
+                    'content': 'import sys, helper\nsys.stderr.write(sys.argv[0][-4:])\nprint(helper.double(int(sys.stdin.readline())))\n'}],
+                'dependencies': [{'name': 'helper.py',
+                    'content': 'def double(n):\n    return 2 * n\n'}]},
+            'compilationExecution': {
+                'timeLimitMs': 60000,
+                'memoryLimitKb': 131072,
+                'forcePrecompile': precompile,
+                'stdoutTruncateKb': -1,
+                'stderrTruncateKb': -1,
+                'getFiles': []}}
+
+    def makeExecution(self, execId, solId):
+        return {
+            'id': execId,
+            'idSolution': solId,
+            'filterTests': ['testextra1.in'],
+            'runExecution': '@testExecParams'}
+
+    def makeInputJson(self):
+        self.assertTrue(programExists('python2.7'), msg="Dependency `python2.7` missing.")
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': [self.makeSolution('tSolutionPlain', False), self.makeSolution('tSolutionPrecompiled', True)],
+            'executions': [self.makeExecution('tExecutionPlain', 'tSolutionPlain'),
+                self.makeExecution('tExecutionPrecompiled', 'tSolutionPrecompiled')]
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['execution']['stderr']['data']", "e.py"),
+            self.assertVariableEqual("outputJson['executions'][1]['testsReports'][0]['execution']['stderr']['data']", ".pyc"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['execution']['stdout']['data']", "60"),
+            self.assertVariableEqual("outputJson['executions'][1]['testsReports'][0]['execution']['stdout']['data']", "60"),
+            self.assertVariableEqual("outputJson['executions'][1]['testsReports'][0]['checker']['stdout']['data']", "100")
+            ]
+
 @register_test
 class SolutionInvalidTest(FullTestBase):
     """This test tries an invalid solution (giving a wrong result), with one
@@ -443,6 +634,128 @@ class SolutionUncompTest(FullTestBase):
             self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['exitCode']", 1)
             ]
 
+@register_test
+class SolutionsCompilationTest(FullTestBase):
+    """This test compiles multiple solutions at once, one of them not
+    compiling, and checks the reports are kept in order."""
+
+    description = "multiple compilations test"
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': ['@testSolutionC', '@testSolutionUncomp', '@testSolutionCpp', '@testSolutionPython'],
+            'executions': ['@testExecutionC', '@testExecutionUncomp', '@testExecutionCpp', '@testExecutionPython']
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['solutions'][1]['id']", 'tSolutionUncomp'),
+            self.assertVariableEqual("outputJson['solutions'][3]['id']", 'tSolutionPython'),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['exitCode']", 0),
+            self.assertVariableEqual("outputJson['solutions'][1]['compilationExecution']['exitCode']", 1),
+            self.assertVariableEqual("outputJson['solutions'][2]['compilationExecution']['exitCode']", 0),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100"),
+            self.assertVariableEqual("outputJson['executions'][1]['name']", 'tSolutionCpp'),
+            self.assertVariableEqual("outputJson['executions'][2]['testsReports'][0]['checker']['stdout']['data']", "100")
+            ]
+
+@register_test
+class PrecompiledHeadersTest(FullTestBase):
+    """This test compiles a C++ solution without the cache, with options
+    differing from the default ones, and checks precompiled headers were
+    available to the compiler and actually used by it."""
+
+    description = "precompiled headers test"
+
+    def makeInputJson(self):
+        self.assertTrue(programExists('g++'), msg="Dependency `g++` missing.")
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': [{
+                'id': 'tSolutionCpp',
+                'compilationDescr': {
+                    'language': 'cpp',
+                    'files': [{'name': 'sol-pch-cpp.cpp',
+                        'content': '#include <bits/stdc++.h>\nint main() { int n; std::cin >> n; std::cout << n * 2; return 0; }\n'}],
+                    'dependencies': []},
+                'compilationExecution': {
+                    'timeLimitMs': 60000,
+                    'memoryLimitKb': 131072,
+                    # -Winvalid-pch warns if the precompiled headers are
+                    # ignored, -O0 changes the macros they depend on
+                    'executionArgs': '-O0 -Winvalid-pch',
+                    'useCache': False,
+                    'stdoutTruncateKb': -1,
+                    'stderrTruncateKb': -1,
+                    'getFiles': []}}],
+            'executions': ['@testExecutionCpp']
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['precompiledHeaders']", True),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['stderr']['data']", ""),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['wasCached']", False),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100")
+            ]
+
+@register_test
+class DynamicLinkingTest(FullTestBase):
+    """This test compiles a C solution dynamically, and checks the compiler
+    output is clean and the executable is small."""
+
+    description = "dynamic linking test"
+
+    def makeInputJson(self):
+        self.assertTrue(programExists('gcc'), msg="Dependency `gcc` missing.")
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': [{
+                'id': 'tSolutionC',
+                'compilationDescr': {
+                    'language': 'c',
+                    'files': [{'name': 'sol-ok-c.c', 'path': '$TASK_PATH/sol-ok-c.c'}],
+                    'dependencies': []},
+                'compilationExecution': {
+                    'timeLimitMs': 60000,
+                    'memoryLimitKb': 131072,
+                    'useCache': False,
+                    'forceStatic': False,
+                    'stdoutTruncateKb': -1,
+                    'stderrTruncateKb': -1,
+                    'getFiles': []}}],
+            'executions': ['@testExecutionC']
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['stderr']['data']", ""),
+            self.assertVariableEqual("outputJson['solutions'][0]['compilationExecution']['executableSizeKb'] < 100", True),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100")
+            ]
+
 @unittest.skip('test not working') # TODO :: fix
 class SolutionMemoverflowTest(FullTestBase):
     """This test tries a solution using more memory than the allowed limit."""
@@ -571,6 +884,142 @@ class TestMultipleTest(FullTestBase):
             self.assertVariableEqual("outputJson['executions'][0]['testsReports'][2]['checker']['stdout']['data']", "100")
             ]
 
+@register_test
+class BuiltinCheckerTest(FullTestBase):
+    """This test uses a built-in checker, comparing with a tolerance the
+    solution output with the expected output of each test file."""
+
+    description = "built-in checker test"
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': [
+                {'name': 'testbuiltin1.in', 'content': '30'},
+                {'name': 'testbuiltin1.out', 'content': '60.0000001\n'},
+                {'name': 'testbuiltin2.in', 'content': '45'},
+                {'name': 'testbuiltin2.out', 'content': '91\n'}],
+            'sanitizer': '@testSanitizer',
+            'checker': {'builtin': 'float', 'options': {'tolerance': 1e-6}},
+            'solutions': ['@testSolutionC'],
+            'executions': ['@testExecutionC']
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['checker']['exitCode']", 0),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][1]['checker']['stdout']['data'].split('\\n')[0]", "0")
+            ]
+
+@register_test
+class OutputPreCheckTest(FullTestBase):
+    """This test enables the output pre-check; the checker must only be
+    called for the test file where the solution output differs from the
+    expected output."""
+
+    description = "output pre-check test"
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': [
+                {'name': 'testprecheck1.in', 'content': '30'},
+                {'name': 'testprecheck1.out', 'content': ' 60\n'},
+                {'name': 'testprecheck2.in', 'content': '45'},
+                {'name': 'testprecheck2.out', 'content': '91\n'}],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': ['@testSolutionC'],
+            'executions': ['@testExecutionC'],
+            'options': {'outputPreCheck': 'spaces'}
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['commandLine']", "precheck:spaces"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][1]['checker']['commandLine'].startswith('precheck:')", False),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][1]['checker']['stdout']['data']", "100")
+            ]
+
+@register_test
+class ProfileTest(FullTestBase):
+    """This test enables the profile option, and checks the profile sections
+    of the report."""
+
+    description = "profile option test"
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': ['@testSolutionC'],
+            'executions': ['@testExecutionC'],
+            'options': {'profile': True}
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['profile']['phases']['preprocess']['count']", 1),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['profile']['totalMs'] > 0", True)
+            ]
+
+@register_test
+class EvaluationCacheTest(FullTestBase):
+    """This test evaluates a solution twice, and checks the second report is
+    the report of the first evaluation, taken from the cache without making a
+    build folder."""
+
+    description = "whole evaluation cache test"
+
+    def setUp(self):
+        """Evaluate the solution a first time."""
+        proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (procOut, procErr) = communicateWithTimeout(proc, 15, input=json.dumps(self.makeInputJson()))
+        self.assertEqual(proc.returncode, 0, msg="First evaluation failed: %s" % procErr)
+        self.firstBuildPath = json.loads(procOut)['buildPath']
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'generators': [],
+            'generations': [],
+            'extraTests': ['@testExtraSimple1'],
+            'sanitizer': '@testSanitizer',
+            'checker': '@testChecker',
+            'solutions': ['@testSolutionC'],
+            'executions': ['@testExecutionC'],
+            'options': {'evaluationCache': True}
+            }
+
+    def makeChecks(self):
+        buildPath = getattr(self, 'outputJson', {}).get('buildPath', '')
+        self.otherBuildPath = (buildPath != self.firstBuildPath)
+        self.buildFolderMade = os.path.isdir(buildPath)
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("otherBuildPath", True),
+            self.assertVariableEqual("buildFolderMade", False),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['execution']['wasCached']", True),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100")
+            ]
+
 @register_test
 class TestRestrictPath(FullTestBase):
     """This test tries to load a file which is not in the paths allowed by
@@ -606,6 +1055,529 @@ class TestRestrictPath(FullTestBase):
             self.assertVariableEqual("proc.returncode", 1),
             ]
 
+@register_test
+class TaskBundleTest(FullTestBase):
+    """This test prepares a task bundle from the default task components, then
+    evaluates a solution against that bundle."""
+
+    description = "task bundle test"
+
+    def setUp(self):
+        """Prepare the task bundle."""
+        proc = subprocess.Popen([CFG_TASKGRADER, '--prepare-task', SELFDIR], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (procOut, procErr) = communicateWithTimeout(proc, 15)
+        self.assertEqual(proc.returncode, 0, msg="Task bundle preparation failed: %s" % procErr)
+        self.bundlePath = json.loads(procOut)['bundlePath']
+
+    def makeInputJson(self):
+        return {
+            'rootPath': os.path.dirname(os.path.abspath(__file__)),
+            'taskPath': '$ROOT_PATH',
+            'taskBundle': self.bundlePath,
+            'solutions': ['@testSolutionC'],
+            'executions': ['@testExecutionC']
+            }
+
+    def makeChecks(self):
+        return [
+            self.assertVariableEqual("proc.returncode", 0),
+            self.assertVariableEqual("outputJson['generations'][0]['outputGeneratorExecution']['stdout']['data']", "40"),
+            self.assertVariableEqual("outputJson['checker']['wasCached']", True),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['name']", "test20"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][0]['checker']['stdout']['data']", "100"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][1]['name']", "testextra1"),
+            self.assertVariableEqual("outputJson['executions'][0]['testsReports'][1]['checker']['stdout']['data']", "100")
+            ]
+
+
+### Unit tests of taskgrader internals
+
+class UnitTestBase(unittest.TestCase):
+    """A unit test checks directly the functions and classes of the
+    taskgrader, for behaviors difficult to trigger with a full test."""
+
+    def setUp(self):
+        self.details = {}
+
+    def setConfig(self, name, value, module=taskgrader):
+        """Change the configuration variable name of module (by default the
+        taskgrader) for the duration of the test."""
+        self.addCleanup(setattr, module, name, getattr(module, name))
+        setattr(module, name, value)
+
+    def makeTmpDir(self):
+        """Make a temporary folder, deleted after the test."""
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        return tmpDir
+
+    def writeFile(self, path, data):
+        f = open(path, 'w')
+        f.write(data)
+        f.close()
+
+@register_test
+class LimitsReuseTest(UnitTestBase):
+    """Test which cached executions with other limits are reused."""
+
+    def makeReport(self, timeLimitMs, memoryLimitKb, **kwargs):
+        """Make the report of an execution with the given limits."""
+        report = {'realTimeLimitMs': timeLimitMs,
+            'realMemoryLimitKb': memoryLimitKb,
+            'realTimeTakenMs': 100,
+            'memoryUsedKb': 1000,
+            'wasKilled': False,
+            'exitCode': 0,
+            'exitSig': 0}
+        report.update(kwargs)
+        return report
+
+    def isImplied(self, report, timeLimitMs, memoryLimitKb):
+        """Check whether report is also the result of an execution with the
+        limits timeLimitMs and memoryLimitKb."""
+        execution = taskgrader.IsolatedExecution(None,
+            {'timeLimitMs': timeLimitMs, 'memoryLimitKb': memoryLimitKb}, 'true', {})
+        program = types.InstanceType(taskgrader.Program, {'execution': execution})
+        return program._isImpliedReport(report)
+
+    def test_killed(self):
+        """Execution killed at a higher time limit"""
+        report = self.makeReport(2000, 64000, realTimeTakenMs=2000, wasKilled=True, exitCode=0, exitSig=137)
+        self.assertTrue(self.isImplied(report, 1000, 64000))
+        self.assertFalse(self.isImplied(report, 3000, 64000))
+
+    def test_wellWithin(self):
+        """Successful execution well within both limits"""
+        self.assertTrue(self.isImplied(self.makeReport(1000, 64000), 2000, 64000))
+        self.assertTrue(self.isImplied(self.makeReport(2000, 64000), 1000, 64000))
+        # Too close to the new limit
+        self.assertFalse(self.isImplied(self.makeReport(2000, 64000, realTimeTakenMs=800), 1000, 64000))
+
+    def test_failed(self):
+        """Failed execution at a lower time limit"""
+        self.assertFalse(self.isImplied(self.makeReport(1000, 64000, exitCode=1), 2000, 64000))
+        self.assertFalse(self.isImplied(self.makeReport(1000, 64000, exitSig=11), 2000, 64000))
+        self.assertTrue(self.isImplied(self.makeReport(1000, 64000, exitCode=1), 1000, 64000))
+
+    def test_memoryWithoutControlGroups(self):
+        """Memory limit change without control groups"""
+        report = self.makeReport(1000, 64000)
+        self.setConfig('CFG_CONTROLGROUPS', False)
+        self.assertFalse(self.isImplied(report, 1000, 128000))
+        self.setConfig('CFG_CONTROLGROUPS', True)
+        self.assertTrue(self.isImplied(report, 1000, 128000))
+
+@register_test
+class CacheDatabaseTest(UnitTestBase):
+    """Test the cache entries, stored in a temporary cache."""
+
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.tmpDir = self.makeTmpDir()
+        cacheDir = os.path.join(self.tmpDir, 'cache')
+        cacheDbPath = os.path.join(self.tmpDir, 'taskgrader-cache.sqlite')
+        os.mkdir(cacheDir)
+        for module in [taskgrader, clean_cache]:
+            self.setConfig('CFG_CACHEDIR', cacheDir, module)
+            self.setConfig('CFG_CACHEDBPATH', cacheDbPath, module)
+        self.setConfig('CFG_CACHEDBPATH', cacheDbPath, taskgrader.schema_db)
+        taskgrader.schema_db.schemaDb()
+        taskgrader.CACHE_ACCESS_TIMES.clear()
+
+        self.cache = taskgrader.CacheDatabase()
+        self.sourcePath = os.path.join(self.tmpDir, 'source.py')
+        self.writeFile(self.sourcePath, 'print(42)')
+
+    def getCacheFolder(self, cacheType='test'):
+        return self.cache.getHandle([{'name': 'source.py', 'path': self.sourcePath}]).getCacheFolder(cacheType)
+
+    def makeEntry(self, cacheType='test'):
+        """Make a complete cache entry, returns its CacheFolder."""
+        cachef = self.getCacheFolder(cacheType)
+        self.assertFalse(cachef.isCached)
+        outputPath = os.path.join(self.tmpDir, 'output')
+        self.writeFile(outputPath, '42')
+        cachef.addFile(outputPath)
+        cachef.addReport({'exitCode': 0})
+        self.assertTrue(cachef.save())
+        return cachef
+
+    def getRow(self, cacheId):
+        return self.cache.database.execute("SELECT * FROM cache WHERE id=?", [cacheId]).fetchone()
+
+    def test_hit(self):
+        """Cache entry saved and reused"""
+        cacheId = self.makeEntry().cacheId
+        cachef = self.getCacheFolder()
+        self.assertTrue(cachef.isCached)
+        self.assertFalse(cachef.locked)
+        self.assertEqual(cachef.cacheId, cacheId)
+        self.assertEqual(cachef.files, ['output'])
+        self.assertEqual(cachef.loadReport(), {'exitCode': 0})
+
+    def test_changedSource(self):
+        """Cache entry of a modified program"""
+        oldCachef = self.makeEntry()
+        self.writeFile(self.sourcePath, 'print(43)')
+        cachef = self.getCacheFolder()
+        self.assertFalse(cachef.isCached)
+        # The files of the old entry are kept, they may be in use
+        self.assertNotEqual(cachef.cacheId, oldCachef.cacheId)
+        self.assertTrue(os.path.isfile(oldCachef._makePath('output')))
+        self.assertIsNone(self.getRow(oldCachef.cacheId))
+
+    def test_concurrentSave(self):
+        """Cache entry made for another program meanwhile"""
+        cachef = self.getCacheFolder()
+        self.cache.database.execute("UPDATE cache SET hashlist='other' WHERE id=?", [cachef.cacheId])
+        cachef.addReport({'exitCode': 0})
+        self.assertFalse(cachef.save())
+        self.assertFalse(cachef.isCached)
+        self.assertIsNone(self.getRow(cachef.cacheId)['files'])
+
+    def test_removedFolder(self):
+        """Cache entry with its folder removed"""
+        cacheId = self.makeEntry().cacheId
+        shutil.rmtree(os.path.join(taskgrader.CFG_CACHEDIR, str(cacheId)))
+        cachef = self.getCacheFolder()
+        self.assertEqual(cachef.cacheId, cacheId)
+        self.assertFalse(cachef.isCached)
+        self.assertTrue(cachef.locked)
+        self.assertIsNone(self.getRow(cacheId)['files'])
+
+    def test_oldEntry(self):
+        """Cache entry made by an older version"""
+        cachef = self.getCacheFolder()
+        cacheId = cachef.cacheId
+        cachef = None
+        self.writeFile(os.path.join(taskgrader.CFG_CACHEDIR, str(cacheId), 'output'), '42')
+        self.writeFile(os.path.join(taskgrader.CFG_CACHEDIR, str(cacheId), 'report.json'), '{"exitCode": 0}')
+        self.writeFile(os.path.join(taskgrader.CFG_CACHEDIR, str(cacheId), 'cache.files'), cPickle.dumps(['output']))
+        self.writeFile(os.path.join(taskgrader.CFG_CACHEDIR, str(cacheId), 'cache.ok'), str(time.time()))
+
+        cachef = self.getCacheFolder()
+        self.assertTrue(cachef.isCached)
+        self.assertEqual(cachef.files, ['output'])
+        self.assertEqual(cachef.loadReport(), {'exitCode': 0})
+        self.assertFalse(os.path.exists(cachef._makePath('cache.ok')))
+        self.assertEqual(json.loads(self.getRow(cacheId)['files']), ['output'])
+
+    def test_accessTimes(self):
+        """Access times of the cache entries"""
+        cacheId = self.makeEntry().cacheId
+        # Recent access times are not updated
+        self.getCacheFolder()
+        self.assertEqual(taskgrader.CACHE_ACCESS_TIMES, {})
+
+        self.cache.database.execute("UPDATE cache SET atime=0 WHERE id=?", [cacheId])
+        self.cache.database.commit()
+        self.getCacheFolder()
+        self.getCacheFolder()
+        # The accesses are recorded once, and saved together
+        self.assertEqual(taskgrader.CACHE_ACCESS_TIMES.keys(), [cacheId])
+        self.assertEqual(self.getRow(cacheId)['atime'], 0)
+        taskgrader.saveCacheAccessTimes()
+        self.assertEqual(taskgrader.CACHE_ACCESS_TIMES, {})
+        self.assertGreater(self.getRow(cacheId)['atime'], time.time() - 60)
+
+    def test_limitsVariant(self):
+        """Cache entry implied by an entry with other limits"""
+        handle = self.cache.getHandle([{'name': 'source.py', 'path': self.sourcePath}])
+        variantReport = {'realTimeLimitMs': 2000, 'realMemoryLimitKb': 64000,
+            'realTimeTakenMs': 100, 'memoryUsedKb': 1000, 'wasKilled': False,
+            'exitCode': 0, 'exitSig': 0}
+        variant = handle.getCacheFolder('test', execParams={'timeLimitMs': 2000, 'memoryLimitKb': 64000})
+        variant.addReport(variantReport)
+        self.assertTrue(variant.save())
+
+        execParams = {'timeLimitMs': 1000, 'memoryLimitKb': 64000}
+        execution = taskgrader.IsolatedExecution(None, execParams, 'true', {})
+        program = types.InstanceType(taskgrader.Program, {'execution': execution, 'cacheHandle': handle})
+        cachef = handle.getCacheFolder('test', execParams=execParams)
+        # The entry is replaced meanwhile, the report is still returned
+        self.cache.database.execute("UPDATE cache SET hashlist='other' WHERE id=?", [cachef.cacheId])
+        report = program._loadLimitsVariant(cachef, self.tmpDir)
+        self.assertEqual(report['realTimeLimitMs'], 1000)
+        self.assertEqual(report['realTimeTakenMs'], 100)
+        self.assertFalse(cachef.isCached)
+
+    def test_cleanCache(self):
+        """Pruning of old cache entries"""
+        oldId = self.makeEntry().cacheId
+        self.cache.database.execute("UPDATE cache SET atime=0 WHERE id=?", [oldId])
+        self.cache.database.commit()
+        recentId = self.makeEntry('test-recent').cacheId
+        # Entry being made
+        currentCachef = self.getCacheFolder('test-current')
+
+        clean_cache.pruneCache(self.cache.database)
+        self.assertIsNone(self.getRow(oldId))
+        self.assertFalse(os.path.exists(os.path.join(taskgrader.CFG_CACHEDIR, str(oldId))))
+        self.assertIsNotNone(self.getRow(recentId)['files'])
+        self.assertTrue(os.path.exists(os.path.join(taskgrader.CFG_CACHEDIR, str(recentId))))
+        self.assertTrue(os.path.exists(currentCachef._makePath()))
+        currentCachef.addReport({'exitCode': 0})
+        self.assertTrue(currentCachef.save())
+
+        cachef = self.getCacheFolder()
+        self.assertFalse(cachef.isCached)
+        self.assertNotEqual(cachef.cacheId, oldId)
+
+@register_test
+class PrecompiledHeadersTest(UnitTestBase):
+    """Test the building and pruning of precompiled headers, in a temporary
+    folder."""
+
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.pchDir = os.path.join(self.makeTmpDir(), 'pch')
+        for module in [taskgrader, clean_cache]:
+            self.setConfig('CFG_PCHDIR', self.pchDir, module)
+        self.setConfig('CFG_CPP_PCH_HEADERS', ['bits/stdc++.h'])
+        self.addCleanup(taskgrader.PCH_DIRS.update, dict(taskgrader.PCH_DIRS))
+        taskgrader.PCH_DIRS.clear()
+
+    def test_failedBuild(self):
+        """No folder left when no header could be precompiled"""
+        self.assertIsNone(taskgrader.getPrecompiledHeaders('false', ''))
+        self.assertEqual(os.listdir(self.pchDir), [])
+
+    def test_prune(self):
+        """Pruning of unused precompiled headers"""
+        for folder in ['old', 'recent']:
+            os.makedirs(os.path.join(self.pchDir, folder, 'bits'))
+            self.writeFile(os.path.join(self.pchDir, folder, 'bits', 'stdc++.h.gch'), 'gch')
+        os.utime(os.path.join(self.pchDir, 'old'), (0, 0))
+        clean_cache.prunePrecompiledHeaders()
+        self.assertEqual(os.listdir(self.pchDir), ['recent'])
+
+@register_test
+class PreprocessJsonTest(UnitTestBase):
+    """Test the expansion of variables in the input JSON."""
+
+    pathData = {'ROOT_PATH': '/root', 'TASK_PATH': '$ROOT_PATH/task', 'BUILD_PATH': '/build'}
+
+    def preprocess(self, json, **varData):
+        data = dict(self.pathData)
+        data.update(varData)
+        return taskgrader.preprocessJson(json, data)
+
+    def test_selfReference(self):
+        """Variables referencing themselves"""
+        with self.assertRaisesRegexp(Exception, 'references itself'):
+            self.preprocess('@a', a='@a')
+        with self.assertRaisesRegexp(Exception, 'references itself'):
+            self.preprocess('@a', a={'b': ['@b']}, b='@a')
+        with self.assertRaisesRegexp(Exception, 'references itself'):
+            self.preprocess('$ROOT_PATH', ROOT_PATH='$TASK_PATH', TASK_PATH='$ROOT_PATH')
+
+    def test_shared(self):
+        """Variables expanded once and shared"""
+        result = self.preprocess(['@a', '@b', {'c': '@a'}], a={'d': '@e'}, b='@a', e=[1])
+        self.assertEqual(result, [{'d': [1]}, {'d': [1]}, {'c': {'d': [1]}}])
+        self.assertIs(result[0], result[1])
+        self.assertIs(result[0], result[2]['c'])
+
+    def test_pathVariables(self):
+        """Path variables referencing other path variables"""
+        self.assertEqual(self.preprocess(['$TASK_PATH/gen.sh', '$BUILD_PATH/tests/', '$ROOT_PATH']),
+            ['/root/task/gen.sh', '/build/tests/', '/root'])
+        self.assertEqual(self.preprocess('@a', a='$TASK_PATH/$ROOT_PATH', ROOT_PATH='$BUILD_PATH/root'),
+            '/build/root/task//build/root')
+
+    def test_noneRemoved(self):
+        """None values removed from lists only"""
+        self.assertEqual(self.preprocess({'a': ['@b', 1, None, '@b'], 'b': '@b'}, b=None),
+            {'a': [1], 'b': None})
+
+    def test_recursiveOutput(self):
+        """Same output as the former recursive expansion"""
+        varData = {
+            'execParams': {'timeLimitMs': 1000, 'getFiles': []},
+            'defaultExecParams': '@execParams',
+            'genExecution': '@defaultExecParams',
+            'optionalFile': None,
+            'generator': {'id': 'gen', 'compilationDescr': {'language': 'sh',
+                'files': [{'name': 'gen.sh', 'path': '$TASK_PATH/gen.sh'}, '@optionalFile']},
+                'compilationExecution': '@defaultExecParams'},
+            'generators': ['@generator'],
+            'generations': [{'id': 'g1', 'idGenerator': 'gen', 'genExecution': '@genExecution'}]}
+        self.assertEqual(self.preprocess({'generators': '@generators', 'generations': '@generations',
+                'extraTests': ['@optionalFile', {'name': 'test.in', 'path': '$BUILD_PATH/test.in'}]},
+                **varData), {
+            'generators': [{'id': 'gen',
+                'compilationDescr': {'language': 'sh',
+                    'files': [{'name': 'gen.sh', 'path': '/root/task/gen.sh'}]},
+                'compilationExecution': {'timeLimitMs': 1000, 'getFiles': []}}],
+            'generations': [{'id': 'g1', 'idGenerator': 'gen',
+                'genExecution': {'timeLimitMs': 1000, 'getFiles': []}}],
+            'extraTests': [{'name': 'test.in', 'path': '/build/test.in'}]})
+
+@register_test
+class ProfileHelpersTest(UnitTestBase):
+    """Test the profile helpers, with and without a profile."""
+
+    def test_noProfile(self):
+        """Profile helpers without a profile"""
+        self.setConfig('PROFILE', None)
+        with taskgrader.profilePhase('test'):
+            pass
+        self.assertEqual(taskgrader.profiled('test')(lambda x: x + 1)(1), 2)
+        self.assertIsNone(taskgrader.PROFILE)
+
+    def test_profile(self):
+        """Profile helpers with a profile"""
+        self.setConfig('PROFILE', taskgrader.Profile())
+        with taskgrader.profilePhase('test'):
+            pass
+        taskgrader.profiled('test')(lambda: None)()
+        self.assertEqual(taskgrader.PROFILE.makeReport()['phases']['test']['count'], 2)
+
+@register_test
+class OutputDiffTest(UnitTestBase):
+    """Test the comparison of outputs of output_diff, used by the default
+    checker and the built-in checkers."""
+
+    def setUp(self):
+        UnitTestBase.setUp(self)
+        self.tmpDir = self.makeTmpDir()
+
+    def diff(self, solData, expData, options=None):
+        """Compare solData with expData, returns the grade and the result."""
+        solPath = os.path.join(self.tmpDir, 'test.solout')
+        expPath = os.path.join(self.tmpDir, 'test.out')
+        self.writeFile(solPath, solData)
+        self.writeFile(expPath, expData)
+        return output_diff.diff(solPath, expPath, options)
+
+    def test_identical(self):
+        """Identical outputs"""
+        self.assertEqual(self.diff('1\n2\n3\n', '1\n2\n3\n'), (100, {}))
+        self.assertEqual(self.diff('', ''), (100, {}))
+
+    def test_mismatch(self):
+        """Outputs with a different line"""
+        (grade, result) = self.diff('1\n2\n3 4\n5\n', '1\n2\n3 5\n5\n')
+        self.assertEqual(grade, 0)
+        self.assertEqual(result['diffRow'], 3)
+        self.assertEqual(result['diffCol'], 3)
+        self.assertEqual(result['displayedSolutionOutput'], '1\n2\n3 4\n5\n')
+        self.assertEqual(result['displayedExpectedOutput'], '1\n2\n3 5\n5\n')
+        # Missing line
+        (grade, result) = self.diff('1\n2\n', '1\n2\n3\n')
+        self.assertEqual(grade, 0)
+        self.assertEqual(result['diffRow'], 3)
+
+    def test_blankLines(self):
+        """Outputs differing by blank lines"""
+        self.assertEqual(self.diff('1\n\n2\n\n', '1\n2')[0], 100)
+        # Lines with only whitespaces are blank lines too
+        self.assertEqual(self.diff('1\n\n', '  \t   \n1')[0], 100)
+        self.assertEqual(self.diff('1\n\n2\n', '1\n2\n', {'ignoreBlankLines': False})[0], 0)
+
+    def test_whitespaces(self):
+        """Outputs differing by whitespaces"""
+        self.assertEqual(self.diff('1  2\t3 \n', '1 2 3\n')[0], 100)
+        self.assertEqual(self.diff('1  2\n', '1 2\n', {'ignoreSpaceChange': False})[0], 0)
+        self.assertEqual(self.diff('12\n', '1 2\n')[0], 0)
+
+    def test_chunks(self):
+        """Outputs larger than a chunk"""
+        lines = ['%d\n' % i for i in range(output_diff.CHUNK_SIZE / 3)]
+        data = ''.join(lines)
+        self.assertGreater(len(data), 2 * output_diff.CHUNK_SIZE)
+        self.assertEqual(self.diff(data, data), (100, {}))
+        self.assertEqual(self.diff(data + '\n\n', data)[0], 100)
+
+        # Difference on the line after the end of the first chunk
+        offset = 0
+        for (lineIdx, line) in enumerate(lines):
+            offset += len(line)
+            if offset > output_diff.CHUNK_SIZE:
+                break
+        solLines = lines[:]
+        solLines[lineIdx + 1] = 'x\n'
+        (grade, result) = self.diff(''.join(solLines), data)
+        self.assertEqual(grade, 0)
+        self.assertEqual(result['diffRow'], lineIdx + 2)
+        self.assertEqual(result['displayedExpectedOutput'], ''.join(lines[lineIdx-2:lineIdx+5]))
+
+    def test_defaultChecker(self):
+        """defaultChecker.py program"""
+        for (solData, expected) in [('1 2\n', '100'), ('1 3\n', '0')]:
+            self.writeFile(os.path.join(self.tmpDir, 'test.solout'), solData)
+            self.writeFile(os.path.join(self.tmpDir, 'test.out'), '1  2')
+            proc = subprocess.Popen([CFG_DEFAULTCHECKER, 'test.solout', 'test.in', 'test.out'],
+                stdout=subprocess.PIPE, cwd=self.tmpDir)
+            (procOut, procErr) = communicateWithTimeout(proc, 15)
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(procOut.split('\n')[0], expected)
+
+@register_test
+class MetricsTest(UnitTestBase):
+    """Test the metrics accumulated into the metrics file."""
+
+    def readMetrics(self, path):
+        """Read the samples of the metrics file path, indexed by their name
+        with labels."""
+        samples = {}
+        for line in open(path, 'r'):
+            if line[0] != '#':
+                (name, value) = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_save(self):
+        """Metrics saved twice"""
+        path = os.path.join(self.makeTmpDir(), 'metrics.prom')
+        metrics = taskgrader.Metrics()
+        metrics.inc('taskgrader_cache_hits_total', {'cache_type': 'execution'})
+        metrics.inc('taskgrader_cache_hits_total', {'cache_type': 'execution'})
+        metrics.observe('taskgrader_lock_wait_seconds', 0.003, {'lock': 'cacheFolder'})
+        metrics.observe('taskgrader_lock_wait_seconds', 0.2, {'lock': 'cacheFolder'})
+        metrics.save(path)
+        # Metrics are reset after being saved
+        self.assertEqual(metrics.counters, {})
+        self.assertEqual(metrics.histograms, {})
+
+        metrics.inc('taskgrader_cache_hits_total', {'cache_type': 'execution'})
+        metrics.inc('taskgrader_isolate_errors_total')
+        metrics.observe('taskgrader_lock_wait_seconds', 200, {'lock': 'cacheFolder'})
+        metrics.save(path)
+
+        samples = self.readMetrics(path)
+        self.assertEqual(samples['taskgrader_cache_hits_total{cache_type="execution"}'], 3)
+        self.assertEqual(samples['taskgrader_isolate_errors_total'], 1)
+
+        # Buckets are cumulative, +Inf counts all observations
+        name = 'taskgrader_lock_wait_seconds'
+        buckets = [samples['%s_bucket{lock="cacheFolder",le="%s"}' % (name, bound)]
+            for bound in taskgrader.METRICS_BUCKETS + ['+Inf']]
+        self.assertEqual(buckets[:4], [0, 1, 1, 1])
+        self.assertEqual(buckets[-2:], [2, 3])
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertEqual(samples['%s_count{lock="cacheFolder"}' % name], 3)
+        self.assertAlmostEqual(samples['%s_sum{lock="cacheFolder"}' % name], 200.203)
+
+    def test_temporaryException(self):
+        """Temporary errors counted once per evaluation"""
+        path = os.path.join(self.makeTmpDir(), 'metrics.prom')
+        self.setConfig('CFG_METRICS_FILE', path)
+        self.setConfig('METRICS', taskgrader.Metrics())
+        def failingEvaluation(evaluationParams):
+            # Exceptions caught and raised again are only counted once
+            try:
+                raise taskgrader.TemporaryException("first try")
+            except taskgrader.TemporaryException:
+                raise taskgrader.TemporaryException("second try")
+        self.setConfig('_evaluation', failingEvaluation)
+
+        self.assertRaises(taskgrader.TemporaryException, taskgrader.evaluation, {})
+        samples = self.readMetrics(path)
+        self.assertEqual(samples['taskgrader_temporary_exceptions_total'], 1)
+        self.assertEqual(samples['taskgrader_evaluations_total{result="temporary"}'], 1)
+
+
 
 ### Test examples
 
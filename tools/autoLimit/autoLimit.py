@@ -9,59 +9,109 @@
 # time/memory transformation functions for the current server.
 
 
-import argparse, json, os, sys, subprocess
+import argparse, atexit, json, os, platform, queue, sys, subprocess, threading, time
+from concurrent.futures import ThreadPoolExecutor
 
 SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
 
-CFG_GENSTD = os.path.normpath(os.path.join(SELFDIR, '../stdGrade/genStdTaskJson.py'))
-CFG_TASKGRADER = os.path.normpath(os.path.join(SELFDIR, '../../taskgrader.py'))
+CFG_EVALSERVER = os.path.join(SELFDIR, 'evalServer.py')
+# Module where the calibrated transformations are written, loaded by the
+# taskgrader
+CFG_TRANSFORMS_MODULE = os.path.normpath(os.path.join(SELFDIR, '../../config_transforms.py'))
 
 CFG_RATIO = 0.05 # Ratio which is considered as a good limit
+CFG_JOBS = 4 # Maximum number of evaluations running at the same time
 CFG_MAX_TIMELIMIT = 60000       # in milliseconds
 CFG_MAX_MEMORYLIMIT = 1024*1024 # in kilobytes
 
+# Other names the taskgrader knows each language of reference.json by
+CFG_LANG_ALIASES = {
+    'ocaml': ['ml'],
+    'python2': ['py', 'py2', 'python'],
+    'python3': ['py3']
+    }
+
 
 def linearRegression(xyList):
     """Return the coefficients a b so that yList ~= a * xList + b."""
     avgX, avgY, avgX2, avgXY = 0, 0, 0, 0
     for x, y in xyList:
-        avgX += x
-        avgY += y
-        avgX2 += x**2
-        avgXY += x*y
-    a = float(avgXY - avgX * avgY) / float(avgX2 - avgX**2)
-    b = avgY - a * avgX
+        avgX += float(x) / len(xyList)
+        avgY += float(y) / len(xyList)
+        avgX2 += float(x**2) / len(xyList)
+        avgXY += float(x*y) / len(xyList)
+    if avgX2 - avgX**2 > 0:
+        a = (avgXY - avgX * avgY) / (avgX2 - avgX**2)
+        b = avgY - a * avgX
+    else:
+        # All x are the same (for instance a single reference program), we
+        # can only fit a proportional transformation
+        a = avgY / avgX
+        b = 0
 
     return (a, int(b))
 
 
+class EvalServer(object):
+    """Evaluation server process, evaluating solutions with the taskgrader
+    in-process (see evalServer.py)."""
+    def __init__(self):
+        self.proc = subprocess.Popen([CFG_EVALSERVER], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, universal_newlines=True)
+
+    def evaluate(self, request):
+        """Send an evaluation request, return the taskgrader report."""
+        self.proc.stdin.write(json.dumps(request) + '\n')
+        self.proc.stdin.flush()
+        line = self.proc.stdout.readline()
+        if not line:
+            raise Exception("Evaluation server exited unexpectedly.")
+        return json.loads(line)
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+# Evaluation servers not currently evaluating a solution; there are at most as
+# many servers as evaluations running at the same time
+IDLE_SERVERS = queue.Queue()
+ALL_SERVERS = []
+
+def closeServers():
+    for server in ALL_SERVERS:
+        server.close()
+
+atexit.register(closeServers)
+
+
 def tryEvaluation(taskPath, solution, timeLimit=None, memoryLimit=None, language=None):
     """Evaluate a solution against a task, using specified limits.
     If limits are None, the default limits set for the task are used."""
-
-    # Prepare genStdTaskJson arguments
-    genCmd = [CFG_GENSTD, '-p', taskPath, '-r', solution]
-    if timeLimit is not None:
-        genCmd.extend(['-t', str(timeLimit)])
-    if memoryLimit is not None:
-        genCmd.extend(['-m', str(memoryLimit)])
-    if language is not None:
-        genCmd.extend(['-l', language])
+    try:
+        server = IDLE_SERVERS.get_nowait()
+    except queue.Empty:
+        server = EvalServer()
+        ALL_SERVERS.append(server)
 
     # Launch an evaluation
-    genProc = subprocess.Popen(genCmd, stdout=subprocess.PIPE, universal_newlines=True)
-    graderProc = subprocess.Popen([CFG_TASKGRADER], stdin=genProc.stdout, stdout=subprocess.PIPE, universal_newlines=True)
-
     try:
-        outputJson = json.load(graderProc.stdout)
-    except:
-        raise Exception("Evaluation failed for solution '%s' with task '%s'." % (solution, taskPath))
+        outputJson = server.evaluate({'taskPath': taskPath, 'solution': solution,
+            'timeLimit': timeLimit, 'memoryLimit': memoryLimit,
+            'language': language})
+    finally:
+        IDLE_SERVERS.put(server)
+
+    if 'error' in outputJson:
+        raise Exception("Evaluation failed for solution '%s' with task '%s':\n%s" % (solution, taskPath, outputJson['error']))
 
     # Read usage
     maxTime = 0
     maxMem = 0
     maxTimeLimit = 0
     maxMemLimit = 0
+    maxRealTimeLimit = 0
+    maxRealMemLimit = 0
     nbFails, nbNoExec, nbTotal = 0, 0, 0
 
     for execution in outputJson['executions']:
@@ -77,34 +127,117 @@ def tryEvaluation(taskPath, solution, timeLimit=None, memoryLimit=None, language
                 nbFails += 1
             else:
                 maxTime = max(maxTime, execReport['timeTakenMs'])
-                maxMem = max(maxMem, execReport['memoryUsedKb'])
+                maxMem = max(maxMem, execReport.get('memoryUsedKb', -1))
                 maxTimeLimit = max(maxTimeLimit, execReport['timeLimitMs'])
                 maxMemLimit = max(maxMemLimit, execReport['memoryLimitKb'])
+                # Limits actually used, after the transformations configured
+                maxRealTimeLimit = max(maxRealTimeLimit, execReport.get('realTimeLimitMs', execReport['timeLimitMs']))
+                maxRealMemLimit = max(maxRealMemLimit, execReport.get('realMemoryLimitKb', execReport['memoryLimitKb']))
 
     # Return whether there were failures, the maximum time taken and the maximum memory used
     return {'failed': nbFails > 0,
             'maxTime': maxTime,
             'maxMem': maxMem,
             'maxTimeLimit': maxTimeLimit,
-            'maxMemLimit': maxMemLimit}
+            'maxMemLimit': maxMemLimit,
+            'maxRealTimeLimit': maxRealTimeLimit,
+            'maxRealMemLimit': maxRealMemLimit}
+
+
+# Evaluations of both limit searches share the same pool
+EVALUATIONS_POOL = ThreadPoolExecutor(max_workers=CFG_JOBS)
 
 
 def tryMultipleEvaluations(taskPath, solutionList, timeLimit=None, memoryLimit=None, language=None):
     """Evaluate multiple solutions against a task, summarizing the results."""
-    # Evaluate each solution individually
-    reports = []
+    # Evaluate each solution individually, all at the same time
+    futures = []
     for solution in solutionList:
-        reports.append(tryEvaluation(taskPath, solution, timeLimit, memoryLimit, language))
+        futures.append(EVALUATIONS_POOL.submit(tryEvaluation, taskPath, solution, timeLimit, memoryLimit, language))
+    reports = [f.result() for f in futures]
 
     # Fetch values from each report
     finalReport = {}
     finalReport['failed'] = any(map(lambda r: r['failed'], reports))
-    for key in ['maxTime', 'maxMem', 'maxTimeLimit', 'maxMemLimit']:
+    for key in ['maxTime', 'maxMem', 'maxTimeLimit', 'maxMemLimit', 'maxRealTimeLimit', 'maxRealMemLimit']:
         finalReport[key] = max(map(lambda r: r[key], reports))
 
     return finalReport
 
 
+PRINT_LOCK = threading.Lock()
+
+def printProgress(msg):
+    """Print a progress message from one of the limit searches."""
+    with PRINT_LOCK:
+        print(msg, flush=True)
+
+
+def searchLimit(tryLimit, minLimit, maxLimit, guess=None, name='limit'):
+    """Find the lowest limit between minLimit and maxLimit for which
+    tryLimit(limit) succeeds, up to CFG_RATIO.
+    If guess (such as the time or memory measured) is given, the search first
+    gallops around guess to bracket the answer, instead of bisecting the whole
+    range."""
+    def tryAndNarrow(curLimit):
+        nonlocal minLimit, maxLimit
+        if tryLimit(curLimit):
+            maxLimit = curLimit
+            printProgress("%s %d: ok" % (name, curLimit))
+            return True
+        else:
+            minLimit = curLimit + 1
+            printProgress("%s %d: failed" % (name, curLimit))
+            return False
+
+    if guess is not None and minLimit < guess < maxLimit:
+        step = max(1, int(guess * CFG_RATIO))
+        # Try just above the guess, then go up with increasing steps until a
+        # limit succeeds
+        curLimit = guess + step
+        while curLimit < maxLimit and not tryAndNarrow(curLimit):
+            step *= 2
+            curLimit = minLimit + step
+        # Go down the same way until a limit fails
+        step = max(1, int(guess * CFG_RATIO))
+        curLimit = maxLimit - step
+        while curLimit > minLimit and tryAndNarrow(curLimit):
+            step *= 2
+            curLimit = maxLimit - step
+
+    # Bisect the remaining range
+    while maxLimit > 0 and maxLimit - minLimit >= CFG_RATIO * maxLimit:
+        tryAndNarrow(int((minLimit + maxLimit) / 2))
+
+    return maxLimit
+
+
+def deriveLimits(usageEval, minTimeLimit, maxTimeLimit, minMemLimit, maxMemLimit):
+    """Derive the time and memory limits from the usage measured during an
+    evaluation where all solutions succeeded, allowing CFG_RATIO above the
+    usage. Returns None if the limits cannot be derived."""
+    if usageEval['failed'] or usageEval['maxTime'] <= 0 or usageEval['maxMem'] <= 0:
+        return None
+
+    timeLimit = int(usageEval['maxTime'] * (1 + CFG_RATIO)) + 1
+    memLimit = int(usageEval['maxMem'] * (1 + CFG_RATIO)) + 1
+    return (min(max(timeLimit, minTimeLimit), maxTimeLimit),
+            min(max(memLimit, minMemLimit), maxMemLimit))
+
+
+def makeLimitsResults(maxTimeLimit, maxMemLimit, finalEval):
+    """Make the results of findLimits, from the limits found and the
+    evaluation with these limits."""
+    return {
+        'maxTimeLimit': maxTimeLimit,
+        'maxMemLimit': maxMemLimit,
+        'maxTime': finalEval['maxTime'],
+        'maxMem': finalEval['maxMem'],
+        'maxRealTimeLimit': finalEval['maxRealTimeLimit'],
+        'maxRealMemLimit': finalEval['maxRealMemLimit']
+        }
+
+
 def findLimits(taskPath, solutionList, language=None):
     """Find good limits for a task, encompassing solutions from solutionList."""
     minTimeLimit = 0
@@ -112,12 +245,9 @@ def findLimits(taskPath, solutionList, language=None):
     minMemLimit = 0
     maxMemLimit = CFG_MAX_MEMORYLIMIT
 
-    tlOk = False
-    mlOk = False
-
     # Do a first evaluation to get the task's default limits
     print("Initial evaluation...")
-    taskEval = tryMultipleEvaluations(taskPath, solutionList)
+    taskEval = tryMultipleEvaluations(taskPath, solutionList, language=language)
     if taskEval['failed']:
         minTimeLimit = taskEval['maxTimeLimit']
         minMemLimit = taskEval['maxMemLimit']
@@ -125,60 +255,51 @@ def findLimits(taskPath, solutionList, language=None):
         maxTimeLimit = taskEval['maxTimeLimit']
         maxMemLimit = taskEval['maxMemLimit']
 
-    print("Finding time limit", end='', flush=True)
-    while True:
-        # Check if limits are under ratio
-        if maxTimeLimit <= 0 or maxTimeLimit - minTimeLimit < CFG_RATIO * maxTimeLimit:
-            break
-
-        curTimeLimit = int((minTimeLimit + maxTimeLimit) / 2)
-
-        # Make new evaluations
-        curEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=curTimeLimit, memoryLimit=maxMemLimit, language=language)
-
-        # Check if evaluation was successful or failed
-        if curEval['failed']:
-            minTimeLimit = curTimeLimit + 1
-            print('!', end='', flush=True)
-        else:
-            maxTimeLimit = curTimeLimit
-            print('.', end='', flush=True)
-    print(' done.')
-
-    print("Finding memory limit", end='', flush=True)
-    while True:
-        # Check if limits are under ratio
-        if maxMemLimit <= 0 or maxMemLimit - minMemLimit < CFG_RATIO * maxMemLimit:
-            # We're done
-            break
-
-        curMemLimit = int((minMemLimit + maxMemLimit) / 2)
-
-        # Make new evaluations
-        curEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=maxTimeLimit, memoryLimit=curMemLimit, language=language)
-
-        # Check if evaluation was successful or failed
-        if curEval['failed']:
-            minMemLimit = curMemLimit + 1
-            print('!', end='', flush=True)
-        else:
-            maxMemLimit = curMemLimit
-            print('.', end='', flush=True)
-    print(' done.')
+    # Evaluate once with generous limits; the limits can usually be derived
+    # from the time and memory used
+    if taskEval['failed']:
+        print("Evaluation with generous limits...")
+        usageEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=maxTimeLimit, memoryLimit=maxMemLimit, language=language)
+    else:
+        usageEval = taskEval
+    derivedLimits = deriveLimits(usageEval, minTimeLimit, maxTimeLimit, minMemLimit, maxMemLimit)
+    if derivedLimits:
+        (derivedTimeLimit, derivedMemLimit) = derivedLimits
+        print("Checking limits derived from the usage: time %dms, memory %dKb..." % derivedLimits)
+        finalEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=derivedTimeLimit, memoryLimit=derivedMemLimit, language=language)
+        if not finalEval['failed']:
+            print("Done.")
+            return makeLimitsResults(derivedTimeLimit, derivedMemLimit, finalEval)
+        print("Solutions failed with the derived limits, searching instead.")
+
+    # Time and memory used, if they could be measured, are good guesses
+    timeGuess = usageEval['maxTime'] if usageEval['maxTime'] > 0 else None
+    memGuess = usageEval['maxMem'] if usageEval['maxMem'] > 0 else None
+
+    # Both limits are searched at the same time, each with a generous value
+    # for the other limit
+    print("Finding time and memory limits...")
+    searchPool = ThreadPoolExecutor(max_workers=2)
+    timeSearch = searchPool.submit(searchLimit,
+        lambda l: not tryMultipleEvaluations(taskPath, solutionList, timeLimit=l, memoryLimit=maxMemLimit, language=language)['failed'],
+        minTimeLimit, maxTimeLimit, timeGuess, 'Time limit')
+    memSearch = searchPool.submit(searchLimit,
+        lambda l: not tryMultipleEvaluations(taskPath, solutionList, timeLimit=maxTimeLimit, memoryLimit=l, language=language)['failed'],
+        minMemLimit, maxMemLimit, memGuess, 'Memory limit')
+    maxTimeLimit = timeSearch.result()
+    maxMemLimit = memSearch.result()
+    searchPool.shutdown()
+    print("Done.")
 
     # Last evaluation to get the maxTime and maxMem
-    finalEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=maxTimeLimit, memoryLimit=maxMemLimit)
+    finalEval = tryMultipleEvaluations(taskPath, solutionList, timeLimit=maxTimeLimit, memoryLimit=maxMemLimit, language=language)
 
-    return {
-        'maxTimeLimit': maxTimeLimit,
-        'maxMemLimit': maxMemLimit,
-        'maxTime': finalEval['maxTime'],
-        'maxMem': finalEval['maxMem']
-        }
+    return makeLimitsResults(maxTimeLimit, maxMemLimit, finalEval)
 
 def configLang(reference, lang):
     """Find the limit transformations to apply globally for the specified
-    language."""
+    language. Returns the coefficients of the time and memory
+    transformations, or None if they are not increasing."""
     progsPath = os.path.join(SELFDIR, 'programs/')
 
     timeList = []
@@ -187,19 +308,75 @@ def configLang(reference, lang):
         print("* Evaluating '%s' for language '%s'" % (solution['name'], lang))
         results = findLimits(progsPath, [os.path.join(progsPath, solution['name'])], language=lang)
         print("Time: %dms (ref: %dms) / Memory: %dKb (ref: %dKb)" % (
-            results['maxTimeLimit'], solution['time'],
-            results['maxMemLimit'], solution['memory']))
+            results['maxRealTimeLimit'], solution['time'],
+            results['maxRealMemLimit'], solution['memory']))
 
-        timeList.append((solution['time'], results['maxTimeLimit']))
-        memList.append((solution['memory'], results['maxMemLimit']))
+        # We compare with the limits actually used by the taskgrader, so that
+        # transformations already configured don't alter the results
+        timeList.append((solution['time'], results['maxRealTimeLimit']))
+        memList.append((solution['memory'], results['maxRealMemLimit']))
 
     timeA, timeB = linearRegression(timeList)
     memA, memB = linearRegression(memList)
+    timeA, memA = round(timeA, 5), round(memA, 5)
     print("""
 Results for language '%s':
 Time transformation: lambda x: %s * x + %d
 Memory transformation: lambda x: %s * x + %d
-""" % (lang, round(timeA, 5), timeB, round(memA, 5), memB))
+""" % (lang, timeA, timeB, memA, memB))
+
+    # The transformations must be increasing, the time transformation being
+    # inverted by the taskgrader
+    if timeA <= 0 or memA <= 0:
+        print("Error: transformations for language '%s' are not increasing, not using them." % lang)
+        return None
+
+    return {'time': [timeA, timeB], 'memory': [memA, memB]}
+
+
+def loadCalibration(modulePath):
+    """Load the calibration data from a transformations module previously
+    written by writeTransformsModule."""
+    moduleVars = {}
+    try:
+        exec(open(modulePath, 'r').read(), moduleVars)
+        return moduleVars['CALIBRATION']
+    except:
+        return {}
+
+
+def writeTransformsModule(modulePath, calibration):
+    """Write the transformations module for the taskgrader, from the
+    calibration data (coefficients for each language)."""
+    # Each language is also set for its aliases
+    allCalibration = {}
+    for lang in calibration:
+        for name in [lang] + CFG_LANG_ALIASES.get(lang, []):
+            allCalibration[name] = calibration[lang]
+
+    moduleFile = open(modulePath, 'w')
+    moduleFile.write("""# -*- coding: utf-8 -*-
+
+# Limit transformations calibrated by tools/autoLimit/autoLimit.py on host
+# `%s`, %s.
+# This file is generated, run `autoLimit.py config` again instead of editing
+# it; transformations set in config.py take precedence.
+
+# Coefficients (a, b) of the transformations x -> a * x + b for each language
+CALIBRATION = %s
+
+CFG_TRANSFORM_TIME = {}
+CFG_TRANSFORM_MEM = {}
+for (lang, coefs) in CALIBRATION.items():
+    (timeA, timeB) = coefs['time']
+    (memA, memB) = coefs['memory']
+    CFG_TRANSFORM_TIME[lang] = (
+        lambda x, a=timeA, b=timeB: int(a * x + b),
+        lambda x, a=timeA, b=timeB: int((x - b) / a))
+    CFG_TRANSFORM_MEM[lang] = (lambda x, a=memA, b=memB: int(a * x + b))
+""" % (platform.node(), time.strftime('%Y-%m-%d %H:%M:%S'),
+       json.dumps(allCalibration, sort_keys=True, indent=4)))
+    moduleFile.close()
 
 
 ### Actions
@@ -211,13 +388,30 @@ def config(args):
         if args.lang not in reference:
             print("Error: language '%s' has no reference limits." % args.lang)
             return 1
-        configLang(reference, args.lang)
-        return 0
+        langs = [args.lang]
+    else:
+        # We do all languages
+        langs = sorted(reference.keys())
+
+    calibration = {}
+    failedLangs = []
+    for lang in langs:
+        coefs = configLang(reference, lang)
+        if coefs:
+            calibration[lang] = coefs
+        else:
+            failedLangs.append(lang)
 
-    # We do all languages
-    for lang in reference:
-        configLang(reference, lang)
+    if not args.dry_run and calibration:
+        # Keep the previous calibration of the other languages
+        newCalibration = loadCalibration(args.output)
+        newCalibration.update(calibration)
+        writeTransformsModule(args.output, newCalibration)
+        print("Transformations written to `%s`." % args.output)
 
+    if failedLangs:
+        print("Error: no transformations found for language(s) %s." % ', '.join(failedLangs))
+        return 1
     return 0
 
 
@@ -259,6 +453,8 @@ if __name__ == '__main__':
         Find the limits for the reference task and solution, to determine which
         transformation functions should be set in taskgrader's configuration.""")
     configParser.add_argument('-l', '--lang', help='Only determine for this language')
+    configParser.add_argument('-o', '--output', help='Transformations module to write (default: %(default)s)', default=CFG_TRANSFORMS_MODULE)
+    configParser.add_argument('-n', '--dry-run', help='Only display the transformations, do not write them', action='store_true')
 
     taskParser = subparsers.add_parser('task', help='Find limits for a task', description="""
         Find good time and memory limits for a task, testing on which limits
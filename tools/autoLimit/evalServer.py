@@ -0,0 +1,62 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 France-IOI, MIT license
+#
+# http://opensource.org/licenses/MIT
+
+# This companion tool to autoLimit.py evaluates solutions against tasks with
+# the taskgrader, in-process. It reads one request per line on stdin, and
+# writes one taskgrader report per line on stdout, so that the same process
+# evaluates a solution with all the limits tried.
+# Each request is a JSON object with the keys taskPath, solution, and
+# optionally timeLimit, memoryLimit and language.
+
+
+import json, logging, os, sys, traceback
+
+SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+
+# genStdTaskJson and the taskgrader both have config and config_default
+# modules; each one needs to import its own
+sys.path.insert(0, os.path.join(SELFDIR, '../stdGrade'))
+from genStdTaskJson import genStdTaskJson
+sys.path.pop(0)
+for module in ['config', 'config_default']:
+    del sys.modules[module]
+
+sys.path.insert(0, os.path.join(SELFDIR, '../..'))
+import taskgrader
+
+
+def evaluate(request):
+    """Evaluate a solution as asked by request, returning the taskgrader
+    report."""
+    cmdExecParams = {}
+    if request.get('timeLimit') is not None:
+        cmdExecParams['timeLimitMs'] = request['timeLimit']
+    if request.get('memoryLimit') is not None:
+        cmdExecParams['memoryLimitKb'] = request['memoryLimit']
+
+    evalJson = genStdTaskJson(request['taskPath'], request['solution'],
+        cmdExecParams, request.get('language'))
+    return taskgrader.evaluation(evalJson)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=getattr(logging, taskgrader.CFG_LOGLEVEL, logging.CRITICAL),
+        format='%(asctime)s - evalServer - %(levelname)s - %(message)s')
+
+    # Keep stdout for the reports, the programs launched by the taskgrader
+    # write to stderr instead
+    reportsFile = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    for line in iter(sys.stdin.readline, ''):
+        try:
+            report = evaluate(json.loads(line))
+        except:
+            traceback.print_exc()
+            report = {'error': traceback.format_exc()}
+        reportsFile.write(json.dumps(report) + '\n')
+        reportsFile.flush()
@@ -20,6 +20,8 @@ CFG_TASKGRADER = os.path.join(CFG_TASKGRADERDIR, 'taskgrader.py')
 CFG_IGNORE_PATHS = ['.git', '.svn']
 # Timeout for test execution of components
 CFG_EXEC_TIMEOUT = 60
+# Number of tasks, or correctSolutions of a task, tested at the same time
+CFG_JOBS = 4
 
 # Languages to generate defaultParams for
 CFG_LANGUAGES = ['ada', 'c', 'cpp', 'cpp11', 'cplex', 'java', 'java8', 'javascool', 'ocaml', 'pascal', 'python', 'sh', 'shell']
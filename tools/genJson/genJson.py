@@ -6,8 +6,9 @@
 # http://opensource.org/licenses/MIT
 
 
-import argparse, fnmatch, glob, json, os, re, shutil, signal, sys, subprocess
-import tempfile, time
+import argparse, fnmatch, glob, hashlib, json, os, re, shutil, signal, sys
+import subprocess, tempfile, time
+from multiprocessing.pool import ThreadPool
 from config_default import *
 from config import *
 
@@ -69,6 +70,14 @@ def getScript(path):
             'content': f.read().decode('utf-8')}
 
 
+def getTaskgraderModule(path):
+    """Return the fileDescr of a module of the taskgrader, used by a default
+    script."""
+    f = open(os.path.join(CFG_TASKGRADERDIR, path), 'rb')
+    return {'name': os.path.basename(path),
+            'content': f.read().decode('utf-8')}
+
+
 def getTaskFile(path):
     """Return the fileDescr of a file in the task.
     path must be the relative path to the task."""
@@ -376,7 +385,7 @@ def genDefaultParams(taskPath, taskSettings):
         defChecker = {
             'compilationDescr': {'language': 'python2',
                 'files': [getScript('defaultChecker.py')],
-                'dependencies': []},
+                'dependencies': [getTaskgraderModule('output_diff.py')]},
             'compilationExecution': '@defaultToolCompParams',
             'runExecution': '@defaultToolExecParams'}
 
@@ -441,6 +450,62 @@ def genDefaultParams(taskPath, taskSettings):
     return defaultParams
 
 
+def getAutoTestHash(taskPath, defaultParams, correctSolutions):
+    """Compute the hash of the inputs of the auto-test of a task: its
+    defaultParams, its files and its correctSolutions."""
+    md5 = hashlib.md5()
+    md5.update(json.dumps(defaultParams, sort_keys=True))
+
+    filePaths = map(lambda f: os.path.join(taskPath, f), sorted(getFileList(taskPath)))
+    for cs in correctSolutions:
+        md5.update(json.dumps(cs, sort_keys=True))
+        filePaths.append(cs['path'].replace('$TASK_PATH', taskPath))
+
+    for filePath in filePaths:
+        # defaultParams.json is being generated
+        if filePath == os.path.join(taskPath, 'defaultParams.json'):
+            continue
+        md5.update(filePath)
+        try:
+            f = open(filePath, 'rb')
+        except:
+            continue
+        for chunk in iter(lambda: f.read(65536), ''):
+            md5.update(chunk)
+        f.close()
+
+    return md5.hexdigest()
+
+
+def saveDefaultParams(path, defaultParams):
+    """Save the defaultParams of the task in path."""
+    json.dump(defaultParams, open(os.path.join(path, 'defaultParams.json'), 'w'))
+
+
+def evaluateCorrectSolution(path, cs):
+    """Evaluate a correctSolution against the task in path, returning its path,
+    the test evaluation JSON made by genStdTaskJson and the taskgrader
+    output."""
+    # Call stdGrade to generate the evaluation
+    csPath = os.path.join(cs['path'].replace('$TASK_PATH', path))
+    cmd = [os.path.join(SELFDIR, '../stdGrade/genStdTaskJson.py'),
+        '-p', path]
+    if cs.has_key('language'):
+        cmd.extend(['-l', cs['language']])
+    cmd.append(csPath)
+    genStd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    (genStdOut, genStdErr) = genStd.communicate()
+
+    try:
+        testEvaluation = json.loads(genStdOut)
+    except:
+        return (csPath, genStdOut, None)
+
+    proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    (procOut, procErr) = proc.communicate(json.dumps(testEvaluation))
+    return (csPath, genStdOut, procOut)
+
+
 def processPath(path, args):
     """Process a task path, generating defaultParams for it and performing an
     auto-test with the taskgrader."""
@@ -454,15 +519,29 @@ def processPath(path, args):
     except:
         pass
 
+    # Hash of the inputs of the last successful auto-test
+    try:
+        oldAutoTestHash = json.load(open(os.path.join(path, 'defaultParams.json'), 'r'))['autoTestHash']
+    except:
+        oldAutoTestHash = None
+
     # Generate and save defaultParams
     defaultParams = genDefaultParams(path, taskSettings)
-    json.dump(defaultParams, open(os.path.join(path, 'defaultParams.json'), 'w'))
+    autoTestHash = getAutoTestHash(path, defaultParams, taskSettings.get('correctSolutions', []))
+    saveDefaultParams(path, defaultParams)
     print ''
     if args.verbose:
         print 'Generated defaultParams:'
         print json.dumps(defaultParams)
         print ''
 
+    # Skip the auto-test if nothing changed since the last successful one
+    if autoTestHash == oldAutoTestHash and not args.force:
+        print '* Task unchanged since the last successful auto-test, skipping it.'
+        defaultParams['autoTestHash'] = autoTestHash
+        saveDefaultParams(path, defaultParams)
+        return 0
+
     taskPath = os.path.relpath(path, CFG_ROOTDIR)
 
     # Make test evaluation
@@ -480,33 +559,25 @@ def processPath(path, args):
         # checker executions
         nbTests, nbSan, nbSol, nbCheck = 0, 0, 0, 0
 
-        # Do an evaluation for each correctSolution
-        for cs in correctSolutions:
-            curError = False
+        # Do an evaluation for each correctSolution, at the same time
+        pool = ThreadPool(args.jobs)
+        csResults = pool.map(lambda cs: evaluateCorrectSolution(path, cs), correctSolutions)
+        pool.close()
 
-            # Call stdGrade to generate the evaluation
-            csPath = os.path.join(cs['path'].replace('$TASK_PATH', path))
-            cmd = [os.path.join(SELFDIR, '../stdGrade/genStdTaskJson.py'),
-                '-p', path]
-            if cs.has_key('language'):
-                cmd.extend(['-l', cs['language']])
-            cmd.append(csPath)
-            genStd = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            (genStdOut, genStdErr) = genStd.communicate()
+        # Check the results in order
+        for (cs, (csPath, genStdOut, procOut)) in zip(correctSolutions, csResults):
+            curError = False
 
             if args.verbose:
                 print ''
                 print 'Generated test evaluation for correctSolution %s:' % csPath
                 print genStdOut
                 print ''
-            try:
-                testEvaluation = json.loads(genStdOut)
-            except:
+            if procOut is None:
                 print "Error: couldn't generate test evaluation for correctSolution `%s`." % csPath
+                cError = True
                 continue
 
-            proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-            (procOut, procErr) = proc.communicate(json.dumps(testEvaluation))
             if args.verbose:
                 print ''
                 print 'Test evaluation report:'
@@ -618,9 +689,9 @@ def processPath(path, args):
             cError = True
 
         if cError:
-            tasksWithErrors.append(path)
-        else:
-            print "Test successful on %d correctSolutions with up to %d test cases." % (len(taskSettings['correctSolutions']), maxNbTotal)
+            return 2
+
+        print "Test successful on %d correctSolutions with up to %d test cases." % (len(taskSettings['correctSolutions']), maxNbTotal)
 
     else:
         # No correctSolutions, we use a dummy solution (true.sh)
@@ -690,12 +761,36 @@ def processPath(path, args):
             print '%d test cases not validated by sanitizer' % (nbTests - nbSan)
         if nbCheck < nbSol:
             print 'Checker failed on %d tests' % (nbSol - nbCheck)
+        if nbSan < nbTests or nbCheck < nbSol:
+            return 0
+
+    # The auto-test was successful, it won't be done again until the task
+    # changes
+    defaultParams['autoTestHash'] = autoTestHash
+    saveDefaultParams(path, defaultParams)
+    return 0
+
+
+def processPathProcess(path, args):
+    """Process a task path in a separate genJson process, returning its exit
+    code and its output."""
+    cmd = [os.path.abspath(__file__), '-j', '1']
+    if args.force:
+        cmd.append('-f')
+    if args.verbose:
+        cmd.append('-v')
+    cmd.append(path)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    (procOut, procErr) = proc.communicate()
+    return (proc.returncode, procOut)
 
 
 if __name__ == '__main__':
     # Parse command-line arguments
     argParser = argparse.ArgumentParser(description="Generate the defaultParams.json for tasks in FOLDERs.")
 
+    argParser.add_argument('-f', '--force', help='Do the auto-test even if the task is unchanged since the last successful auto-test', action='store_true')
+    argParser.add_argument('-j', '--jobs', help='Number of tasks, or correctSolutions of a task, tested at the same time (default: %(default)d)', type=int, default=CFG_JOBS)
     argParser.add_argument('-r', '--recursive', help='Searches recursively for tasks in FOLDER(s)', action='store_true')
     argParser.add_argument('-v', '--verbose', help='Be more verbose', action='store_true')
     argParser.add_argument('-V', '--version', help='Print current version and exit', action='store_true')
@@ -749,14 +844,33 @@ if __name__ == '__main__':
 
     fatalErrors = 0
     tasksWithErrors = []
+    retCodes = {}
+
+    if len(paths) > 1 and args.jobs > 1:
+        # Process tasks at the same time, each in its own genJson process;
+        # the output of each task is displayed in order, once it's done
+        pool = ThreadPool(args.jobs)
+        for (path, (retCode, output)) in zip(paths, pool.imap(lambda p: processPathProcess(p, args), paths)):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            retCodes[path] = retCode
+        pool.close()
+    else:
+        for path in paths:
+            retCodes[path] = processPath(path, args)
 
     for path in paths:
-        retCode = processPath(path, args)
-        if retCode > 0:
+        if retCodes[path] > 0:
             tasksWithErrors.append(path)
-            if retCode == 1:
+            if retCodes[path] == 1:
                 fatalErrors += 1
 
+    if len(paths) > 1:
+        print ''
+        print '*** Summary:'
+        for path in paths:
+            print '%s: %s' % (path, {0: 'success', 1: 'fatal error'}.get(retCodes[path], 'errors'))
+
     if len(tasksWithErrors) > 0:
         print ''
         if len(tasksWithErrors) == 1:
@@ -7,45 +7,24 @@
 
 import argparse, json, os, sys
 
+SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(SELFDIR, '../'))
+from taskgrader import preprocessJson
+
+
+def bundleFileDescr(data):
+    """Bundle the file referenced by a fileDescr into its content."""
+    if data.has_key('name') and data.has_key('path') and data['path'] != '':
+        data['content'] = open(data.pop('path'), 'rb').read().decode('utf-8')
+    return data
+
+
 def recStandalone(data, varData):
-    """Recursion part for makeStandaloneJson.
+    """Replace the variables in data with preprocessJson, bundling the files
+    referenced by path.
     varData is the variables data."""
+    return preprocessJson(data, varData, dictHook=bundleFileDescr)
 
-    if (type(data) is str or type(data) is unicode) and len(data) > 0:
-        if data[0] == '@':
-            # It's a variable, we replace it with the JSON data
-            # It will return an error if the variable doesn't exist, it's intended
-            return recStandalone(varData[data[1:]], varData)
-        elif '$' in data:
-            if '$BUILD_PATH' in data:
-                return recStandalone(data.replace('$BUILD_PATH', varData['BUILD_PATH']), varData)
-            elif '$ROOT_PATH' in data:
-                return recStandalone(data.replace('$ROOT_PATH', varData['ROOT_PATH']), varData)
-            elif '$TASK_PATH' in data:
-                return recStandalone(data.replace('$TASK_PATH', varData['TASK_PATH']), varData)
-            else:
-                return data
-        else:
-            return data
-    elif type(data) is dict:
-        # It's a dict, we process the values in it
-        newdata = {}
-        for k in data.keys():
-            newdata[k] = recStandalone(data[k], varData)
-        # Is it a fileDescr?
-        if newdata.has_key('name') and newdata.has_key('path') and newdata['path'] != '':
-            newdata['content'] = open(newdata.pop('path'), 'rb').read().decode('utf-8')
-        return newdata
-    elif type(data) is list:
-        # It's a list, we filter the values in it
-        newdata = map(lambda x: recStandalone(x, varData), data)
-        # We remove None values, which are probably undefined variables
-        while None in newdata:
-            newdata.remove(None)
-        return newdata
-    else:
-        return data
-    
 
 def makeStandaloneJson(data):
     """Makes a 'standalone' JSON file, bundling files referenced by path into
@@ -98,7 +77,7 @@ if __name__ == '__main__':
             except:
                 raise Exception("File `%s` does not contain valid JSON data." % f)
             stdData = makeStandaloneJson(data)
-            json.dump(newdata, open(f, 'w'))
+            json.dump(stdData, open(f, 'w'))
             
     else:
         try:
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016 France-IOI, MIT license
+#
+# http://opensource.org/licenses/MIT
+
+# This tool is a minimal graderqueue, to test the remoteGrader locally: it
+# answers the requests of the graderqueue API used by the remoteGrader, and
+# evaluates the jobs with the local taskgrader.
+
+
+import argparse, json, os, queue, subprocess, sys, threading, urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
+
+CFG_TASKGRADER = os.path.normpath(os.path.join(SELFDIR, '../../taskgrader.py'))
+
+
+class MockGraderqueue(object):
+    """Jobs of the mock graderqueue."""
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.jobs = {}
+        self.jobsLock = threading.Lock()
+        self.jobsQueue = queue.Queue()
+
+    def sendJob(self, request):
+        with self.jobsLock:
+            jobid = len(self.jobs) + 1
+            self.jobs[jobid] = {'status': 'queued', 'jobname': request.get('jobname', ''), 'resultdata': None}
+        self.jobsQueue.put((jobid, request['jobdata']))
+        return {'errorcode': 0, 'jobid': jobid}
+
+    def getJob(self, request):
+        with self.jobsLock:
+            job = self.jobs.get(int(request['jobid']))
+            if job is None:
+                return {'errorcode': 3, 'errormsg': 'Job not found.'}
+            if job['resultdata'] is not None:
+                return {'errorcode': 0, 'origin': 'done', 'data': {'resultdata': job['resultdata']}}
+            return {'errorcode': 0, 'origin': 'queue', 'data': {'status': job['status']}}
+
+    def answer(self, fields):
+        """Answer a request to the API."""
+        if self.username is not None and (fields.get('rUsername') != self.username
+                or fields.get('rPassword') != self.password):
+            return {'errorcode': 1, 'errormsg': 'Authentication failed.'}
+
+        try:
+            request = json.loads(fields['rRequest'])
+        except:
+            return {'errorcode': 2, 'errormsg': 'Invalid request.'}
+
+        if request.get('request') == 'test':
+            return {'errorcode': 0, 'errormsg': 'Mock graderqueue is working.'}
+        elif request.get('request') == 'sendjob':
+            return self.sendJob(request)
+        elif request.get('request') == 'getjob':
+            return self.getJob(request)
+        else:
+            return {'errorcode': 2, 'errormsg': "Unknown request '%s'." % request.get('request')}
+
+    def work(self):
+        """Evaluate the jobs of the queue with the local taskgrader."""
+        while True:
+            (jobid, jobdata) = self.jobsQueue.get()
+            with self.jobsLock:
+                self.jobs[jobid]['status'] = 'sent'
+
+            proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, universal_newlines=True)
+            (procOut, procErr) = proc.communicate(input=jobdata)
+            try:
+                result = json.loads(procOut)
+            except:
+                result = None
+
+            with self.jobsLock:
+                self.jobs[jobid]['resultdata'] = json.dumps({'jobdata': result})
+
+
+def makeHandler(graderqueue):
+    """Make the HTTP request handler for graderqueue."""
+    class MockHandler(BaseHTTPRequestHandler):
+        # Keep connections alive, as the real graderqueue
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            fields = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode('ascii')))
+            body = json.dumps(graderqueue.answer(fields)).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Minimal graderqueue evaluating jobs with the local taskgrader, to test the remoteGrader.")
+    argParser.add_argument('-j', '--jobs', help="Number of jobs evaluated at the same time (default: %(default)d)", type=int, default=1)
+    argParser.add_argument('-p', '--port', help="Port to listen on (default: %(default)d)", type=int, default=8001)
+    argParser.add_argument('-u', '--username', help="Username expected in requests (default: any)")
+    argParser.add_argument('-w', '--password', help="Password expected in requests", default='')
+    args = argParser.parse_args()
+
+    graderqueue = MockGraderqueue(args.username, args.password)
+    for i in range(args.jobs):
+        worker = threading.Thread(target=graderqueue.work)
+        worker.daemon = True
+        worker.start()
+
+    server = ThreadingHTTPServer(('localhost', args.port), makeHandler(graderqueue))
+    sys.stderr.write("Mock graderqueue listening on http://localhost:%d/\n" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
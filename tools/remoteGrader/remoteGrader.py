@@ -5,7 +5,9 @@
 #
 # http://opensource.org/licenses/MIT
 
-import argparse, json, sys, time, urllib.request, urllib.parse
+import argparse, http.client, json, sys, threading, time, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from remote_config_default import *
 from remote_config import *
 
 def printErr(msg):
@@ -13,6 +15,27 @@ def printErr(msg):
     sys.stderr.write(msg)
     sys.stderr.flush()
 
+# HTTP connection to the graderqueue of each thread, kept open between requests
+CONNECTIONS = threading.local()
+
+def getConnection():
+    """Get the HTTP connection to the graderqueue for the current thread."""
+    if getattr(CONNECTIONS, 'conn', None) is None:
+        url = urllib.parse.urlsplit(CFG_API)
+        if url.scheme == 'https':
+            CONNECTIONS.conn = http.client.HTTPSConnection(url.hostname, url.port, timeout=CFG_HTTP_TIMEOUT)
+        else:
+            CONNECTIONS.conn = http.client.HTTPConnection(url.hostname, url.port, timeout=CFG_HTTP_TIMEOUT)
+        # Whether the connection was kept alive after a previous request
+        CONNECTIONS.reused = False
+    return CONNECTIONS.conn
+
+def closeConnection():
+    """Close the HTTP connection of the current thread."""
+    if getattr(CONNECTIONS, 'conn', None) is not None:
+        CONNECTIONS.conn.close()
+        CONNECTIONS.conn = None
+
 def apiRequest(request):
     """Make a request to the API."""
     postdata = urllib.parse.urlencode({
@@ -20,8 +43,31 @@ def apiRequest(request):
         'rUsername': CFG_USERNAME,
         'rPassword': CFG_PASSWORD
         })
-    post = urllib.request.urlopen(CFG_API, postdata.encode('ascii'))
-    resp = post.read().decode('utf-8')
+    url = urllib.parse.urlsplit(CFG_API)
+    path = url.path or '/'
+    if url.query:
+        path += '?' + url.query
+
+    while True:
+        conn = getConnection()
+        reused = CONNECTIONS.reused
+        try:
+            conn.request('POST', path, postdata.encode('ascii'),
+                {'Content-Type': 'application/x-www-form-urlencoded'})
+            resp = conn.getresponse().read().decode('utf-8')
+            CONNECTIONS.reused = True
+            break
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # The server closes the kept-alive connections after some time
+            # without requests; the request didn't reach it, we retry once
+            # with a new connection. Other errors, such as timeouts, are not
+            # retried, as the request may have been handled.
+            closeConnection()
+            if not reused:
+                raise
+        except:
+            closeConnection()
+            raise
     try:
         resp = json.loads(resp)
     except:
@@ -86,6 +132,7 @@ def getJobLoop(jobid, display=False, exit=False):
     start_time = time.time()
 
     isSent = False
+    interval = CFG_POLL_INTERVAL
 
     while time.time() - start_time < CFG_TIMEOUT:
         if display:
@@ -107,9 +154,11 @@ def getJobLoop(jobid, display=False, exit=False):
                 isSent = True
                 # We refresh the timer
                 start_time = time.time()
+                interval = CFG_POLL_INTERVAL
         except:
             pass
-        time.sleep(1)
+        time.sleep(interval)
+        interval = min(interval * 2, CFG_POLL_MAX_INTERVAL)
 
     if display:
         printErr("\n")
@@ -147,6 +196,92 @@ def gradeJob(inputJson, revision=None):
     return json.loads(jobReq['data']['resultdata'])['jobdata']
 
 
+# Requests of batch mode are sent by this pool, each thread keeping its
+# connection to the graderqueue
+REQUESTS_POOL = ThreadPoolExecutor(max_workers=CFG_JOBS)
+
+def getJobsLoop(jobids):
+    """Wait for completion of multiple jobs at once, returns the last answer
+    for each job. Jobs still pending are fetched concurrently, less often each
+    time no job changed status."""
+    def getJobOrNone(jobid):
+        # We ignore errors, they can be temporary
+        try:
+            return getJob(jobid)
+        except:
+            return None
+
+    jobReqs = {}
+    # Time from which the timeout of each pending job is counted
+    pending = {}
+    for jobid in jobids:
+        pending[jobid] = time.time()
+    sent = set()
+    interval = CFG_POLL_INTERVAL
+
+    while len(pending) > 0:
+        printErr('.')
+        pendingIds = list(pending.keys())
+        changed = False
+        for (jobid, jobReq) in zip(pendingIds, REQUESTS_POOL.map(getJobOrNone, pendingIds)):
+            if jobReq is not None:
+                jobReqs[jobid] = jobReq
+            try:
+                if jobReq['origin'] == 'done':
+                    del pending[jobid]
+                    changed = True
+                    continue
+
+                if jobid not in sent and jobReq['data']['status'] == 'sent':
+                    sent.add(jobid)
+                    pending[jobid] = time.time()
+                    changed = True
+            except:
+                pass
+
+            if time.time() - pending[jobid] >= CFG_TIMEOUT:
+                del pending[jobid]
+
+        if len(pending) > 0:
+            interval = CFG_POLL_INTERVAL if changed else min(interval * 2, CFG_POLL_MAX_INTERVAL)
+            time.sleep(interval)
+    printErr("\n")
+
+    return jobReqs
+
+
+def gradeJobs(inputJsons, revision=None):
+    """Send multiple jobs at once and fetch their results. Returns the list
+    of results, None for each job which couldn't be evaluated."""
+    printErr("Sending %d jobs...\n" % len(inputJsons))
+    sendReqs = list(REQUESTS_POOL.map(lambda j: sendJob(j, revision=revision), inputJsons))
+
+    jobids = []
+    for sendReq in sendReqs:
+        if checkApiOk(sendReq):
+            jobids.append(int(sendReq['jobid']))
+        else:
+            displayApiError(sendReq, request='sendjob')
+            jobids.append(None)
+
+    printErr("Waiting for evaluations")
+    jobReqs = getJobsLoop(filter(lambda jobid: jobid is not None, jobids))
+
+    results = []
+    for jobid in jobids:
+        if jobid is None:
+            results.append(None)
+            continue
+        jobReq = jobReqs.get(jobid, {})
+        if jobReq.get('origin', None) == 'done':
+            results.append(json.loads(jobReq['data']['resultdata'])['jobdata'])
+        else:
+            printErr("Job #%d wasn't evaluated, use the option '-g %d' to try again fetching results.\n" % (jobid, jobid))
+            results.append(None)
+
+    return results
+
+
 def testAuth():
     """Test the authentication."""
     req = apiRequest({'request': 'test'})
@@ -160,10 +295,11 @@ def testAuth():
 
 if __name__ == '__main__':
     argParser = argparse.ArgumentParser(description="Launches an evaluation with a remote taskgrader through the graderqueue.")
+    argParser.add_argument('-b', '--batch', help="Send all FILEs at once, output a JSON object with the results for each FILE", action='store_true')
     argParser.add_argument('-g', '--getjob', help="Try again to fetch results of ID", action='store', metavar='ID', type=int)
     argParser.add_argument('-r', '--revision', help="Tell the queue which task revision is needed", action='store', metavar='REV')
     argParser.add_argument('-t', '--test', help="Test connection to the graderqueue", action='store_true')
-    argParser.add_argument('file', metavar='FILE', nargs='?', help='Input JSON file.', default='')
+    argParser.add_argument('file', metavar='FILE', nargs='*', help='Input JSON file.')
     args = argParser.parse_args()
 
     if not (CFG_API and CFG_USERNAME and CFG_PASSWORD):
@@ -185,12 +321,28 @@ if __name__ == '__main__':
         json.dump(resultdata, sys.stdout)
         sys.exit(0)
 
+    # Send all files at once
+    if args.batch:
+        inputJsons = []
+        for path in args.file:
+            try:
+                inputJsons.append(json.load(open(path, 'r')))
+            except:
+                raise Exception("File `%s` does not contain valid JSON data." % path)
+
+        results = gradeJobs(inputJsons, revision=args.revision)
+        json.dump(dict(zip(args.file, results)), sys.stdout)
+        sys.exit(1 if None in results else 0)
+
+    if len(args.file) > 1:
+        argParser.error("Use the option '-b' to send multiple files.")
+
     # If no file is given, we load from stdin
     if args.file:
         try:
-            inputJson = json.load(open(args.file, 'r'))
+            inputJson = json.load(open(args.file[0], 'r'))
         except:
-            raise Exception("File `%s` does not contain valid JSON data." % args.file)
+            raise Exception("File `%s` does not contain valid JSON data." % args.file[0])
     else:
         try:
             inputJson = json.load(sys.stdin)
@@ -16,3 +16,11 @@ CFG_USERNAME = ""
 CFG_PASSWORD = ""
 # Timeout for an evaluation
 CFG_TIMEOUT = 20
+# Number of requests sent at the same time in batch mode
+CFG_JOBS = 8
+# Interval between two requests for the status of the jobs, in seconds; the
+# interval is doubled each time no job changed status, up to the maximum
+CFG_POLL_INTERVAL = 0.5
+CFG_POLL_MAX_INTERVAL = 8
+# Timeout of each HTTP request, in seconds
+CFG_HTTP_TIMEOUT = 30
@@ -8,11 +8,14 @@
 # This tool select a minimal set of tests finding errors in each solution.
 
 
-import argparse, glob, json, os, shutil, subprocess, sys
+import argparse, glob, heapq, json, os, shutil, subprocess, sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 SELFDIR = os.path.normpath(os.path.dirname(os.path.abspath(__file__)))
 
 CFG_TASKGRADER = os.path.join(SELFDIR, '../../', 'taskgrader.py')
+CFG_JOBS = 4 # Default number of solutions evaluated at the same time
+CFG_EXACT_MAX_CASES = 64 # Maximum number of candidates for the exact cover
 
 
 def checkData(args, data):
@@ -66,12 +69,16 @@ def loadData(args):
 
 def saveData(args, data):
     """Save testSelect data to the task."""
+    dataPath = os.path.join(args.taskpath, 'testSelect.json')
     try:
+        # Write to a temporary file first, so that an interruption doesn't
+        # leave incomplete data
         json.dump(
             data,
-            open(os.path.join(args.taskpath, 'testSelect.json'), 'w'),
+            open(dataPath + '.tmp', 'w'),
             indent=2,
             sort_keys=True)
+        os.replace(dataPath + '.tmp', dataPath)
     except:
         print("Error saving testSelect data.")
         return 1
@@ -92,7 +99,7 @@ def makeEvaluationJson(taskPath, solution, casesToTest):
         'solutionFilename': solution['name'],
         }
     if solution.get('path', None):
-        extraParams['solutionPath'] = os.path.abspath(os.path.join(args.taskpath, solution['path']))
+        extraParams['solutionPath'] = os.path.abspath(os.path.join(taskPath, solution['path']))
     else:
         extraParams['solutionContent'] = solution['content']
 
@@ -106,7 +113,7 @@ def makeEvaluationJson(taskPath, solution, casesToTest):
         newCase = {'name': ncName}
 
         if case.get('path', None):
-            newCase['path'] = os.path.abspath(case['path'])
+            newCase['path'] = os.path.abspath(os.path.join(taskPath, case['path']))
         else:
             newCase['content'] = case['content']
 
@@ -137,39 +144,107 @@ def getComplexity(case, taskPath):
     return len(data)
 
 
+def bitCount(bits):
+    """Count the number of bits set in bits."""
+    return bin(bits).count('1')
+
+
+def makeCoverBits(coveringSet, coverTable, coveredSet):
+    """Make the coverage matrix as bitsets: returns the list of elements of
+    coveredSet, and for each case of coveringSet, the bitset of the elements
+    it covers (bit i being the i-th element)."""
+    elements = sorted(coveredSet)
+    elemBits = {}
+    for i, elem in enumerate(elements):
+        elemBits[elem] = 1 << i
+
+    caseBits = []
+    for case in coveringSet:
+        bits = 0
+        for elem in coverTable[case]:
+            bits |= elemBits.get(elem, 0)
+        caseBits.append(bits)
+
+    return (elements, caseBits)
+
+
 def greedyCover(coveringSet, coverTable, caseCompl, coveredSet):
     """Find an approximation of the smallest set cover (greedy algorithm)."""
-    # Copy variables to avoid side effects
-    curSet = coveredSet.copy()
-    remCases = coveringSet[:]
-    curCov = {}
-    for case in coveringSet:
-        curCov[case] = coverTable[case].copy()
+    (elements, caseBits) = makeCoverBits(coveringSet, coverTable, coveredSet)
+    remBits = (1 << len(elements)) - 1
+
+    # Priority queue of the cases, by number of remaining elements covered,
+    # then complexity, then last case first; the numbers of elements are
+    # only updated when a case reaches the top of the queue, as they can only
+    # decrease
+    caseQueue = []
+    for i, case in enumerate(coveringSet):
+        heapq.heappush(caseQueue, (-bitCount(caseBits[i]), -caseCompl[case], -i))
 
     selectedCases = []
-    while len(curSet) > 0:
-        # Find the case covering the largest number of remaining solutions
-        maxElems = 0
-        caseCandidates = []
-        for case in remCases:
-            if len(curCov[case]) > maxElems:
-                maxElems = len(curCov[case])
-                caseCandidates = [case]
-            elif len(curCov[case]) == maxElems:
-                caseCandidates.append(case)
-        selCase = sorted(caseCandidates, key=lambda c: caseCompl[c])[-1]
+    while remBits and caseQueue:
+        (negGain, negCompl, negIdx) = heapq.heappop(caseQueue)
+        gain = bitCount(caseBits[-negIdx] & remBits)
+        if gain == 0:
+            continue
+        elif gain < -negGain:
+            # Outdated number of elements, put the case back
+            heapq.heappush(caseQueue, (-gain, negCompl, negIdx))
+            continue
 
         # Select this case
-        selectedCases.append(selCase)
-        # Compute new sets, excluding elements already covered
-        curSet = curSet - curCov[selCase]
-        remCases.remove(selCase)
-        for case in remCases:
-            curCov[case] = curCov[case] - curCov[selCase]
+        selectedCases.append(coveringSet[-negIdx])
+        remBits &= ~caseBits[-negIdx]
 
     return (len(selectedCases), sum(map(lambda c: caseCompl[c], selectedCases)), selectedCases)
 
 
+def exactCover(coveringSet, coverTable, caseCompl, coveredSet):
+    """Find the smallest set cover (branch and bound), with the largest
+    complexity between the smallest covers, like greedyCover. Only usable
+    with small numbers of cases."""
+    (elements, caseBits) = makeCoverBits(coveringSet, coverTable, coveredSet)
+    allBits = (1 << len(elements)) - 1
+
+    # Cases covering each element
+    elemCases = []
+    for i in range(len(elements)):
+        elemCases.append([c for c in range(len(coveringSet)) if caseBits[c] & (1 << i)])
+
+    # The greedy cover is the first bound
+    (number, totalCompl, selected) = greedyCover(coveringSet, coverTable, caseCompl, coveredSet)
+    best = {'key': (number, -totalCompl), 'cases': selected}
+
+    def search(remBits, chosen, compl):
+        if not remBits:
+            if (len(chosen), -compl) < best['key']:
+                best['key'] = (len(chosen), -compl)
+                best['cases'] = [coveringSet[c] for c in chosen]
+            return
+        if len(chosen) >= best['key'][0]:
+            return
+
+        # Branch on the remaining element covered by the fewest cases
+        elem = min([i for i in range(len(elements)) if remBits & (1 << i)],
+            key=lambda i: len(elemCases[i]))
+        for c in elemCases[elem]:
+            search(remBits & ~caseBits[c], chosen + [c], compl + caseCompl[coveringSet[c]])
+
+    search(allBits, [], 0)
+
+    return (best['key'][0], -best['key'][1], best['cases'])
+
+
+def findCover(coveringSet, coverTable, caseCompl, coveredSet, exact=False):
+    """Find the smallest set cover, exactly if exact is True and there are
+    few enough cases, else with the greedy algorithm."""
+    if exact:
+        if len(coveringSet) <= CFG_EXACT_MAX_CASES:
+            return exactCover(coveringSet, coverTable, caseCompl, coveredSet)
+        print("Warning: too many candidates (%d) for an exact cover, using the greedy algorithm." % len(coveringSet))
+    return greedyCover(coveringSet, coverTable, caseCompl, coveredSet)
+
+
 def makeHtmlTable(coverage, solutionsList, testCasesList):
     """Generate the table for coverage of solutions by testCases."""
 
@@ -400,10 +475,64 @@ def addtest(args):
     return 0
 
 
+def evaluateSolution(taskPath, solution, casesToTest):
+    """Evaluate solution against casesToTest with the taskgrader. Returns the
+    taskgrader output JSON, or None if the evaluation failed."""
+    evaluationJson = makeEvaluationJson(taskPath, solution, casesToTest)
+    proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    procOut, procErr = proc.communicate(input=json.dumps(evaluationJson))
+
+    # Handle some errors
+    if proc.returncode > 0:
+        print("Error: Taskgrader exited with return code %d for solution %s, output:" % (proc.returncode, solution['name']))
+        print(procOut)
+        print(procErr)
+        print("Ignoring results.")
+        return None
+
+    try:
+        return json.loads(procOut)
+    except:
+        print("Error: Taskgrader returned invalid JSON data for solution %s, output:" % solution['name'])
+        print(procOut)
+        print(procErr)
+        print("Ignoring results.")
+        return None
+
+
+def readCoverage(resultJson, casesToTest, solCov):
+    """Read the coverage of a solution from the taskgrader output JSON into
+    solCov."""
+    # Note : the modification of these variables will modify the variable
+    # 'data' (as they are pointers to values inside 'data')
+    for report in resultJson['executions'][0]['testsReports']:
+        testName = report['name']
+        if testName[:3] != 'ts-':
+            print("Warning: ignoring test %s, wasn't sent by testSelect." % testName)
+            continue
+        testName = "%s.in" % testName[3:]
+        case = casesToTest[testName]
+        if report['sanitizer']['exitCode'] != 0:
+            print("Test %s was not validated by sanitizer, disabling usage..." % testName)
+            case['enabled'] = False
+            continue
+        elif report['execution']['exitCode'] != 0:
+            if report['execution']['wasKilled']:
+                solCov[testName] = 'timeout'
+            else:
+                solCov[testName] = 'error'
+        elif report['checker']['stdout']['data'].split()[0] == '100':
+            solCov[testName] = 'success'
+        else:
+            solCov[testName] = 'badgrade'
+
+
 def compute(args):
     """Check which test cases find which errors in which test cases."""
     data = loadData(args)
 
+    # List the cases to test with each solution
+    toEvaluate = []
     for solution in data['solutions']:
         if solution['name'] not in data['coverage']:
             data['coverage'][solution['name']] = {}
@@ -414,57 +543,42 @@ def compute(args):
         for case in data['testCases']:
             if case.get('enabled', True) and (case['name'] not in solCov):
                 casesToTest[case['name']] = case
-        if len(casesToTest) == 0:
-            continue
+        if len(casesToTest) > 0:
+            toEvaluate.append((solution, casesToTest))
 
-        # Execute taskgrader
-        print("Testing %d cases with solution %s..." % (len(casesToTest), solution['name']))
-        evaluationJson = makeEvaluationJson(args.taskpath, solution, casesToTest)
-        proc = subprocess.Popen([CFG_TASKGRADER], stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
-        procOut, procErr = proc.communicate(input=json.dumps(evaluationJson))
-
-        # Handle some errors
-        if proc.returncode > 0:
-            print("Error: Taskgrader exited with return code %d, output:" % proc.returncode)
-            print(procOut)
-            print(procErr)
-            print("Ignoring results.")
-            continue
+    if len(toEvaluate) == 0:
+        print("Coverage is already computed for all solutions.")
+        return 0
 
-        try:
-            resultJson = json.loads(procOut)
-        except:
-            print("Error: Taskgrader returned invalid JSON data, output:")
-            print(procOut)
-            print(procErr)
-            print("Ignoring results.")
-            continue
+    # Evaluate the solutions concurrently; the coverage is saved after each
+    # solution, so that an interrupted computation resumes where it stopped
+    pool = ThreadPoolExecutor(max_workers=args.jobs)
+    futures = {}
+    for (solution, casesToTest) in toEvaluate:
+        print("Testing %d cases with solution %s..." % (len(casesToTest), solution['name']))
+        futures[pool.submit(evaluateSolution, args.taskpath, solution, casesToTest)] = (solution, casesToTest)
 
-        # Read test reports
-        # Note : the modification of these variables will modify the variable
-        # 'data' (as they are pointers to values inside 'data')
-        for report in resultJson['executions'][0]['testsReports']:
-            testName = report['name']
-            if testName[:3] != 'ts-':
-                print("Warning: ignoring test %s, wasn't sent by testSelect." % testName)
-                continue
-            testName = "%s.in" % testName[3:]
-            case = casesToTest[testName]
-            if report['sanitizer']['exitCode'] != 0:
-                print("Test %s was not validated by sanitizer, disabling usage..." % testName)
-                case['enabled'] = False
+    nbDone = 0
+    try:
+        for future in as_completed(futures):
+            (solution, casesToTest) = futures[future]
+            nbDone += 1
+            resultJson = future.result()
+            if resultJson is None:
                 continue
-            elif report['execution']['exitCode'] != 0:
-                if report['execution']['wasKilled']:
-                    solCov[testName] = 'timeout'
-                else:
-                    solCov[testName] = 'error'
-            elif report['checker']['stdout']['data'].split()[0] == '100':
-                solCov[testName] = 'success'
-            else:
-                solCov[testName] = 'badgrade'
 
-    saveData(args, data)
+            readCoverage(resultJson, casesToTest, data['coverage'][solution['name']])
+            saveData(args, data)
+            print("[%d/%d] Solution %s tested." % (nbDone, len(toEvaluate), solution['name']))
+    except KeyboardInterrupt:
+        print("Interrupted, run compute again to resume.")
+        for future in futures:
+            future.cancel()
+        return 1
+    finally:
+        pool.shutdown()
+
+    return saveData(args, data)
 
 
 def select(args):
@@ -528,7 +642,7 @@ def select(args):
             solCompl[sol['name']] = getComplexity(sol, args.taskpath)
 
         # Find the smallest set of solutions
-        number, totalCompl, selected = greedyCover(solutions, allSolCov, solCompl, set(testCases))
+        number, totalCompl, selected = findCover(solutions, allSolCov, solCompl, set(testCases), args.exact)
 
         print("Best selection found for %d tests: %d solutions, complexity %d." % (len(testCases), number, totalCompl))
         selected.sort()
@@ -541,7 +655,7 @@ def select(args):
                 testCompl[case['name']] = getComplexity(case, args.taskpath)
 
         # Find the smallest set of test cases
-        number, totalCompl, selected = greedyCover(testCases, testCov, testCompl, set(solutions))
+        number, totalCompl, selected = findCover(testCases, testCov, testCompl, set(solutions), args.exact)
 
         print("Best selection found for %d solutions: %d tests, complexity %d." % (len(solutions), number, totalCompl))
         selected.sort()
@@ -785,7 +899,9 @@ if __name__ == '__main__':
 
     computeParser = subparsers.add_parser('compute', help='Check solutions against test cases', description="""
         Check all solutions against all test cases from the pool (except if
-        already checked).""")
+        already checked). The coverage is saved after each solution, running
+        compute again resumes an interrupted computation.""")
+    computeParser.add_argument('-j', '--jobs', help='Number of solutions evaluated at the same time (default: %(default)d)', type=int, default=CFG_JOBS)
     computeParser.add_argument('-t', '--taskpath', help='Task path', default='.')
 
     exportParser = subparsers.add_parser('export', help='Export selected test cases into the task', description="""
@@ -807,6 +923,7 @@ if __name__ == '__main__':
     selectParser = subparsers.add_parser('select', help='Select the best test cases', description="""
         Find the smallest number of test cases necessary to cover all solution
         errors.""")
+    selectParser.add_argument('-e', '--exact', help='Find the smallest selection exactly, for up to %d candidates' % CFG_EXACT_MAX_CASES, action='store_true')
     selectParser.add_argument('-s', '--solutions', help='Select solutions instead of test cases', action='store_true')
     selectParser.add_argument('-t', '--taskpath', help='Task path', default='.')
 